@@ -0,0 +1 @@
+__author__ = 'neoinsanity'
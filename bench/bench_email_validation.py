@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Benchmark of the EmailWindmill request decode and validation path.
+
+The stdlib json decoder with the schematics EmailRequest model is compared
+against the ujson decoder with the precompiled ModelValidator, over a set of
+email requests with realistic message sizes and recipient counts. The
+benchmark reports the per request cost of each path.
+
+Example invocation from the repository root:
+    python -m bench.bench_email_validation --requests 20000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from windmills.email_windmill import EmailRequest, ModelValidator, json_loads
+
+
+__author__ = 'neoinsanity'
+
+
+def gen_requests(count, seed=7):
+    """
+    Generate email request json strings, with a msg of 200 bytes to 20KB and
+    1 to 20 recipients.
+
+    >>> requests = gen_requests(3)
+    >>> len(requests)
+    3
+    >>> sorted(json.loads(requests[0])['payload'].keys())
+    [u'msg', u'sender', u'subject', u'to']
+    """
+    rand = random.Random(seed)
+    requests = []
+    for count in xrange(count):
+        payload = {
+            'msg': 'Share and enjoy. ' * rand.randint(12, 1200),
+            'sender': 'notifications@filepicker.io',
+            'subject': 'Notification %d for your account' % count,
+            'to': ['user%d@filepicker.io' % rand.randint(0, 100000)
+                   for _ in range(rand.randint(1, 20))]}
+        requests.append(json.dumps({'type': 'email_request',
+                                    'id': count,
+                                    'payload': payload}))
+    return requests
+
+
+def schematics_path(request_json):
+    payload = json.loads(request_json)['payload']
+    EmailRequest(**payload).validate(validate_all=True)
+
+
+def make_fast_path():
+    validate = ModelValidator(EmailRequest).validate
+
+    def fast_path(request_json):
+        validate(json_loads(request_json)['payload'])
+
+    return fast_path
+
+
+def measure(path, requests, rounds):
+    """
+    Return: the best per request time in seconds over the given rounds.
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.time()
+        for request_json in requests:
+            path(request_json)
+        elapsed = (time.time() - start) / len(requests)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('--requests', type=int, default=10000,
+                            help='The number of email requests per round.')
+    arg_parser.add_argument('--rounds', type=int, default=3,
+                            help='The number of rounds, the best is reported.')
+    args = arg_parser.parse_args(argv)
+
+    requests = gen_requests(args.requests)
+
+    slow = measure(schematics_path, requests, args.rounds)
+    fast = measure(make_fast_path(), requests, args.rounds)
+
+    print ('requests=%d rounds=%d' % (args.requests, args.rounds))
+    print ('json + schematics: %.1fus/request' % (slow * 1e6))
+    print ('ujson + precompiled: %.1fus/request' % (fast * 1e6))
+    print ('speedup: %.1fx' % (slow / fast))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Benchmark of the RouterDealerWindmill request/reply path.
+
+N REQ clients, each in its own process, drive requests through a
+RouterDealerWindmill broker to M EchoService workers. The benchmark reports
+the aggregate request rate along with the p50 and p99 round trip latency.
+
+Example invocation from the repository root:
+    python -m bench.bench_router_dealer --clients 8 --workers 4 --engine proxy
+"""
+import argparse
+import sys
+import time
+from multiprocessing import Pool
+from threading import Thread
+from windmills import EchoService, RouterDealerWindmill
+from zmq import Context, REQ
+
+
+__author__ = 'neoinsanity'
+
+
+def percentile(sorted_values, fraction):
+    """
+    Return the value at the given fraction of a sorted list of values.
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.5)
+    5
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 0.99)
+    9
+    """
+    if not sorted_values:
+        return 0
+    index = int(fraction * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def run_client(args):
+    """
+    Issue a number of requests on a REQ socket in lock step.
+
+    Return: a list of the round trip latencies in seconds.
+    """
+    router_url, requests, size = args
+
+    ctx = Context()
+    sock = ctx.socket(REQ)
+    sock.connect(router_url)
+
+    payload = 'x' * size
+    latencies = []
+    for _ in xrange(requests):
+        start = time.time()
+        sock.send(payload)
+        sock.recv()
+        latencies.append(time.time() - start)
+
+    sock.close()
+    ctx.term()
+
+    return latencies
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('--clients', type=int, default=4,
+                            help='The number of REQ client processes.')
+    arg_parser.add_argument('--workers', type=int, default=2,
+                            help='The number of EchoService workers.')
+    arg_parser.add_argument('--requests', type=int, default=10000,
+                            help='The number of requests sent per client.')
+    arg_parser.add_argument('--size', type=int, default=64,
+                            help='The request payload size in bytes.')
+    arg_parser.add_argument('--engine', default='poll',
+                            choices=['poll', 'proxy'],
+                            help='The RouterDealerWindmill engine.')
+    arg_parser.add_argument('--router_port', type=int, default=8888)
+    arg_parser.add_argument('--dealer_port', type=int, default=8889)
+    args = arg_parser.parse_args(argv)
+
+    # the client processes are forked prior to the creation of any context
+    client_pool = Pool(args.clients)
+
+    router_url = 'tcp://localhost:%d' % args.router_port
+    broker = RouterDealerWindmill(argv=[
+        '--router_sock_url', 'tcp://*:%d' % args.router_port,
+        '--dealer_sock_url', 'tcp://*:%d' % args.dealer_port,
+        '--engine', args.engine])
+    workers = [EchoService(argv=[
+        '--reply_sock_url', 'tcp://localhost:%d' % args.dealer_port,
+        '--name', 'echo-%d' % count]) for count in range(args.workers)]
+
+    threads = [Thread(target=windmill.run) for windmill in [broker] + workers]
+    for t in threads:
+        t.start()
+    time.sleep(1) # allow the workers to connect to the broker
+
+    try:
+        start = time.time()
+        results = client_pool.map(
+            run_client,
+            [(router_url, args.requests, args.size)] * args.clients)
+        elapsed = time.time() - start
+
+        # report within the try, so a failed run raises its own error
+        latencies = sorted(latency for result in results for latency in result)
+        print ('engine=%s clients=%d workers=%d size=%d requests=%d' %
+               (args.engine, args.clients, args.workers, args.size,
+                len(latencies)))
+        print ('%.0f req/s p50=%.1fus p99=%.1fus' %
+               (len(latencies) / elapsed,
+                percentile(latencies, 0.50) * 1e6,
+                percentile(latencies, 0.99) * 1e6))
+    finally:
+        client_pool.close()
+        for windmill in [broker] + workers:
+            windmill.kill()
+        for t in threads:
+            t.join(3)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
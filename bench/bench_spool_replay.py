@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Benchmark of the replay of a Spool across a restart.
+
+A spool is filled with a number of entries, closed, and reopened, after which
+the entries are replayed the way the EmailWindmill delivery scheduler does,
+by alternate calls to due() and next_due() in batches. The benchmark reports
+the time to append the entries and the time to replay them, for each of the
+given spool sizes, so that the growth of the replay cost can be compared
+against the growth of the append cost.
+
+Example invocation from the repository root:
+    python -m bench.bench_spool_replay --entries 10000 50000 --batch 100
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from windmills.lib import Spool
+
+
+__author__ = 'neoinsanity'
+
+
+def fill(spool_dir, entries, size=512):
+    """
+    Append the given number of entries to a new spool.
+
+    Return: the seconds taken to append the entries.
+    """
+    payload = 'x' * size
+    spool = Spool(spool_dir)
+    start = time.time()
+    for _ in xrange(entries):
+        spool.append(payload)
+    elapsed = time.time() - start
+    spool.close()
+    return elapsed
+
+
+def replay(spool_dir, batch):
+    """
+    Reopen a spool and complete each entry as it is handed out by due().
+
+    >>> spool_dir = tempfile.mkdtemp()
+    >>> append_time = fill(spool_dir, 250)
+    >>> replayed, elapsed = replay(spool_dir, 100)
+    >>> replayed
+    250
+    >>> shutil.rmtree(spool_dir)
+
+    Return: the number of entries replayed and the seconds taken.
+    """
+    start = time.time()
+    spool = Spool(spool_dir)
+    replayed = 0
+    while True:
+        due = spool.due(limit=batch)
+        spool.next_due()
+        if not due:
+            break
+        for entry_id, payload in due:
+            spool.done(entry_id)
+        replayed += len(due)
+    elapsed = time.time() - start
+    spool.close()
+    return replayed, elapsed
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    arg_parser.add_argument('--entries', type=int, nargs='+',
+                            default=[10000, 50000],
+                            help='The spool sizes to replay.')
+    arg_parser.add_argument('--batch', type=int, default=100,
+                            help='The number of entries per due() call.')
+    args = arg_parser.parse_args(argv)
+
+    for entries in args.entries:
+        spool_dir = tempfile.mkdtemp()
+        try:
+            append_time = fill(spool_dir, entries)
+            replayed, replay_time = replay(spool_dir, args.batch)
+        finally:
+            shutil.rmtree(spool_dir)
+        print ('entries=%d append=%.2fs replay=%.2fs' %
+               (replayed, append_time, replay_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
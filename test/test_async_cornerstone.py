@@ -0,0 +1,149 @@
+from test.test_cornerstone import kill_cornerstone
+from test.windmill_test_case import WindmillTestCase
+from threading import Event, Thread
+import time
+import unittest
+from windmills.lib.async_cornerstone import AsyncCornerstone, gevent
+from zmq import Context, PULL, PUSH
+
+
+__author__ = 'neoinsanity'
+
+
+class SlowForwarder(AsyncCornerstone):
+    """An AsyncCornerstone with a handler that waits on I/O before it
+    forwards a message, a stand in for a call to a slow server."""
+    def __init__(self, **kwargs):
+        self.input_recv_handler = self._slow_recv_handler
+
+        AsyncCornerstone.__init__(self, **kwargs)
+
+
+    def configure(self, args=None):
+        in_sock = self.zmq_ctx.socket(PULL)
+        in_sock.bind('tcp://*:6693')
+        self.register_input_sock(in_sock)
+        out_sock = self.zmq_ctx.socket(PUSH)
+        out_sock.bind('tcp://*:6694')
+        self.register_output_sock(out_sock)
+
+
+    def _slow_recv_handler(self, sock):
+        msg = sock.recv()
+        gevent.sleep(0.3)
+        self.send(msg)
+        return msg
+
+
+class YieldingSocket(object):
+    """A socket that yields between the frames of a multipart send, as a
+    zmq.green socket does when a send would block."""
+    def __init__(self):
+        self.frames = list()
+
+    def send_multipart(self, frames, flags=0, copy=True):
+        for frame in frames:
+            self.frames.append(frame)
+            gevent.sleep(0)
+
+
+@unittest.skipIf(gevent is None, 'The gevent package is not installed.')
+class TestAsyncCornerstone(WindmillTestCase):
+    def setUp(self):
+        self.zmq_ctx = Context()
+
+
+    def tearDown(self):
+        self.zmq_ctx.term()
+
+
+    def test_async_cornerstone_concurrent_handlers(self):
+        t = self._thread_wrap_forwarder(argv=['--concurrency', '20'])
+        push_sock = self.zmq_ctx.socket(PUSH)
+        push_sock.connect('tcp://localhost:6693')
+        pull_sock = self.zmq_ctx.socket(PULL)
+        pull_sock.connect('tcp://localhost:6694')
+
+        try:
+            t.start()
+            self.assertTrue(t.ready.wait(3))
+            msgs = ['msg-%d' % i for i in range(20)]
+            start = time.time()
+            for msg in msgs:
+                push_sock.send(msg)
+            received = [pull_sock.recv() for _ in msgs]
+
+            self.assertEqual(sorted(msgs), sorted(received))
+            # the 20 handlers wait concurrently, rather than one at a time
+            self.assertTrue(time.time() - start < 1.5)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive())
+            push_sock.close(linger=0)
+            pull_sock.close(linger=0)
+
+
+    def test_async_cornerstone_concurrency_limit(self):
+        t = self._thread_wrap_forwarder(argv=['--concurrency', '2'])
+        push_sock = self.zmq_ctx.socket(PUSH)
+        push_sock.connect('tcp://localhost:6693')
+        pull_sock = self.zmq_ctx.socket(PULL)
+        pull_sock.connect('tcp://localhost:6694')
+
+        try:
+            t.start()
+            self.assertTrue(t.ready.wait(3))
+            start = time.time()
+            for i in range(6):
+                push_sock.send('msg-%d' % i)
+            for _ in range(6):
+                pull_sock.recv()
+
+            # 6 messages, 2 at a time, take 3 rounds of the handler
+            self.assertTrue(time.time() - start >= 0.9)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive())
+            push_sock.close(linger=0)
+            pull_sock.close(linger=0)
+
+
+    def test_async_cornerstone_send_lock(self):
+        foo = AsyncCornerstone()
+        sock = YieldingSocket()
+        msgs = [['envelope-%d' % i, '', 'body-%d' % i] for i in range(10)]
+        gevent.joinall([gevent.spawn(foo._send_frames, sock, msg)
+                        for msg in msgs])
+
+        # the frames of each message are sent together
+        self.assertEqual([frame for msg in msgs for frame in msg], sock.frames)
+
+
+    def test_async_cornerstone_control_kill(self):
+        t = self._thread_wrap_forwarder()
+        t.start()
+        self.assertTrue(t.ready.wait(3))
+        self.assertTrue(t.is_alive())
+
+        kill_cornerstone()
+        t.join(3)
+        self.assertFalse(t.is_alive())
+
+
+    def _thread_wrap_forwarder(self, argv=None):
+        """
+        The sockets of an AsyncCornerstone belong to the thread that creates
+        them, so the forwarder is created by the thread that runs it.
+        """
+        t = Thread()
+        t.ready = Event()
+
+        def target():
+            t.windmill = SlowForwarder(argv=argv)
+            t.ready.set()
+            t.windmill.run()
+
+        t.run = target
+        return t
@@ -0,0 +1,48 @@
+import os
+import tempfile
+from test.windmill_test_case import WindmillTestCase
+from windmills.lib import CaptureReader, CaptureWriter
+from windmills.lib.capture import (FILE_HEADER, FRAME_COUNT, FRAME_LENGTH,
+                                   TIMESTAMP)
+
+
+__author__ = 'neoinsanity'
+
+
+class TestCapture(WindmillTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+
+    def tearDown(self):
+        os.remove(self.path)
+
+
+    def test_capture_truncated_header(self):
+        writer = CaptureWriter(self.path, timestamps=True)
+        writer.write(['first'], timestamp=1.0)
+        writer.write(['envelope', 'payload'], timestamp=2.0)
+        writer.close()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # the offsets within the second record at which the file is cut
+        record = (FILE_HEADER.size + TIMESTAMP.size + FRAME_COUNT.size +
+                  FRAME_LENGTH.size + len('first'))
+        cuts = [record + TIMESTAMP.size / 2,
+                record + TIMESTAMP.size + FRAME_COUNT.size / 2,
+                record + TIMESTAMP.size + FRAME_COUNT.size +
+                FRAME_LENGTH.size / 2,
+                len(data) - 1]
+        for cut in cuts:
+            with open(self.path, 'wb') as f:
+                f.write(data[:cut])
+
+            reader = CaptureReader(self.path)
+            messages = iter(reader)
+            self.assertEqual(['first'],
+                             [str(frame) for frame in next(messages)[1]])
+            self.assertRaisesRegexp(ValueError, 'Truncated capture file',
+                                    next, messages)
+            reader.close()
@@ -1,8 +1,12 @@
+from mock import patch
+from StringIO import StringIO
+from zmq import PULL, PUSH
 import os
 import time
 from test.windmill_test_case import WindmillTestCase
 from test.utils_of_test import (gen_archive_output_pair, thread_wrap_windmill)
 from windmills import CliEmitter
+from windmills.lib import CaptureReader, CaptureWriter
 
 
 __author__ = 'neoinsanity'
@@ -55,6 +59,94 @@ class TestCliEmitter(WindmillTestCase):
                 '--input_sock_url', 'tcp://localhost:6677'])
 
 
+    def test_cli_emitter_stream_option(self):
+        self.executor(
+            test_name='cli_emitter_stream_option',
+            emitter_args=[
+                '-f', 'test_data/inputs/cli_emitter_file_option._input',
+                '--stream', '--lines_per_msg', '2'],
+            listener_args=[
+                '--input_sock_url', 'tcp://localhost:6677'])
+
+
+    def test_cli_emitter_stream_output_policy(self):
+        # the streamed messages are routed by the output policy
+        emitter = CliEmitter(argv=[
+            '-f', 'test_data/inputs/cli_emitter_file_option._input',
+            '--stream', '--output_policy', 'round_robin',
+            '--output_sock_url', 'inproc://stream-route-0'])
+        ctx = emitter.zmq_ctx
+        output_sock = ctx.socket(PUSH)
+        output_sock.bind('inproc://stream-route-1')
+        emitter.add_output_sock(output_sock)
+        pull_socks = list()
+        for index in range(2):
+            pull_sock = ctx.socket(PULL)
+            pull_sock.connect('inproc://stream-route-%d' % index)
+            pull_socks.append(pull_sock)
+
+        try:
+            emitter.run()
+            received = [[str(frame) for frame in pull_sock.recv_multipart()]
+                        for pull_sock in pull_socks
+                        for _ in range(2) if pull_sock.poll(100)]
+        finally:
+            for sock in pull_socks + emitter.output_socks():
+                sock.close(linger=0)
+
+        self.assertEqual([['This is a test message\n'],
+                          ['A Stream of words\n'],
+                          ['It is simply a list of lines\n']], received)
+
+
+    def test_cli_emitter_rate_option(self):
+        # the 3 lines at 10 msg/s are paced over at least 0.2 seconds, in
+        # addition to the 1 second wait at the end of a run
+        start = time.time()
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            self.executor(
+                test_name='cli_emitter_file_option',
+                emitter_args=[
+                    '-f', 'test_data/inputs/cli_emitter_file_option._input',
+                    '--rate', '10', '--burst', '1'],
+                listener_args=[
+                    '--input_sock_url', 'tcp://localhost:6677'])
+        self.assertTrue(time.time() - start >= 2.2)
+        # the achieved rate is reported whatever the log level
+        self.assertRegexpMatches(stderr.getvalue(),
+                                 r'Sent 3 messages in [0-9.]+s, [0-9.]+ msg/s '
+                                 r'of the 10\.0 msg/s rate\.')
+
+
+    def test_cli_emitter_capture_replay(self):
+        capture_file = 'test_out/cli_emitter_capture_replay._capture'
+        output_file = 'test_out/cli_emitter_capture_replay._output'
+
+        messages = [['envelope', '\x00\x01\xff binary'],
+                    ['single line\n'],
+                    ['a', '', 'c']]
+        writer = CaptureWriter(capture_file)
+        for count, frames in enumerate(messages):
+            writer.write(frames, timestamp=100 + 0.2 * count)
+        writer.close()
+
+        emitter = CliEmitter(argv=['-f', capture_file, '--capture',
+                                   '--timing', 'original'])
+        t = thread_wrap_windmill('CliListener', argv=[
+            '-f', output_file, '--capture',
+            '--input_sock_url', 'tcp://localhost:6677'])
+
+        # the replay at the original timing spans 0.4 seconds
+        start = time.time()
+        self.emit_message(emitter, t)
+        self.assertTrue(time.time() - start >= 2.4)
+
+        reader = CaptureReader(output_file)
+        self.assertEqual(messages, [[str(frame) for frame in frames]
+                                    for _, frames in reader])
+        reader.close()
+
+
     def executor(self,
                  test_name=None,
                  emitter_args=None,
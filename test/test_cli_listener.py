@@ -1,4 +1,7 @@
+import glob
+import gzip
 import os
+import shutil
 import time
 from test.utils_of_test import (gen_archive_output_pair,
                                 thread_wrap_windmill)
@@ -29,7 +32,8 @@ class TestCliListener(WindmillTestCase):
 
     def tearDown(self):
         for sock in self.sock_map.values():
-            sock.close()
+            sock.close(linger=0)
+        self.zmq_ctx.term()
 
 
     def test_cli_listener_default_behavior(self):
@@ -76,6 +80,122 @@ class TestCliListener(WindmillTestCase):
         self.assertFiles(archive_file, output_file)
 
 
+    def test_cli_listener_buffered_flush_interval(self):
+        output_file = 'test_out/cli_listener_buffered_flush_interval._output'
+        args = ['-f', output_file,
+                '--buffer_size', '65536', '--flush_interval', '0.2']
+
+        t = thread_wrap_windmill('CliListener', args)
+        try:
+            t.start()
+            for msg in ['one\n', 'two\n', 'three\n']:
+                self.sock_map['PUSH'].send(msg)
+            time.sleep(1)
+
+            # the buffered messages are flushed by the interval, not shutdown
+            with open(output_file) as f:
+                self.assertEqual('one\ntwo\nthree\n', f.read())
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'CliListener instance should have shutdown.')
+
+
+    def test_cli_listener_buffered_size_flush(self):
+        output_file = 'test_out/cli_listener_buffered_size_flush._output'
+        args = ['-f', output_file,
+                '--buffer_size', '16', '--flush_interval', '60']
+
+        t = thread_wrap_windmill('CliListener', args)
+        try:
+            t.start()
+            msgs = ['message %d\n' % count for count in range(4)]
+            for msg in msgs:
+                self.sock_map['PUSH'].send(msg)
+            time.sleep(1)
+
+            # each pair of buffered messages reaches the buffer size, and is
+            # joined into a single write before the flush interval
+            with open(output_file) as f:
+                self.assertEqual(''.join(msgs), f.read())
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'CliListener instance should have shutdown.')
+
+
+    def test_cli_listener_buffered_shutdown_flush(self):
+        output_file = 'test_out/cli_listener_buffered_shutdown_flush._output'
+        args = ['-f', output_file,
+                '--buffer_size', '65536', '--flush_interval', '60']
+
+        self._deliver_the_message('Goodbye, Buffer\n', args)
+
+        with open(output_file) as f:
+            self.assertEqual('Goodbye, Buffer\n', f.read())
+
+
+    def test_cli_listener_rotate_compress(self):
+        d = 'test_out/cli_listener_rotate'
+        if os.path.exists(d):
+            shutil.rmtree(d)
+        os.makedirs(d)
+        output_file = d + '/rotate._output'
+
+        args = ['-f', output_file, '--rotate_bytes', '10', '--compress', 'gzip']
+        msgs = ['message %d\n' % count for count in range(3)]
+        self._deliver_the_messages(msgs, args)
+
+        # each message reached the rotate size, and was compressed
+        rotated = glob.glob(output_file + '.*.gz')
+        self.assertEqual(3, len(rotated))
+        contents = list()
+        for path in rotated:
+            with gzip.open(path) as f:
+                contents.append(f.read())
+        self.assertEqual(msgs, sorted(contents))
+        self.assertEqual(0, os.path.getsize(output_file))
+
+
+    def test_cli_listener_append_option(self):
+        output_file = 'test_out/cli_listener_append_option._output'
+        with open(output_file, 'w') as f:
+            f.write('Hello, Yesterday\n')
+
+        self._deliver_the_message('Goodbye, Yesterday\n',
+                                  ['-f', output_file, '--append'])
+
+        with open(output_file) as f:
+            self.assertEqual('Hello, Yesterday\nGoodbye, Yesterday\n', f.read())
+
+
+    def test_cli_listener_aggregate_option(self):
+        output_file = 'test_out/cli_listener_aggregate_option._output'
+        args = ['-f', output_file, '--aggregate',
+                '--summary_interval', '0.5', '--prefix_length', '3']
+
+        self._deliver_the_messages(['cat people', 'dog nap', 'cat scratch'],
+                                   args)
+
+        with open(output_file) as f:
+            lines = f.readlines()
+        self.assertTrue(len(lines) > 1, 'Summaries should be periodic.')
+        self.assertFalse('people' in ''.join(lines))
+        self.assertTrue('total_msgs=3 total_bytes=28 ' in lines[-1])
+        self.assertEqual(3, sum(int(line.split()[0][len('msgs='):])
+                                for line in lines))
+
+        prefixes = dict()
+        for line in lines:
+            counts = line.split()[-1][len('prefixes={'):-1]
+            for count in filter(None, counts.split(',')):
+                prefix, value = count.split(':')
+                prefixes[prefix] = prefixes.get(prefix, 0) + int(value)
+        self.assertEqual({'cat': 2, 'dog': 1}, prefixes)
+
+
     def _deliver_the_messages(self, msgs=[], args=list(), sock_type='PUSH'):
         t = thread_wrap_windmill('CliListener', args)
         try:
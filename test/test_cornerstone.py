@@ -1,13 +1,22 @@
 from test.windmill_test_case import WindmillTestCase
 from test.utils_of_test import thread_wrap_windmill
-from time import sleep
+from time import sleep, time
 from windmills.lib import Cornerstone
-from zmq import Context, NOBLOCK, PUB
+from zmq import Context, NOBLOCK, PUB, PULL, PUSH
 
 
 __author__ = 'neoinsanity'
 
 
+class SlowTransform(object):
+    """A CPU bound stand in that takes longer for the earlier messages of
+    a key, so that the results of a key would complete out of order."""
+    def __call__(self, frames):
+        key, seq = frames
+        sleep(0.01 * (10 - int(seq)))
+        return [key.upper(), seq]
+
+
 class TestCornerstone(WindmillTestCase):
     def setUp(self):
         pass
@@ -30,6 +39,266 @@ class TestCornerstone(WindmillTestCase):
         assert not t.is_alive()
 
 
+    def test_cornerstone_prompt_kill_on_long_heartbeat(self):
+        t = thread_wrap_windmill('Cornerstone', argv=[
+            '--heartbeat', '30', '--max_heartbeat', '60'])
+        t.start()
+        sleep(0.5)
+        assert t.is_alive()
+
+        t.windmill.kill()
+        t.join(1)
+        assert not t.is_alive()
+
+
+    def test_cornerstone_drain_batch(self):
+        msgs = [['msg-%d' % i] for i in range(20)]
+        received = self._forward_messages(['--drain_batch', '8'], msgs)
+        self.assertEqual(msgs, received)
+
+
+    def test_cornerstone_zero_copy_multipart(self):
+        msgs = [['key-%d' % i, 'x' * (i * 1024)] for i in range(10)]
+        msgs.append(['tiny', '', 'frames'])
+        received = self._forward_messages(
+            ['--zero_copy', '--copy_threshold', '2048'], msgs)
+        self.assertEqual(msgs, received)
+
+
+    def test_cornerstone_multiple_input_fair(self):
+        feeds = {'a': 10, 'b': 10, 'c': 10}
+        received = self._merge_feeds(['--input_policy', 'fair'], feeds)
+        self.assertEqual(30, len(received))
+        for name in feeds:
+            self.assertEqual(['%s-%d' % (name, i) for i in range(10)],
+                             [msg for msg in received
+                              if msg.startswith(name)])
+        # each feed is serviced in turn, rather than one feed at a time
+        self.assertEqual(3, len(set(msg.split('-')[0]
+                                    for msg in received[:3])))
+
+
+    def test_cornerstone_multiple_input_priority(self):
+        feeds = {'low': 10, 'high': 10}
+        received = self._merge_feeds(['--input_policy', 'priority'], feeds,
+                                     priorities={'high': 1})
+        self.assertEqual(['high-%d' % i for i in range(10)], received[:10])
+        self.assertEqual(['low-%d' % i for i in range(10)], received[10:])
+
+
+    def test_cornerstone_multiple_input_weighted(self):
+        feeds = {'light': 12, 'heavy': 12}
+        received = self._merge_feeds(['--input_policy', 'weighted'], feeds,
+                                     weights={'heavy': 3})
+        self.assertEqual(24, len(received))
+        # the heavy feed is drained three times faster than the light feed
+        self.assertEqual(6, len([msg for msg in received[:8]
+                                 if msg.startswith('heavy')]))
+
+
+    def test_cornerstone_multiple_output_broadcast(self):
+        msgs = [['msg-%d' % i] for i in range(5)]
+        received = self._route_messages(['--output_policy', 'broadcast'], msgs)
+        self.assertEqual([msgs] * 3, received)
+
+
+    def test_cornerstone_multiple_output_hash(self):
+        msgs = [['key-%d' % (i % 7), str(i)] for i in range(70)]
+        received = self._route_messages(['--output_policy', 'hash'], msgs)
+        self.assertEqual(70, sum(len(sock_msgs) for sock_msgs in received))
+        # each key is sent to a single socket, in the order of the messages
+        for key in set(msg[0] for msg in msgs):
+            holders = [sock_msgs for sock_msgs in received
+                       if [key] in [msg[:1] for msg in sock_msgs]]
+            self.assertEqual(1, len(holders))
+            self.assertEqual([msg for msg in msgs if msg[0] == key],
+                             [msg for msg in holders[0] if msg[0] == key])
+
+
+    def test_cornerstone_multiple_output_least_queued(self):
+        foo = Cornerstone(argv=['--output_policy', 'least_queued'])
+        ctx = foo.zmq_ctx
+
+        # the first socket has no peer, so it is unable to queue a message
+        stalled_sock = ctx.socket(PUSH)
+        stalled_sock.bind('inproc://least-queued-stalled')
+        foo.add_output_sock(stalled_sock)
+        ready_sock = ctx.socket(PUSH)
+        ready_sock.bind('inproc://least-queued-ready')
+        foo.add_output_sock(ready_sock)
+        pull_sock = ctx.socket(PULL)
+        pull_sock.connect('inproc://least-queued-ready')
+
+        try:
+            for i in range(10):
+                foo.send('msg-%d' % i)
+            self.assertEqual(['msg-%d' % i for i in range(10)],
+                             [pull_sock.recv() for _ in range(10)])
+        finally:
+            for sock in [pull_sock] + foo.output_socks():
+                sock.close(linger=0)
+
+
+    def test_cornerstone_no_output_socks(self):
+        # a message is dropped under every policy when there are no outputs
+        for policy in ['broadcast', 'round_robin', 'hash', 'least_queued']:
+            foo = Cornerstone(argv=['--output_policy', policy])
+            foo._route(['key', 'msg'])
+            foo.send('msg')
+
+            # nor once the last output socket has been removed
+            output_sock = foo.zmq_ctx.socket(PUSH)
+            output_sock.bind('inproc://no-outputs-%s' % policy)
+            foo.add_output_sock(output_sock)
+            foo.remove_output_sock(output_sock)
+            foo._route(['key', 'msg'])
+            self.assertEqual([], foo.output_socks())
+
+
+    def test_cornerstone_executor_keyed_order(self):
+        msgs = [['key-%d' % (i % 2), str(i / 2)] for i in range(20)]
+        received = self._forward_messages(
+            ['--executor', 'thread', '--executor_workers', '8',
+             '--executor_order', 'keyed'], msgs, SlowTransform())
+
+        self.assertEqual(sorted([key.upper(), seq] for key, seq in msgs),
+                         sorted(received))
+        # the results of each key are in the order of the messages
+        for key in set(msg[0] for msg in received):
+            self.assertEqual([str(seq) for seq in range(10)],
+                             [seq for msg_key, seq in received
+                              if msg_key == key])
+
+
+    def test_cornerstone_executor_process_pool(self):
+        msgs = [['key-%d' % i, '0'] for i in range(16)]
+        start = time()
+        received = self._forward_messages(
+            ['--executor', 'process', '--executor_workers', '4',
+             '--executor_inflight', '16'], msgs, SlowTransform())
+
+        self.assertEqual(sorted([key.upper(), seq] for key, seq in msgs),
+                         sorted(received))
+        # the 16 messages of 100ms are handled by 4 workers at once
+        self.assertTrue(time() - start < 1.2)
+
+
+    def _route_messages(self, argv=None, msgs=None):
+        """
+        Forward messages through a Cornerstone with three output sockets,
+        returning the list of the messages received from each output socket.
+        """
+        t = thread_wrap_windmill('Cornerstone', argv=argv)
+        foo = t.windmill
+        ctx = foo.zmq_ctx
+
+        input_sock = ctx.socket(PULL)
+        input_sock.bind('inproc://route-in')
+        foo.register_input_sock(input_sock)
+        pull_socks = list()
+        for index in range(3):
+            output_sock = ctx.socket(PUSH)
+            output_sock.bind('inproc://route-out-%d' % index)
+            foo.add_output_sock(output_sock)
+            pull_sock = ctx.socket(PULL)
+            pull_sock.connect('inproc://route-out-%d' % index)
+            pull_socks.append(pull_sock)
+        push_sock = ctx.socket(PUSH)
+        push_sock.connect('inproc://route-in')
+
+        try:
+            t.start()
+            for msg in msgs:
+                push_sock.send_multipart(msg)
+            sleep(0.5)
+            received = list()
+            for pull_sock in pull_socks:
+                sock_msgs = list()
+                while pull_sock.poll(100):
+                    sock_msgs.append(pull_sock.recv_multipart())
+                received.append(sock_msgs)
+            return received
+        finally:
+            foo.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive())
+            for sock in pull_socks + [push_sock]:
+                sock.close()
+
+
+    def _merge_feeds(self, argv=None, feeds=None, priorities=None,
+                     weights=None):
+        """
+        Forward the messages of several preloaded feeds through a single
+        Cornerstone, returning the messages in the order they were forwarded.
+        """
+        priorities = priorities or dict()
+        weights = weights or dict()
+
+        t = thread_wrap_windmill('Cornerstone', argv=argv)
+        foo = t.windmill
+        ctx = foo.zmq_ctx
+
+        push_socks = list()
+        for name, count in sorted(feeds.items()):
+            input_sock = ctx.socket(PULL)
+            input_sock.bind('inproc://merge-%s' % name)
+            foo.add_input_sock(input_sock, priority=priorities.get(name, 0),
+                               weight=weights.get(name, 1))
+            push_sock = ctx.socket(PUSH)
+            push_sock.connect('inproc://merge-%s' % name)
+            for i in range(count):
+                push_sock.send('%s-%d' % (name, i))
+            push_socks.append(push_sock)
+
+        output_sock = ctx.socket(PUSH)
+        output_sock.bind('inproc://merge-out')
+        foo.register_output_sock(output_sock)
+        pull_sock = ctx.socket(PULL)
+        pull_sock.connect('inproc://merge-out')
+
+        try:
+            t.start()
+            return [pull_sock.recv() for _ in range(sum(feeds.values()))]
+        finally:
+            foo.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive())
+            for sock in push_socks + [pull_sock]:
+                sock.close()
+
+
+    def _forward_messages(self, argv=None, msgs=None, message_handler=None):
+        t = thread_wrap_windmill('Cornerstone', argv=argv)
+        foo = t.windmill
+        foo.message_handler = message_handler
+        ctx = foo.zmq_ctx
+
+        input_sock = ctx.socket(PULL)
+        input_sock.bind('tcp://*:6691')
+        foo.register_input_sock(input_sock)
+        output_sock = ctx.socket(PUSH)
+        output_sock.bind('tcp://*:6692')
+        foo.register_output_sock(output_sock)
+
+        push_sock = ctx.socket(PUSH)
+        push_sock.connect('tcp://localhost:6691')
+        pull_sock = ctx.socket(PULL)
+        pull_sock.connect('tcp://localhost:6692')
+
+        try:
+            t.start()
+            for msg in msgs:
+                push_sock.send_multipart(msg)
+            return [pull_sock.recv_multipart() for _ in msgs]
+        finally:
+            foo.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive())
+            push_sock.close()
+            pull_sock.close()
+
+
 def kill_cornerstone():
     context = Context()
 
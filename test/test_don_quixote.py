@@ -1,8 +1,10 @@
+import os
 import time
 from test.utils_of_test import gen_archive_output_pair
 from test.windmill_test_case import WindmillTestCase
 from threading import Thread
 from windmills.don_quixote import DonQuixote
+from windmills.lib import Cornerstone
 
 
 __author__ = 'neoinsanity'
@@ -70,6 +72,188 @@ class TestDonQuixote(WindmillTestCase):
         self.assertFiles(archive_file, output_file)
 
 
+    def test_don_quixote_inproc(self):
+        archive_file, output_file = gen_archive_output_pair(
+            'don_quixote_inproc')
+
+        don = DonQuixote(
+            blueprints={"blueprints": [
+                {
+                    "service": "cli_emitter",
+                    "args": "-f "
+                            "test_data/inputs/don_quixote_inproc._input"
+                            " --output_sock_url inproc://don_quixote_inproc"
+                },
+                {
+                    "service": "cli_listener",
+                    "args": "-f "
+                            "test_out/don_quixote_inproc._output"
+                            " --input_sock_url inproc://don_quixote_inproc"
+                }
+            ]},
+            disable_keyboard=True)
+        assert don
+        assert don.shared_context
+        for service in don.active_services:
+            assert service.zmq_ctx is don.zmq_ctx
+        zmq_ctx = don.zmq_ctx
+
+        t = Thread(target=don.run)
+        t.start()
+        time.sleep(2)
+        assert t.is_alive()
+        don.kill()
+        t.join(3)
+        assert not t.is_alive()
+
+        # the shared context is terminated once the services have stopped
+        self.assertTrue(zmq_ctx.closed)
+        self.assertEqual(None, don.zmq_ctx)
+
+        self.assertFiles(archive_file, output_file)
+
+
+    def test_don_quixote_process_mode(self):
+        archive_file, output_file = gen_archive_output_pair(
+            'don_quixote_process_mode')
+
+        don = DonQuixote(
+            blueprints={"mode": "process", "blueprints": [
+                {
+                    "service": "cli_emitter",
+                    "args": "-f "
+                            "test_data/inputs/don_quixote_process_mode._input"
+                            " --output_sock_url tcp://*:9981"
+                },
+                {
+                    "service": "cli_listener",
+                    "args": "-f "
+                            "test_out/don_quixote_process_mode._output"
+                            " --input_sock_url tcp://localhost:9981"
+                }
+            ]},
+            disable_keyboard=True)
+        assert don
+        assert don.active_services == []
+
+        t = Thread(target=don.run)
+        t.start()
+        time.sleep(3)
+        assert t.is_alive()
+        don.kill()
+        t.join(5)
+        assert not t.is_alive()
+
+        self.assertFiles(archive_file, output_file)
+
+
+    def test_don_quixote_process_restart(self):
+        archive_file, output_file = gen_archive_output_pair(
+            'don_quixote_process_restart')
+
+        DonQuixote.service_map['crashing_service'] = CrashingService
+        try:
+            don = DonQuixote(
+                blueprints={"blueprints": [
+                    {
+                        "service": "crashing_service",
+                        "args": "--name " + output_file
+                    }
+                ]},
+                disable_keyboard=True,
+                mode='process',
+                max_restarts=2)
+
+            t = Thread(target=don.run)
+            t.start()
+            time.sleep(4)
+            don.kill()
+            t.join(5)
+            assert not t.is_alive()
+        finally:
+            del DonQuixote.service_map['crashing_service']
+
+        # the initial run and the two restarts
+        self.assertFiles(archive_file, output_file)
+
+
+    def test_don_quixote_replicas(self):
+        input_file = 'test_data/inputs/don_quixote_replicas._input'
+        output_files = list()
+        for replica in range(3):
+            # only the removal of stale output is required of the pair
+            output_files.append(gen_archive_output_pair(
+                'don_quixote_replicas_%d' % replica)[1])
+
+        don = DonQuixote(
+            blueprints={"blueprints": [
+                {
+                    "service": "cli_listener",
+                    "replicas": 3,
+                    "args": "-f test_out/don_quixote_replicas_{replica}._output"
+                            " --input_sock_url tcp://localhost:9982"
+                },
+                {
+                    "service": "cli_emitter",
+                    "args": "-f " + input_file +
+                            " --output_sock_url tcp://*:9982"
+                }
+            ]},
+            disable_keyboard=True)
+        names = [service.name for service in don.active_services]
+        self.assertEqual(['CliListener-0', 'CliListener-1',
+                          'CliListener-2', 'CliEmitter'], names)
+
+        t = Thread(target=don.run)
+        t.start()
+        time.sleep(2)
+        don.kill()
+        t.join(3)
+        assert not t.is_alive()
+
+        # the lines are fanned out across the replicas by the PUSH socket
+        lines = list()
+        for output_file in output_files:
+            lines.extend(open(output_file).readlines())
+        self.assertEqual(sorted(open(input_file).readlines()), sorted(lines))
+
+
+    def test_don_quixote_replicas_bind_failure(self):
+        self.assertRaises(ValueError, DonQuixote,
+                          blueprints={"blueprints": [
+                              {
+                                  "service": "cli_emitter",
+                                  "replicas": 2,
+                                  "args": "--output_sock_url tcp://*:9983"
+                              }
+                          ]},
+                          disable_keyboard=True)
+        # the replicas would bind the default output url of the service
+        self.assertRaises(ValueError, DonQuixote,
+                          blueprints={"blueprints": [
+                              {
+                                  "service": "cli_emitter",
+                                  "replicas": 2,
+                                  "args": "-m hello"
+                              }
+                          ]},
+                          disable_keyboard=True)
+
+
+    def test_don_quixote_replicas_pub_sub_failure(self):
+        # each replica of a subscriber would receive every message
+        self.assertRaises(ValueError, DonQuixote,
+                          blueprints={"blueprints": [
+                              {
+                                  "service": "cli_listener",
+                                  "replicas": 2,
+                                  "args": "--input_sock_type SUB "
+                                          "--input_sock_url tcp://localhost:9984"
+                              }
+                          ]},
+                          disable_keyboard=True)
+
+
     def test_don_quixote_blueprint_failure(self):
         # The lack of flie or blueprints argument should raise and exception.
         try:
@@ -82,3 +266,12 @@ class TestDonQuixote(WindmillTestCase):
 
         self.fail("An expected ValueError exception was not captured. Test "
                   "failed.")
+
+
+class CrashingService(Cornerstone):
+    """A service that records each run in the file given as its name, and
+    then exits with a failure."""
+    def run(self):
+        with open(self.name, 'a') as f:
+            f.write('run\n')
+        os._exit(1)
@@ -1,12 +1,42 @@
 import os
+import time
 from test.utils_of_test import thread_wrap_windmill
 from test.windmill_test_case import WindmillTestCase
+from windmills.echo_service import Echo
 from zmq import Context, REQ
 
 
 __author__ = 'neoinsanity'
 
 
+class SlowEcho(Echo):
+    """An Echo that takes a while to reply, a stand in for an RPC."""
+    def __call__(self, body):
+        time.sleep(0.3)
+        return Echo.__call__(self, body)
+
+
+class CountingEcho(Echo):
+    """An Echo that counts the requests it handles."""
+    def __init__(self, message=None):
+        Echo.__init__(self, message=message)
+        self.calls = 0
+
+    def __call__(self, body):
+        self.calls += 1
+        return Echo.__call__(self, body)
+
+
+class FaultyEcho(Echo):
+    """An Echo that fails on a 'bad' request, and has no reply to 'none'."""
+    def __call__(self, body):
+        if body[-1] == 'bad':
+            raise ValueError('bad request')
+        if body[-1] == 'none':
+            return None
+        return Echo.__call__(self, body)
+
+
 class TestEchoService(WindmillTestCase):
     def setUp(self):
         self.zmq_ctx = Context()
@@ -64,3 +94,144 @@ class TestEchoService(WindmillTestCase):
                              'The EchoService instance shold have shutdown.')
 
             req_out_sock.close()
+
+
+    def test_echo_service_cache_option(self):
+        req_out_sock = self.zmq_ctx.socket(REQ)
+        req_out_sock.bind('tcp://*:8879')
+
+        argv = ['--reply_sock_url', 'tcp://localhost:8879',
+                '--cache_bytes', '1024']
+        t = thread_wrap_windmill('EchoService', argv=argv)
+        handler = CountingEcho()
+        t.windmill.message_handler = handler
+        try:
+            t.start()
+            for msg in ['ping', 'pong', 'ping', 'ping']:
+                req_out_sock.send(msg)
+                self.assertEqual(msg, req_out_sock.recv())
+
+            # the repeated requests are replied from the cache
+            self.assertEqual(2, handler.calls)
+            stats = t.windmill._cache.stats()
+            self.assertEqual(2, stats['hits'])
+            self.assertEqual(2, stats['misses'])
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'The EchoService instance should have shutdown.')
+
+            req_out_sock.close()
+
+
+    def test_echo_service_rep_no_result(self):
+        req_out_sock = self.zmq_ctx.socket(REQ)
+        req_out_sock.bind('tcp://*:8869')
+
+        argv = ['--reply_sock_url', 'tcp://localhost:8869']
+        t = thread_wrap_windmill('EchoService', argv=argv)
+        t.windmill.message_handler = FaultyEcho()
+        try:
+            t.start()
+            # a failed or None result is replied empty, so that the REP
+            # socket goes on to serve the next request
+            for msg, reply in [('bad', ''), ('good', 'good'),
+                               ('none', ''), ('good', 'good')]:
+                req_out_sock.send(msg)
+                self.assertTrue(req_out_sock.poll(3000))
+                self.assertEqual(reply, req_out_sock.recv())
+            self.assertTrue(t.is_alive())
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'The EchoService instance should have shutdown.')
+
+            req_out_sock.close()
+
+
+    def test_echo_service_dealer_no_result(self):
+        broker = thread_wrap_windmill('RouterDealerWindmill', argv=[
+            '--router_sock_url', 'tcp://*:8865',
+            '--dealer_sock_url', 'tcp://*:8866'])
+        echo = thread_wrap_windmill('EchoService', argv=[
+            '--reply_sock_url', 'tcp://localhost:8866',
+            '--socket_type', 'DEALER', '--executor', 'thread'])
+        echo.windmill.message_handler = FaultyEcho()
+
+        req_socks = [self.zmq_ctx.socket(REQ) for _ in range(3)]
+        try:
+            broker.start()
+            echo.start()
+            for req_sock in req_socks:
+                req_sock.connect('tcp://localhost:8865')
+            time.sleep(0.5)
+
+            # the failed request is replied empty, the None result is not
+            # replied, and neither holds up the good request
+            for req_sock, msg in zip(req_socks, ['bad', 'none', 'good']):
+                req_sock.send(msg)
+            self.assertTrue(req_socks[0].poll(3000))
+            self.assertEqual('', req_socks[0].recv())
+            self.assertTrue(req_socks[2].poll(3000))
+            self.assertEqual('good', req_socks[2].recv())
+            self.assertFalse(req_socks[1].poll(500))
+            self.assertTrue(echo.is_alive())
+        finally:
+            for t in [echo, broker]:
+                t.windmill.kill()
+                t.join(3)
+                self.assertFalse(t.is_alive(),
+                                 'The %s instance should have shutdown.' %
+                                 t.windmill.name)
+            for req_sock in req_socks:
+                req_sock.close(linger=0)
+
+
+    def test_echo_service_dealer_thread_pool(self):
+        self._concurrent_executor(router_port=8875, dealer_port=8876,
+                                  pool='thread')
+
+
+    def test_echo_service_dealer_process_pool(self):
+        self._concurrent_executor(router_port=8877, dealer_port=8878,
+                                  pool='process')
+
+
+    def _concurrent_executor(self, router_port=None, dealer_port=None,
+                             pool=None):
+        broker = thread_wrap_windmill('RouterDealerWindmill', argv=[
+            '--router_sock_url', 'tcp://*:%d' % router_port,
+            '--dealer_sock_url', 'tcp://*:%d' % dealer_port])
+        echo = thread_wrap_windmill('EchoService', argv=[
+            '--reply_sock_url', 'tcp://localhost:%d' % dealer_port,
+            '--socket_type', 'DEALER', '--executor', pool,
+            '--executor_workers', '4'])
+        echo.windmill.message_handler = SlowEcho()
+
+        req_socks = [self.zmq_ctx.socket(REQ) for _ in range(4)]
+        try:
+            broker.start()
+            echo.start()
+            for req_sock in req_socks:
+                req_sock.connect('tcp://localhost:%d' % router_port)
+            time.sleep(0.5)
+
+            # the 4 requests are in flight at once, rather than in lockstep
+            start = time.time()
+            for count, req_sock in enumerate(req_socks):
+                req_sock.send_multipart(['ping', str(count)])
+            for count, req_sock in enumerate(req_socks):
+                self.assertEqual(['ping', str(count)],
+                                 req_sock.recv_multipart())
+            self.assertTrue(time.time() - start < 1.0)
+        finally:
+            for t in [echo, broker]:
+                t.windmill.kill()
+                t.join(3)
+                self.assertFalse(t.is_alive(),
+                                 'The %s instance should have shutdown.' %
+                                 t.windmill.name)
+            for req_sock in req_socks:
+                req_sock.close()
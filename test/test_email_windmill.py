@@ -1,9 +1,14 @@
 import os
+import shutil
 import time
 from mock import  MagicMock, patch
 from test.windmill_test_case import WindmillTestCase
-from test.utils_of_test import ( thread_wrap_windmill)
-from zmq import Context, PUB, PUSH
+from test.utils_of_test import (SmtpStandIn, thread_wrap_windmill)
+from schematics.base import ModelException
+from windmills.email_windmill import EmailRequest, ModelValidator
+from windmills.lib import Spool
+from zmq import Context, NOBLOCK, PULL, PUB, PUSH, ZMQError
+import json
 
 
 __author__ = 'neoinsanity'
@@ -30,7 +35,198 @@ class TestEmailWindmill(WindmillTestCase):
 
     def tearDown(self):
         for sock in self.sock_map.values():
-            sock.close()
+            sock.close(linger=0)
+        self.zmq_ctx.term()
+
+
+    def test_email_fast_validator_matches_schematics(self):
+        valid = {u'msg': u'Hi', u'sender': u'raul@filepicker.io',
+                 u'subject': u'Hello', u'to': [u'raul@filepicker.io']}
+        edits = [
+            {}, {u'msg': u''}, {u'sender': u''}, {u'subject': u''},
+            {u'msg': None}, {u'to': None}, {u'to': []}, {u'to': u''},
+            {u'to': u'raul@filepicker.io'}, {u'to': [u'x' * 257]},
+            {u'to': [u'\xe9' * 257]}, {u'to': [5]}, {u'to': [None]},
+            {u'to': [u'']}, {u'msg': 5}, {u'sender': [u'raul']},
+            {u'sender': u'x' * 257}, {u'subject': u'\xe9' * 257},
+            {u'msg': u'\u2603 caf\xe9', u'to': [u'\xe9@filepicker.io']},
+            {u'msg': u'', u'sender': None, u'to': [u'x' * 300]}]
+        missing = [u'msg', u'sender', u'subject', u'to']
+
+        fast = ModelValidator(EmailRequest).validate
+
+        def errors(validate, payload):
+            try:
+                validate(payload)
+            except ModelException, e:
+                return [(error.reason, error.field_name,
+                         repr(error.field_value)) for error in e.error_list]
+
+        payloads = [dict(valid, **edit) for edit in edits]
+        for name in missing:
+            payload = dict(valid)
+            del payload[name]
+            payloads.append(payload)
+
+        for payload in payloads:
+            self.assertEqual(
+                errors(lambda p: EmailRequest(**p).validate(validate_all=True),
+                       payload),
+                errors(fast, payload), repr(payload))
+
+
+    def test_email_pooled_delivery(self):
+        smtp_server = SmtpStandIn(port=2525)
+        smtp_server.start()
+
+        args = ['--smtp_host', 'localhost', '--smtp_port', '2525',
+                '--smtp_workers', '2']
+        t = thread_wrap_windmill('EmailWindmill', argv=args)
+        try:
+            t.start()
+            for count in range(6):
+                self.sock_map['PUSH'].send(
+                    '{"type":"email_request","payload":{"msg":"Message %d",'
+                    '"subject":"Pooled delivery","sender":"raul@filepicker.io",'
+                    '"to":["raul@filepicker.io"]}}' % count)
+
+            for attempt in range(50):
+                if len(smtp_server.messages) == 6:
+                    break
+                time.sleep(0.1)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            smtp_server.stop()
+            self.assertFalse(t.is_alive(),
+                             'The EmailWindmill instance should have shut down.')
+
+        self.assertEqual(6, len(smtp_server.messages))
+        self.assertTrue(smtp_server.connections <= 2,
+                        'The SMTP connections should have been reused.')
+
+
+    def test_email_coalesced_delivery(self):
+        smtp_server = SmtpStandIn(port=2526)
+        smtp_server.start()
+        result_sock = self.zmq_ctx.socket(PULL)
+        result_sock.bind('tcp://*:6680')
+
+        args = ['--smtp_host', 'localhost', '--smtp_port', '2526',
+                '--coalesce_count', '3', '--coalesce_window', '5',
+                '--result_sock_url', 'tcp://localhost:6680']
+        t = thread_wrap_windmill('EmailWindmill', argv=args)
+        results = list()
+        try:
+            t.start()
+            for count in range(3):
+                self.sock_map['PUSH'].send(
+                    '{"type":"email_request","id":%d,"payload":{"msg":"News",'
+                    '"subject":"Coalesced delivery","sender":"raul@filepicker.io",'
+                    '"to":["user%d@filepicker.io"]}}' % (count, count))
+
+            for attempt in range(50):
+                try:
+                    results.append(json.loads(result_sock.recv(NOBLOCK)))
+                except ZMQError:
+                    time.sleep(0.1)
+                if len(results) == 3:
+                    break
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            smtp_server.stop()
+            result_sock.close()
+            self.assertFalse(t.is_alive(),
+                             'The EmailWindmill instance should have shut down.')
+
+        self.assertEqual(1, len(smtp_server.messages))
+        self.assertEqual(3, len(smtp_server.messages[0][1]))
+        self.assertEqual([0, 1, 2],
+                         sorted(r['payload']['id'] for r in results))
+        for result in results:
+            self.assertEqual('sent', result['payload']['status'])
+
+
+    def test_email_queue_backpressure(self):
+        smtp_server = SmtpStandIn(port=2527, delay=0.05)
+        smtp_server.start()
+
+        args = ['--smtp_host', 'localhost', '--smtp_port', '2527',
+                '--smtp_workers', '1', '--queue_high_watermark', '2',
+                '--queue_low_watermark', '1']
+        t = thread_wrap_windmill('EmailWindmill', argv=args)
+        paused = False
+        try:
+            t.start()
+            for count in range(10):
+                self.sock_map['PUSH'].send(
+                    '{"type":"email_request","payload":{"msg":"Message %d",'
+                    '"subject":"Backpressure","sender":"raul@filepicker.io",'
+                    '"to":["raul@filepicker.io"]}}' % count)
+
+            for attempt in range(100):
+                paused = paused or t.windmill.input_paused()
+                self.assertTrue(t.windmill.queue_depth() <= 2)
+                if len(smtp_server.messages) == 10:
+                    break
+                time.sleep(0.02)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            smtp_server.stop()
+            self.assertFalse(t.is_alive(),
+                             'The EmailWindmill instance should have shut down.')
+
+        self.assertTrue(paused, 'The input should have been paused.')
+        self.assertEqual(10, len(smtp_server.messages))
+        self.assertFalse(t.windmill.input_paused())
+
+
+    def test_email_spool_retry_across_restart(self):
+        spool_dir = 'test_out/email_spool'
+        if os.path.exists(spool_dir):
+            shutil.rmtree(spool_dir)
+
+        # no SMTP server is listening, so the emails are spooled for retry
+        args = ['--smtp_host', 'localhost', '--smtp_port', '2528',
+                '--spool_dir', spool_dir, '--spool_retry_delay', '0.1']
+        t = thread_wrap_windmill('EmailWindmill', argv=args)
+        try:
+            t.start()
+            for count in range(2):
+                self.sock_map['PUSH'].send(
+                    '{"type":"email_request","payload":{"msg":"Message %d",'
+                    '"subject":"Spooled delivery","sender":"raul@filepicker.io",'
+                    '"to":["raul@filepicker.io"]}}' % count)
+            time.sleep(0.5)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'The EmailWindmill instance should have shut down.')
+
+        # the spooled emails are delivered once the windmill is restarted
+        smtp_server = SmtpStandIn(port=2528)
+        smtp_server.start()
+        t = thread_wrap_windmill('EmailWindmill', argv=args)
+        try:
+            t.start()
+            for attempt in range(50):
+                if len(smtp_server.messages) == 2:
+                    break
+                time.sleep(0.1)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            smtp_server.stop()
+            self.assertFalse(t.is_alive(),
+                             'The EmailWindmill instance should have shut down.')
+
+        self.assertEqual(2, len(smtp_server.messages))
+        spool = Spool(spool_dir)
+        self.assertEqual(0, len(spool))
+        spool.close()
 
 
     @patch('socket.SMTP', autospec=True)
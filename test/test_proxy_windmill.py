@@ -0,0 +1,61 @@
+from test.utils_of_test import thread_wrap_windmill
+from test.windmill_test_case import WindmillTestCase
+from zmq import Context, POLLIN, PUB, SUB, SUBSCRIBE
+
+
+__author__ = 'neoinsanity'
+
+
+class TestProxyWindmill(WindmillTestCase):
+    def setUp(self):
+        self.zmq_ctx = Context()
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_proxy_windmill_poll_engine(self):
+        self._executor(argv=['--input_sock_url', 'tcp://localhost:6661',
+                             '--output_sock_url', 'tcp://*:6662'],
+                       pub_url='tcp://*:6661',
+                       sub_url='tcp://localhost:6662')
+
+
+    def test_proxy_windmill_proxy_engine(self):
+        self._executor(argv=['--input_sock_url', 'tcp://localhost:6663',
+                             '--output_sock_url', 'tcp://*:6664',
+                             '--engine', 'proxy'],
+                       pub_url='tcp://*:6663',
+                       sub_url='tcp://localhost:6664')
+
+
+    def _executor(self, argv=None, pub_url=None, sub_url=None):
+        pub_sock = self.zmq_ctx.socket(PUB)
+        pub_sock.bind(pub_url)
+        sub_sock = self.zmq_ctx.socket(SUB)
+        sub_sock.setsockopt(SUBSCRIBE, '')
+        sub_sock.connect(sub_url)
+
+        t = thread_wrap_windmill('ProxyWindmill', argv=argv)
+        try:
+            t.start()
+            self.assertTrue(t.is_alive(),
+                            'The ProxyWindmill instance should have started.')
+
+            # publish until the subscriptions have propagated through the proxy
+            msg = None
+            for attempt in range(50):
+                pub_sock.send_multipart(['topic', 'payload'])
+                if sub_sock.poll(100, POLLIN):
+                    msg = sub_sock.recv_multipart()
+                    break
+
+            self.assertEqual(['topic', 'payload'], msg)
+        finally:
+            t.windmill.kill()
+            t.join(3)
+            self.assertFalse(t.is_alive(),
+                             'The ProxyWindmill instance should have shutdown.')
+            pub_sock.close()
+            sub_sock.close()
@@ -0,0 +1,51 @@
+from test.utils_of_test import thread_wrap_windmill
+from test.windmill_test_case import WindmillTestCase
+from zmq import Context, REQ
+
+
+__author__ = 'neoinsanity'
+
+
+class TestRouterDealerWindmill(WindmillTestCase):
+    def setUp(self):
+        self.zmq_ctx = Context()
+
+
+    def tearDown(self):
+        pass
+
+
+    def test_router_dealer_poll_engine(self):
+        self._executor(broker_argv=['--router_sock_url', 'tcp://*:8873',
+                                    '--dealer_sock_url', 'tcp://*:8874'])
+
+
+    def test_router_dealer_proxy_engine(self):
+        self._executor(broker_argv=['--router_sock_url', 'tcp://*:8871',
+                                    '--dealer_sock_url', 'tcp://*:8872',
+                                    '--engine', 'proxy'])
+
+
+    def _executor(self, broker_argv=None):
+        broker = thread_wrap_windmill('RouterDealerWindmill', argv=broker_argv)
+        router_port = broker.windmill.router_sock_url.split(':')[-1]
+        dealer_port = broker.windmill.dealer_sock_url.split(':')[-1]
+        echo = thread_wrap_windmill('EchoService', argv=[
+            '--reply_sock_url', 'tcp://localhost:' + dealer_port])
+
+        req_sock = self.zmq_ctx.socket(REQ)
+        req_sock.connect('tcp://localhost:' + router_port)
+        try:
+            broker.start()
+            echo.start()
+            for count in range(10):
+                req_sock.send('ping %d' % count)
+                self.assertEqual('ping %d' % count, req_sock.recv())
+        finally:
+            for t in [echo, broker]:
+                t.windmill.kill()
+                t.join(3)
+                self.assertFalse(t.is_alive(),
+                                 'The %s instance should have shutdown.' %
+                                 t.windmill.name)
+            req_sock.close()
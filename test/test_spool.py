@@ -0,0 +1,61 @@
+import shutil
+import tempfile
+import time
+from test.windmill_test_case import WindmillTestCase
+from windmills.lib import Spool
+
+
+__author__ = 'neoinsanity'
+
+
+class TestSpool(WindmillTestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+
+    def test_spool_replay_large_spool(self):
+        spool = Spool(self.spool_dir, segment_size=1024 * 1024)
+        entry_ids = [spool.append('entry-%d' % i) for i in range(20000)]
+        spool.close()
+
+        # replay the entries the way the delivery scheduler does
+        spool = Spool(self.spool_dir, segment_size=1024 * 1024)
+        replayed = list()
+        while True:
+            batch = spool.due(limit=100)
+            spool.next_due()
+            if not batch:
+                break
+            for entry_id, payload in batch:
+                self.assertEqual('entry-%d' % (entry_id - 1), payload)
+                spool.done(entry_id)
+            replayed.extend(entry_id for entry_id, _ in batch)
+
+        self.assertEqual(entry_ids, replayed)
+        self.assertEqual(0, len(spool))
+        self.assertEqual(None, spool.next_due())
+        spool.close()
+
+
+    def test_spool_due_order_after_fail(self):
+        spool = Spool(self.spool_dir, base_delay=60)
+        first = spool.append('first')
+        second = spool.append('second')
+        third = spool.append('third')
+
+        self.assertEqual([(first, 'first'), (second, 'second')],
+                         spool.due(limit=2))
+        self.assertTrue(spool.fail(first))
+        spool.done(second)
+
+        # the rescheduled entry is due after the entry that never failed
+        self.assertEqual([(third, 'third')], spool.due())
+        self.assertTrue(spool.next_due() > time.time() + 30)
+        self.assertEqual([(first, 'first')],
+                         spool.due(now=time.time() + 120))
+        self.assertEqual(None, spool.next_due())
+        spool.close()
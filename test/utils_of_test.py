@@ -1,6 +1,10 @@
+import asyncore
 import os
+import smtpd
+import time
 from threading import Thread
-from windmills import CliEmitter, CliListener, EchoService, EmailWindmill
+from windmills import (CliEmitter, CliListener, EchoService, EmailWindmill,
+                       ProxyWindmill, RouterDealerWindmill)
 from windmills.lib import Cornerstone
 
 
@@ -12,6 +16,8 @@ class_map = {
     'Cornerstone': Cornerstone,
     'EchoService': EchoService,
     'EmailWindmill': EmailWindmill,
+    'ProxyWindmill': ProxyWindmill,
+    'RouterDealerWindmill': RouterDealerWindmill,
     }
 
 
@@ -24,6 +30,39 @@ def thread_wrap_windmill(windmill_name=None, argv=None):
     return t
 
 
+class SmtpStandIn(smtpd.SMTPServer):
+    """A local SMTP server that records the emails delivered to it, as well
+    as the number of connections that have been accepted. A delay may be
+    given to stand in for a slow server."""
+    def __init__(self, port=None, delay=0):
+        assert port
+        smtpd.SMTPServer.__init__(self, ('localhost', port), None)
+        self.delay = delay
+        self.connections = 0
+        self.messages = list()
+        self._thread = Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self.close()
+        asyncore.close_all()
+        self._thread.join(3)
+
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        time.sleep(self.delay)
+        self.messages.append((mailfrom, rcpttos, data))
+
+
 def gen_archive_output_pair(test_name=None ):
     archive_file = 'test_data/archive/' + test_name + '._archive'
     output_file = 'test_out/' + test_name + '._output'
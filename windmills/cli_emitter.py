@@ -1,5 +1,7 @@
 #!/usr/bin/env python
-from lib import Brick
+from lib import Brick, CaptureReader
+import mmap
+import os
 import sys
 import time
 
@@ -10,6 +12,65 @@ __all__ = ['CliEmitter']
 # cli-emitter
 #
 
+class TokenBucket(object):
+    """
+    TokenBucket paces a sequence of sends to a rate in messages per second.
+
+    The bucket holds up to burst tokens, and each send takes a token. The
+    tokens are refilled from the time that has actually elapsed, so any
+    oversleep is made up by the following sends, up to the burst size. A
+    burst size of around 10ms worth of messages allows high rates to be
+    paced with a sleep per burst rather than a sleep per message.
+
+    Example Usage:
+    >>> now = [0.0]
+    >>> def sleep(seconds):
+    ...     now[0] += seconds
+    >>> bucket = TokenBucket(rate=4, burst=2, clock=lambda: now[0],
+    ...                      sleep=sleep)
+    >>> for _ in range(6):
+    ...     bucket.acquire()
+    >>> now[0]
+    1.0
+    """
+
+
+    def __init__(self, rate=None, burst=1, clock=time.time, sleep=time.sleep):
+        assert rate > 0
+        assert burst >= 1
+
+        self.rate = float(rate)
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._last = None
+
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        """
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        self._refill()
+        while self._tokens < 1:
+            self._sleep((1 - self._tokens) / self.rate)
+            self._refill()
+
+        self._tokens -= 1
+
+
+    def _refill(self):
+        now = self._clock()
+        if self._last is not None:
+            self._tokens = min(self._tokens + (now - self._last) * self.rate,
+                               self.burst)
+        self._last = now
+
+
 class CliEmitter(Brick):
     """
     >>> from threading import Thread
@@ -34,6 +95,17 @@ class CliEmitter(Brick):
         self.file = None
         self.message = 'Testing 1, 2, 3'
         self.repeat = False
+        self.stream = False
+        self.lines_per_msg = 1
+        self.rate = None
+        self.burst = None
+        self.capture = False
+        self.timing = 'max'
+
+        self._mapping = None
+        self._capture = None
+        self._pacer = None
+        self._sent = 0
 
         self.CONFIGURE_INPUT = False # Signal Brick not to configure input socket
         Brick.__init__(self, **kwargs)
@@ -42,12 +114,26 @@ class CliEmitter(Brick):
     def configuration_options(self, arg_parser=None):
         assert arg_parser
         arg_parser.add_argument('-d', '--delay',
-                                type=int,
+                                type=float,
                                 default=self.delay,
                                 help='The delay in the transmission of '
                                      'multi-line file or repeat messages. A '
                                      '0 delay will disable any delay, '
                                      'A negative delay value is not allowed.')
+        arg_parser.add_argument('--rate',
+                                type=float,
+                                default=self.rate,
+                                help='The rate of transmission in messages '
+                                     'per second. The achieved rate is '
+                                     'reported on stderr once cli-emitter '
+                                     'completes.')
+        arg_parser.add_argument('--burst',
+                                type=int,
+                                default=self.burst,
+                                help='The number of messages that may be sent '
+                                     'at once to make up for a late send at '
+                                     'the given --rate. Defaults to 10ms worth '
+                                     'of messages.')
         arg_parser.add_argument('-f', '--file',
                                 default=self.file,
                                 help='Use of this flag will cause cli-emitter'
@@ -67,11 +153,53 @@ class CliEmitter(Brick):
                                      'repeat transmission of messages. In the'
                                      ' case of a file, cli-emitter will loop '
                                      'through the contents of the file.')
+        arg_parser.add_argument('-s', '--stream',
+                                default=self.stream,
+                                action='store_true',
+                                help='Stream the lines of the -f|--file from '
+                                     'a memory mapping of the file, without a'
+                                     ' copy of each line. This is intended '
+                                     'for the replay of large captures.')
+        arg_parser.add_argument('-c', '--capture',
+                                default=self.capture,
+                                action='store_true',
+                                help='The -f|--file is a capture file, as '
+                                     'recorded by cli-listener, of binary and '
+                                     'multipart messages.')
+        arg_parser.add_argument('--timing',
+                                default=self.timing,
+                                choices=['max', 'original'],
+                                help='Replay a --capture either at max speed, '
+                                     'or at the original timing of the '
+                                     'recorded messages.')
+        arg_parser.add_argument('--lines_per_msg',
+                                type=int,
+                                default=self.lines_per_msg,
+                                help='The number of lines packed as the frames'
+                                     ' of a multipart message in --stream '
+                                     'mode.')
 
 
     def configure(self, args=None):
         assert args
 
+        if self.stream and self.file is None:
+            raise ValueError('The --stream mode requires a -f|--file.')
+        if self.capture and self.file is None:
+            raise ValueError('The --capture mode requires a -f|--file.')
+        if self.capture and self.stream:
+            raise ValueError('The --capture and --stream modes are exclusive.')
+        if self.lines_per_msg < 1:
+            raise ValueError('The --lines_per_msg must be at least 1.')
+
+        if self.rate is not None:
+            if self.rate <= 0:
+                raise ValueError('The --rate must be above 0.')
+            burst = self.burst
+            if burst is None:
+                burst = max(1, int(self.rate / 100))
+            self._pacer = TokenBucket(rate=self.rate, burst=burst)
+
         self.log.info('CliEmitter configured...')
 
 
@@ -82,9 +210,15 @@ class CliEmitter(Brick):
 
         try:
             self.setRun() # The run state must be set to true to detect kill signal
+            self._sent = 0
+            start = time.time()
 
             if self.file is None:
                 send_method = self._send_msg
+            elif self.capture:
+                send_method = self._replay_capture
+            elif self.stream:
+                send_method = self._stream_file
             else:
                 send_method = self._send_file
 
@@ -95,6 +229,14 @@ class CliEmitter(Brick):
                 while(not self.isStopped()):
                     send_method()
 
+            if self._pacer is not None:
+                elapsed = time.time() - start
+                sys.stderr.write('Sent %d messages in %.3fs, %.1f msg/s of '
+                                 'the %.1f msg/s rate.\n' %
+                                 (self._sent, elapsed,
+                                  self._sent / elapsed if elapsed else 0,
+                                  self.rate))
+
             # give it time to die.
             time.sleep(1)
         except Exception, e:
@@ -103,6 +245,12 @@ class CliEmitter(Brick):
         finally:
             self.kill()
             self.register_output_sock(None) # close the socket use
+            # the mapping is not closed, as frames still queued by zmq may
+            # reference it. It will be released with the last such frame.
+            self._mapping = None
+            if self._capture is not None:
+                self._capture.close()
+                self._capture = None
             self.log.info('CliEmitter shutting down.')
 
 
@@ -114,6 +262,77 @@ class CliEmitter(Brick):
                     break
 
 
+    def _stream_file(self):
+        """
+        Send the lines of the file as zero-copy buffers of a memory mapping
+        of the file, packed lines_per_msg to a message. The mapping is reused
+        across repeated passes of the file.
+        """
+        if self._mapping is None:
+            if os.path.getsize(self.file) == 0:
+                return # an empty file can not be mapped
+            with open(self.file, 'rb') as f:
+                self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        mapping = self._mapping
+        end = len(mapping)
+        start = 0
+        frames = []
+        while start < end:
+            stop = mapping.find('\n', start)
+            stop = end if stop < 0 else stop + 1
+            frames.append(buffer(mapping, start, stop - start))
+            start = stop
+
+            if len(frames) == self.lines_per_msg or start >= end:
+                self._transmit_frames(frames)
+                frames = []
+                if self._stop:
+                    break
+
+
+    def _replay_capture(self):
+        """
+        Send the messages of a capture file, either at max speed or at the
+        original timing of the messages relative to the first message.
+        """
+        if self._capture is None:
+            self._capture = CaptureReader(self.file)
+            if self.timing == 'original' and not self._capture.timestamps:
+                self.log.warning('The capture %s has no timestamps, it will '
+                                 'be replayed at max speed.', self.file)
+
+        original = self.timing == 'original' and self._capture.timestamps
+        first = None
+        start = None
+        for timestamp, frames in self._capture:
+            if original:
+                if first is None:
+                    first = timestamp
+                    start = time.time()
+                else:
+                    wait = start + (timestamp - first) - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+
+            self._transmit_frames(frames)
+            if self._stop:
+                break
+
+
+    def _transmit_frames(self, frames):
+        if self.delay > 0:
+            time.sleep(self.delay)
+        if self._pacer is not None:
+            self._pacer.acquire()
+        self._sent += 1
+
+        if self.monitor_stream:
+            self.log.info('o: %s', ''.join(str(frame) for frame in frames))
+
+        self._route(frames, copy=False)
+
+
     def _send_msg(self):
         self._transmit(self.message)
 
@@ -121,6 +340,9 @@ class CliEmitter(Brick):
     def _transmit(self, msg):
         if self.delay > 0:
             time.sleep(self.delay)
+        if self._pacer is not None:
+            self._pacer.acquire()
+        self._sent += 1
 
         self.send(msg)
 
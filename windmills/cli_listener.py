@@ -1,6 +1,17 @@
 #!/usr/bin/env python
-from lib import Brick
+from lib import Brick, CaptureWriter
+from threading import Thread
+import gzip
+import os
+import Queue
+import shutil
 import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 __author__ = 'neoinsanity'
@@ -9,6 +20,101 @@ __all__ = ['CliListener']
 # cli-listener
 #
 
+class StreamAggregate(object):
+    """
+    StreamAggregate maintains the counters of a message stream, without
+    retaining the messages. The counters of the current window, since the
+    last summary, are reported along with the totals of the stream.
+
+    The inter-arrival times of the window are counted in a histogram of
+    power of 2 buckets of microseconds. Messages may also be counted by the
+    prefix of their first frame, such as the topic of a SUB socket.
+
+    Example Usage:
+    >>> aggregate = StreamAggregate(prefix_length=3, start=0.0)
+    >>> aggregate.record(['cat people'], 1.0)
+    >>> aggregate.record(['dog nap'], 1.000010)
+    >>> aggregate.record(['cat scratch'], 1.5)
+    >>> print aggregate.summary(2.0)
+    msgs=3 bytes=28 rate=1.5msg/s 14B/s total_msgs=3 total_bytes=28 iat_us={16:1,524288:1} prefixes={cat:2,dog:1}
+    >>> print aggregate.summary(3.0)
+    msgs=0 bytes=0 rate=0.0msg/s 0B/s total_msgs=3 total_bytes=28 iat_us={} prefixes={}
+    """
+    MAX_PREFIXES = 1000
+
+
+    def __init__(self, prefix_length=0, start=None):
+        self.prefix_length = prefix_length
+
+        self.total_msgs = 0
+        self.total_bytes = 0
+        self._window_start = time.time() if start is None else start
+        self._last_arrival = None
+        self._reset()
+
+
+    def record(self, frames, now):
+        """
+        Count a message.
+
+        Keyword Arguments:
+        frames - the frames of the message, either strings or zmq Frames.
+        now - the time of arrival of the message.
+        """
+        self.msgs += 1
+        for frame in frames:
+            self.bytes += len(frame)
+
+        if self._last_arrival is not None:
+            micros = int((now - self._last_arrival) * 1000000)
+            bucket = 1 << micros.bit_length()
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+        self._last_arrival = now
+
+        if self.prefix_length > 0:
+            first = frames[0]
+            if isinstance(first, str):
+                prefix = first[:self.prefix_length]
+            else:
+                prefix = first.buffer[:self.prefix_length].tobytes()
+            if (prefix in self.prefixes or
+                len(self.prefixes) < self.MAX_PREFIXES):
+                self.prefixes[prefix] = self.prefixes.get(prefix, 0) + 1
+            else:
+                self.prefixes['<other>'] = self.prefixes.get('<other>', 0) + 1
+
+
+    def summary(self, now):
+        """
+        Return: The summary line of the window, which is then reset.
+        """
+        self.total_msgs += self.msgs
+        self.total_bytes += self.bytes
+
+        elapsed = now - self._window_start
+        rate = self.msgs / elapsed if elapsed > 0 else 0.0
+        byte_rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        line = ('msgs=%d bytes=%d rate=%.1fmsg/s %dB/s total_msgs=%d '
+                'total_bytes=%d iat_us={%s} prefixes={%s}' %
+                (self.msgs, self.bytes, rate, byte_rate,
+                 self.total_msgs, self.total_bytes,
+                 ','.join('%d:%d' % item
+                          for item in sorted(self.histogram.items())),
+                 ','.join('%s:%d' % item
+                          for item in sorted(self.prefixes.items()))))
+
+        self._window_start = now
+        self._reset()
+        return line
+
+
+    def _reset(self):
+        self.msgs = 0
+        self.bytes = 0
+        self.histogram = dict()
+        self.prefixes = dict()
+
+
 class CliListener(Brick):
     """
     >>> from threading import Thread
@@ -31,6 +137,34 @@ class CliListener(Brick):
     def __init__(self, **kwargs):
         # setup the initial default configuration
         self.file = None
+        self.capture = False
+        self.buffer_size = 0
+        self.flush_interval = 1.0 # seconds
+        self.rotate_bytes = 0
+        self.rotate_interval = 0 # seconds
+        self.compress = 'none'
+        self.append = False
+        self.aggregate = False
+        self.summary_interval = 1.0 # seconds
+        self.prefix_length = 0
+
+        self._file = None
+        self._writer = None
+        self._out = None
+        self._out_write = None
+        self._out_bytes = 0
+        self._opened_bytes = 0
+        self._rotate_deadline = None
+        self._compress_queue = Queue.Queue()
+        self._compressor = None
+        self._aggregate = None
+        self._summary_deadline = None
+        self._pending = list()
+        self._pending_bytes = 0
+        self._flush_deadline = None
+
+        self._command_handler = self._listener_command_handler
+        self.tick_handler = self._listener_tick_handler
 
         # todo: raul - this is cheesy, and needs to be replaced with a more
         # elegant method of setting the handler.
@@ -45,13 +179,97 @@ class CliListener(Brick):
         arg_parser.add_argument('-f', '--file',
                                 help='A file to append incoming messages by '
                                      'line.')
+        arg_parser.add_argument('-c', '--capture',
+                                default=self.capture,
+                                action='store_true',
+                                help='Record the incoming messages to the '
+                                     '-f|--file as a capture, which preserves '
+                                     'binary and multipart messages along with'
+                                     ' the time of receipt, for replay by '
+                                     'cli-emitter.')
+        arg_parser.add_argument('--buffer_size',
+                                type=int,
+                                default=self.buffer_size,
+                                help='Buffer the output until the given number '
+                                     'of bytes is reached, or the '
+                                     '--flush_interval has elapsed. The '
+                                     'default of 0 writes each message as it '
+                                     'is received.')
+        arg_parser.add_argument('--flush_interval',
+                                type=float,
+                                default=self.flush_interval,
+                                help='The maximum seconds that a message is '
+                                     'held in the output buffer.')
+        arg_parser.add_argument('--rotate_bytes',
+                                type=int,
+                                default=self.rotate_bytes,
+                                help='Rotate the -f|--file once it reaches the '
+                                     'given number of bytes. The rotated file '
+                                     'is renamed with a timestamp suffix.')
+        arg_parser.add_argument('--rotate_interval',
+                                type=float,
+                                default=self.rotate_interval,
+                                help='Rotate the -f|--file after the given '
+                                     'number of seconds.')
+        arg_parser.add_argument('--compress',
+                                default=self.compress,
+                                choices=['none', 'gzip', 'zstd'],
+                                help='Compress the rotated files on a '
+                                     'background thread. zstd requires the '
+                                     'zstandard package.')
+        arg_parser.add_argument('-a', '--append',
+                                default=self.append,
+                                action='store_true',
+                                help='Append to an existing -f|--file, rather '
+                                     'than truncate it.')
+        arg_parser.add_argument('--aggregate',
+                                default=self.aggregate,
+                                action='store_true',
+                                help='Only count the incoming messages, and '
+                                     'write a summary of the counts every '
+                                     '--summary_interval, rather than the '
+                                     'messages.')
+        arg_parser.add_argument('--summary_interval',
+                                type=float,
+                                default=self.summary_interval,
+                                help='The seconds between the summaries of '
+                                     'the --aggregate mode.')
+        arg_parser.add_argument('--prefix_length',
+                                type=int,
+                                default=self.prefix_length,
+                                help='Count the messages by the given length '
+                                     'of prefix of the first frame, such as '
+                                     'a SUB topic, in the --aggregate mode.')
 
 
     def configure(self, args=None):
         assert args
 
-        if self.file is not None:
-            self._file = open(self.file, 'w')
+        if self.file is None:
+            if self.capture:
+                raise ValueError('The --capture mode requires a -f|--file.')
+            if self.rotate_bytes or self.rotate_interval or self.append:
+                raise ValueError('The rotation and --append of the output '
+                                 'require a -f|--file.')
+
+        if self.aggregate and self.capture:
+            raise ValueError('The --aggregate and --capture modes are '
+                             'exclusive.')
+
+        if self.compress == 'zstd' and zstandard is None:
+            raise ValueError('The zstd compression requires the zstandard '
+                             'package.')
+
+        if self.file is None:
+            self._out = sys.stdout
+            self._out_write = self._out.write
+        else:
+            self._open_output(append=self.append)
+
+        if self.aggregate:
+            self._aggregate = StreamAggregate(prefix_length=self.prefix_length)
+            self._summary_deadline = time.time() + self.summary_interval
+            self.input_recv_handler = self._aggregate_recv_handler
 
         self.log.info('CliListener configured...')
 
@@ -61,20 +279,207 @@ class CliListener(Brick):
         This method is a replacement for Cornerstone._default_recv_handler.
         It will take an incoming input message and display it to console,
         or it will send the incoming message content to a designated file is
-        one is provided.
+        one is provided. The frames of a multipart message are written in
+        sequence, unless the message is recorded to a capture.
         """
-        msg = self._input_sock.recv()
+        frames = sock.recv_multipart()
 
-        if(self.file is None):
-            sys.stdout.write(msg)
-            sys.stdout.flush()
-        else:
-            self._file.write(msg)
-            self._file.flush()
+        if self._writer is not None:
+            self._output(self._writer.encode(frames, timestamp=time.time()))
+            return frames
+
+        msg = ''.join(frames)
+        self._output(msg)
 
         return msg
 
 
+    def _aggregate_recv_handler(self, sock):
+        """
+        Count an incoming message in the aggregate, without writing it.
+        """
+        frames = sock.recv_multipart(copy=self._forward_copy)
+        self._aggregate.record(frames, time.time())
+        return frames
+
+
+    def run(self):
+        """
+        Run the Cornerstone loop, flushing any buffered output on shutdown.
+        The compression of rotated files is completed prior to the return.
+        """
+        if self.compress != 'none':
+            self._compressor = Thread(target=self._compress_rotated,
+                                      name='%s-compress' % self.name)
+            self._compressor.daemon = True
+            self._compressor.start()
+
+        try:
+            Brick.run(self)
+        finally:
+            if self._aggregate is not None:
+                self._output(self._aggregate.summary(time.time()) + '\n')
+            self._flush()
+            if self._out is not None and self._out is not sys.stdout:
+                self._out.close()
+            if self._compressor is not None:
+                self._compress_queue.put(None)
+                self._compressor.join()
+                self._compressor = None
+
+
+    def _open_output(self, append=False):
+        """
+        Open the output file, or the capture of the output file.
+
+        Keyword Arguments:
+        append - True to append to an existing file, otherwise the file is
+            truncated.
+        """
+        if self.capture:
+            self._writer = CaptureWriter(self.file, timestamps=True,
+                                         append=append)
+            self._writer.flush() # the header of a new capture
+            self._out = self._writer
+            self._out_write = self._writer.write_encoded
+        else:
+            self._file = open(self.file, 'a' if append else 'w')
+            self._out = self._file
+            self._out_write = self._file.write
+
+        self._out_bytes = os.path.getsize(self.file)
+        self._opened_bytes = self._out_bytes
+        if self.rotate_interval > 0:
+            self._rotate_deadline = time.time() + self.rotate_interval
+
+
+    def _rotate(self):
+        """
+        Close the output file, rename it with a timestamp suffix, and open a
+        new output file. The rotated file is queued for compression.
+        """
+        self._out.close()
+
+        rotated = '%s.%s' % (self.file, time.strftime('%Y%m%d-%H%M%S'))
+        count = 0
+        candidate = rotated
+        while (os.path.exists(candidate) or
+               os.path.exists(candidate + '.gz') or
+               os.path.exists(candidate + '.zst')):
+            count += 1
+            candidate = '%s-%d' % (rotated, count)
+        os.rename(self.file, candidate)
+        self.log.info('Rotated %s to %s.', self.file, candidate)
+
+        if self._compressor is not None:
+            self._compress_queue.put(candidate)
+
+        self._open_output()
+
+
+    def _written(self, size):
+        self._out_bytes += size
+        if 0 < self.rotate_bytes <= self._out_bytes:
+            self._rotate()
+
+
+    def _compress_rotated(self):
+        """
+        Compress the rotated files as they are queued, until a None sentinel
+        is received. Each file is streamed through the compressor, and removed
+        once it has been compressed.
+        """
+        while True:
+            path = self._compress_queue.get()
+            if path is None:
+                break
+
+            try:
+                with open(path, 'rb') as src:
+                    if self.compress == 'gzip':
+                        with gzip.open(path + '.gz', 'wb') as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                    else:
+                        with open(path + '.zst', 'wb') as dst:
+                            zstandard.ZstdCompressor().copy_stream(src, dst)
+                os.remove(path)
+            except (IOError, OSError), e:
+                self.log.error('Failed to compress %s: %s', path, e)
+
+
+    def _output(self, data):
+        if self.buffer_size <= 0:
+            self._out_write(data)
+            self._out.flush()
+            self._written(len(data))
+            return
+
+        if not self._pending:
+            self._flush_deadline = time.time() + self.flush_interval
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if self._pending_bytes >= self.buffer_size:
+            self._flush()
+
+
+    def _flush(self):
+        """
+        Write out the buffered messages, joined into a single write.
+        """
+        if not self._pending:
+            return
+
+        pending = self._pending
+        size = self._pending_bytes
+        self._pending = list()
+        self._pending_bytes = 0
+        self._flush_deadline = None
+
+        self._out_write(''.join(pending))
+        self._out.flush()
+
+        self._written(size)
+
+
+    def _listener_tick_handler(self):
+        """
+        Write the aggregate summary once the summary_interval has elapsed,
+        flush the buffered messages once the flush_interval has elapsed, and
+        rotate the output file once the rotate_interval has elapsed.
+
+        Return: The seconds until the next summary, flush or rotation is due,
+        or None if none are pending.
+        """
+        now = time.time()
+        if (self._summary_deadline is not None and
+            self._summary_deadline <= now):
+            self._output(self._aggregate.summary(now) + '\n')
+            self._summary_deadline = now + self.summary_interval
+        if self._flush_deadline is not None and self._flush_deadline <= now:
+            self._flush()
+        if self._rotate_deadline is not None and self._rotate_deadline <= now:
+            self._flush()
+            if self._out_bytes == self._opened_bytes:
+                # there is nothing to rotate out
+                self._rotate_deadline = now + self.rotate_interval
+            elif self._rotate_deadline <= now:
+                self._rotate()
+
+        deadlines = [deadline
+                     for deadline in (self._summary_deadline,
+                                      self._flush_deadline,
+                                      self._rotate_deadline)
+                     if deadline is not None]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - now, 0)
+
+
+    def _listener_command_handler(self, msg):
+        self._flush()
+        self._default_command_handler(msg)
+
+
 if __name__ == '__main__':
     argv = sys.argv
     cli_listener = CliListener(argv=argv)
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 import argparse
+import os
+import shutil
 import signal
+import tempfile
 import time
 import ujson
+from multiprocessing import Process
 from threading import Thread
+from zmq import Context, NOBLOCK, PUB
 from cli_emitter import CliEmitter
 from cli_listener import CliListener
 from echo_service import EchoService
@@ -37,6 +42,43 @@ class DonQuixote(object):
     >>> foo.kill()
     >>> t.join(2)
     >>> assert not t.is_alive()
+
+    Services launched in the same DonQuixote can share a single zmq Context,
+    which removes the TCP stack between them when they are wired with
+    inproc:// urls. Sharing is enabled by the shared_context argument,
+    a "shared_context": true entry in the blueprints, or automatically when a
+    blueprint uses an inproc:// url. With libzmq prior to 4.0 an inproc url
+    must be bound before it is connected, so the binding service must be
+    listed first in the blueprints. The shared Context is terminated once
+    its services have stopped.
+
+    In the 'process' mode each blueprint service runs in its own process,
+    so CPU bound services are not bound to a single core by the GIL. The
+    DonQuixote parent supervises the processes, a service process that exits
+    with a failure is restarted up to max_restarts times. On shutdown a KILL
+    command is published to each service over its control socket,
+    and any process that has not exited within the grace period is
+    terminated. The mode may also be set with a "mode" blueprints entry.
+
+    A blueprint entry with a "replicas" count starts that many copies of the
+    service. Within the args of a replicated entry "{replica}" is replaced
+    with the replica index, and "{port}" with the entry "base_port" plus the
+    replica index. Each replica is given a unique --name, the service class
+    name and the replica index unless the args give a --name. Replication
+    only fans out the messages of a connect side worker, such as a
+    cli_listener or echo_service, whose replicas share the url of the PUSH or
+    DEALER socket that they connect to. Replicas that bind, such as those of
+    a cli_emitter, must be given a url per replica with a {port} or
+    {replica} template, and replicas of a PUB or SUB socket are rejected, as
+    each would publish or receive every message.
+    >>> don = DonQuixote(blueprints={'mode':'process', 'blueprints':[
+    ...     {'service':'cli_listener', 'replicas':2, 'base_port':9950,
+    ...     'args':'--input_sock_url tcp://localhost:{port} -f out_{replica}'}
+    ... ]}, disable_keyboard=True)
+    >>> for (service_class, args) in don.service_specs:
+    ...     print ' '.join(args)
+    --input_sock_url tcp://localhost:9950 -f out_0 --name CliListener-0
+    --input_sock_url tcp://localhost:9951 -f out_1 --name CliListener-1
     """
     service_map = {
         'cli_emitter': CliEmitter,
@@ -44,18 +86,33 @@ class DonQuixote(object):
         'echo_service': EchoService,
         'ventilator_windmill': VentilatorWindmill,
     }
+    # the services that bind their default output url, unless given an
+    # --output_connect or an --output_sock_url
+    bound_output_services = {
+        'cli_emitter': 'tcp://*:6677',
+        'ventilator_windmill': 'tcp://*:6688',
+    }
 
 
     def __init__(self,
                  file=None,
                  blueprints=None,
                  disable_keyboard=False,
-                 verbose=False):
+                 verbose=False,
+                 shared_context=False,
+                 mode='thread',
+                 max_restarts=5,
+                 shutdown_grace=3):
         # load the config file
         self.file = file
         self.blueprints = blueprints
         self.disable_keyboard = disable_keyboard
         self.verbose = verbose
+        self.shared_context = shared_context
+        self.zmq_ctx = None
+        self.mode = mode
+        self.max_restarts = max_restarts
+        self.shutdown_grace = shutdown_grace # seconds
 
         if file is not None:
             blueprints_json = open(file).read()
@@ -83,6 +140,13 @@ class DonQuixote(object):
 
 
     def run(self):
+        if self.mode == 'process':
+            self._run_processes()
+        else:
+            self._run_threads()
+
+
+    def _run_threads(self):
         thread_service_map = dict()
 
         for service_inst in self.active_services:
@@ -91,14 +155,9 @@ class DonQuixote(object):
             assert t.is_alive
             thread_service_map[t] = service_inst
 
-        # todo: raul - this should be replaced with a more console vs not
-        # console mode.
-        if self.disable_keyboard:
-            while(not self._stop):
-                time.sleep(1)
-        else:
-            _ = raw_input('Touch me and we die <return>:')
+        self._wait_for_stop()
 
+        all_stopped = True
         for t_key in thread_service_map.keys():
             service = thread_service_map[t_key]
             service.kill()
@@ -107,6 +166,7 @@ class DonQuixote(object):
                 if not t_key.is_alive(): break
 
             if t_key.is_alive():
+                all_stopped = False
                 print ('Service', service,
                        'has not shutdown, will attempt to force')
                 try:
@@ -114,33 +174,239 @@ class DonQuixote(object):
                 except:
                     print 'Service failed to stop:', service
 
+        # the shared context is terminated once its services have closed
+        # their sockets, a service that failed to stop would block the term
+        if self.zmq_ctx is not None and all_stopped:
+            self.zmq_ctx.term()
+            self.zmq_ctx = None
+
+
+    def _run_processes(self):
+        """
+        Run each blueprint service in a process of its own. The parent binds
+        a control socket that each service subscribes to, so that the
+        services can be sent a KILL command for a graceful shutdown.
+        """
+        control_dir = tempfile.mkdtemp(prefix='don_quixote-')
+        control_url = 'ipc://' + os.path.join(control_dir, 'control')
+        ctx = Context()
+        control_sock = ctx.socket(PUB)
+        control_sock.bind(control_url)
+
+        supervised = list()
+        for (service_class, args) in self.service_specs:
+            argv = args + ['--control_sock_url', control_url]
+            supervised.append([service_class, argv, None, 0])
+
+        def supervise():
+            if self._stop:
+                return
+            for entry in supervised:
+                service_class, argv, process, restarts = entry
+                if process is None:
+                    entry[2] = self._start_process(service_class, argv)
+                elif not process.is_alive() and process.exitcode != 0:
+                    if restarts >= self.max_restarts:
+                        continue
+                    print ('Service', service_class.__name__, 'exited with',
+                           process.exitcode, 'restarting.')
+                    entry[2] = self._start_process(service_class, argv)
+                    entry[3] = restarts + 1
+
+        try:
+            supervise()
+            self._wait_for_stop(supervise)
+        finally:
+            processes = [entry[2] for entry in supervised
+                         if entry[2] is not None]
+
+            # publish the kill command until the services have exited, as a
+            # subscriber may not have completed connecting to the control
+            deadline = time.time() + self.shutdown_grace
+            while time.time() < deadline:
+                if not [p for p in processes if p.is_alive()]:
+                    break
+                control_sock.send('KILL', NOBLOCK)
+                time.sleep(0.1)
+
+            for process in processes:
+                if process.is_alive():
+                    print ('Service', process.name,
+                           'has not shutdown, will attempt to terminate')
+                    process.terminate()
+                process.join(1)
+
+            control_sock.close(linger=0)
+            ctx.term()
+            shutil.rmtree(control_dir, ignore_errors=True)
+
+
+    def _start_process(self, service_class, argv):
+        process = Process(target=_run_service, args=(service_class, argv),
+                          name=service_class.__name__)
+        process.start()
+
+        return process
+
+
+    def _wait_for_stop(self, supervise=None):
+        """
+        Block until the DonQuixote is stopped, invoking the supervise
+        callable periodically if one is given.
+        """
+        # todo: raul - this should be replaced with a more console vs not
+        # console mode.
+        if self.disable_keyboard:
+            while(not self._stop):
+                if supervise is not None:
+                    supervise()
+                time.sleep(1)
+        else:
+            if supervise is not None:
+                supervisor = Thread(target=self._supervise_loop,
+                                    args=(supervise,))
+                supervisor.daemon = True
+                supervisor.start()
+            _ = raw_input('Touch me and we die <return>:')
+            self._stop = True
+
+
+    def _supervise_loop(self, supervise):
+        while not self._stop:
+            supervise()
+            time.sleep(1)
+
 
     def _load_blueprints(self, blueprints=None):
         assert blueprints
 
         # create a service instance holder
         self.active_services = list()
+        self.service_specs = list()
 
         service_list = blueprints["blueprints"]
+        self.mode = blueprints.get('mode', self.mode)
+        if self.mode not in ('thread', 'process'):
+            raise ValueError("The mode must be either 'thread' or 'process'.")
+
+        # services communicating over inproc must share a zmq context
+        if blueprints.get('shared_context', False):
+            self.shared_context = True
+        for service in service_list:
+            if 'inproc://' in service.get('args', ''):
+                self.shared_context = True
+        if self.shared_context and self.mode == 'process':
+            raise ValueError('A shared context and inproc:// urls are not '
+                             'supported in the process mode.')
+        if self.shared_context:
+            self.zmq_ctx = Context()
+
         for service in service_list:
             service_type = service["service"]
             assert service_type
-            args = service['args'].split()
+            service_class = DonQuixote.service_map[service_type]
+            assert service_class
+
+            for args in self._expand_replicas(service):
+                self.service_specs.append((service_class, args))
+
+        # services in the process mode are created by the child process
+        if self.mode == 'process':
+            return
 
+        for (service_class, args) in self.service_specs:
             the_service = None
 
-            service_class = DonQuixote.service_map[service_type]
-            assert service_class
             if args is not None:
-                the_service = service_class(argv=args)
+                the_service = service_class(argv=args, zmq_ctx=self.zmq_ctx)
             else:
-                the_service = service_class()
+                the_service = service_class(zmq_ctx=self.zmq_ctx)
 
             assert the_service
 
             self.active_services.append(the_service)
 
 
+    def _expand_replicas(self, service=None):
+        """
+        Generate the argument list for each replica of a blueprint entry.
+
+        Keyword Arguments:
+        service - the blueprint entry dictionary.
+
+        Return: a list of argument lists, one for each replica.
+
+        Raises:
+        ValueError: if the replicas would bind the same url, or use a PUB or
+            SUB socket.
+        """
+        assert service
+
+        replicas = service.get('replicas', 1)
+        if replicas < 1:
+            raise ValueError('The replicas of %s must be at least 1.' %
+                             service['service'])
+        if replicas == 1:
+            return [service['args'].split()]
+
+        service_name = DonQuixote.service_map[service['service']].__name__
+        replica_args = list()
+        bound_urls = set()
+        for replica in range(replicas):
+            args = service['args'].replace('{replica}', str(replica))
+            if 'base_port' in service:
+                args = args.replace('{port}',
+                                    str(service['base_port'] + replica))
+            args = args.split()
+
+            # each replica must have a unique name
+            if '--name' in args:
+                index = args.index('--name') + 1
+                if '{replica}' not in service['args'].split()[index]:
+                    args[index] = '%s-%d' % (args[index], replica)
+            else:
+                args += ['--name', '%s-%d' % (service_name, replica)]
+
+            for option, sock_type in [('--input_sock_type', 'SUB'),
+                                      ('--output_sock_type', 'PUB')]:
+                if option in args and \
+                        args[args.index(option) + 1].upper() == sock_type:
+                    raise ValueError(
+                        'The replicas of %s use a %s socket, replicas only '
+                        'fan out behind a PUSH or DEALER socket.' %
+                        (service['service'], sock_type))
+
+            for url in self._bound_urls(service['service'], args):
+                if url in bound_urls:
+                    raise ValueError(
+                        'The replicas of %s bind the same url %s, use a '
+                        '{replica} or {port} template in the url.' %
+                        (service['service'], url))
+                bound_urls.add(url)
+
+            replica_args.append(args)
+
+        return replica_args
+
+
+    def _bound_urls(self, service_type, args):
+        """
+        Return: the list of the urls that a service binds with the given args.
+        """
+        urls = [arg for arg in args if '://*' in arg]
+        for option, url_option in [('--input_bind', '--input_sock_url'),
+                                   ('--output_bind', '--output_sock_url')]:
+            if option in args and url_option in args:
+                urls.append(args[args.index(url_option) + 1])
+
+        default_url = DonQuixote.bound_output_services.get(service_type)
+        if default_url is not None and '--output_connect' not in args and \
+                '--output_sock_url' not in args:
+            urls.append(default_url)
+
+        return urls
+
+
     def _signal_interrupt_handler(self, signum, frame):
         """
         This method is registered with the signal library to ensure handling
@@ -150,14 +416,36 @@ class DonQuixote(object):
         self.kill()
 
 
+def _run_service(service_class, argv):
+    """
+    The target of a service process, the service is created within the
+    child process so that no zmq context is shared across the fork.
+    """
+    service = service_class(argv=argv)
+    service.run()
+
+
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('-f', '--file',
                             required = True,
                             help='The configuration file.')
     arg_parser.add_argument('--verbose', action='store_true')
+    arg_parser.add_argument('--shared_context', action='store_true',
+                            help='Share one 0mq context between all of the '
+                                 'services.')
+    arg_parser.add_argument('--mode', default='thread',
+                            choices=['thread', 'process'],
+                            help='Run each service in a thread or in a '
+                                 'process of its own.')
+    arg_parser.add_argument('--max_restarts', type=int, default=5,
+                            help='The number of times a crashed service '
+                                 'process will be restarted.')
     args = arg_parser.parse_args()
 
     don = DonQuixote(file=args.file,
-                     verbose=args.verbose)
+                     verbose=args.verbose,
+                     shared_context=args.shared_context,
+                     mode=args.mode,
+                     max_restarts=args.max_restarts)
     don.run()
@@ -1,14 +1,56 @@
 #!/usr/bin/env python
-from lib import Cornerstone
-from zmq import   REP
+from lib import Cornerstone, ReplyCache
+from zmq import DEALER, REP
 
 
 __author__ = 'neoinsanity'
-__all__ = ['EchoService']
+__all__ = ['Echo', 'EchoService']
 #
 # echo-windmill
 #
 
+class Echo(object):
+    """
+    Echo is the default message handler of EchoService. The message handler
+    of EchoService is given the frames of a request body, and returns the
+    frames of the reply body. A message handler must be picklable to be used
+    with a process pool executor.
+
+    >>> Echo()(['ping'])
+    ['ping']
+    >>> Echo(message='pong')(['ping'])
+    ['pong']
+    """
+
+
+    def __init__(self, message=None):
+        self.message = message
+
+
+    def __call__(self, body):
+        if self.message is None:
+            return body
+        return [self.message]
+
+
+def split_envelope(frames):
+    """
+    Split a message received on a DEALER socket into the routing envelope
+    and the body. The envelope is made up of the frames up to and including
+    the first empty delimiter frame. A message without a delimiter has an
+    empty envelope.
+
+    >>> split_envelope(['client-id', '', 'ping'])
+    (['client-id', ''], ['ping'])
+    >>> split_envelope(['ping'])
+    ([], ['ping'])
+    """
+    for index, frame in enumerate(frames):
+        if not frame:
+            return frames[:index + 1], frames[index + 1:]
+    return [], frames
+
+
 class EchoService(Cornerstone):
     """
     >>> from threading import Thread
@@ -29,10 +71,26 @@ class EchoService(Cornerstone):
         # setup the initial default settings
         self.reply_sock_url = 'tcp://localhost:8889'
         self.message = None
+        self.socket_type = 'REP'
+        self.cache_bytes = 0
+        self.cache_ttl = 0 # seconds
+
+        self._cache = None
+
+        # the message handler defaults to an Echo of the message
+        if not hasattr(self, 'message_handler'):
+            self.message_handler = None
+
+        # the reply cache is keyed on the request body frames, unless a key
+        # function of the request body frames is assigned
+        if not hasattr(self, 'cache_key'):
+            self.cache_key = None
 
         # todo: raul - this is cheesy, and needs to be replaced with a more
         # elegant method of setting the handler.
         self.input_recv_handler = self._echo_rec_handler
+        self.result_handler = self._echo_result_handler
+        self.no_result_handler = self._echo_no_result_handler
 
         Cornerstone.__init__(self, **kwargs)
 
@@ -50,25 +108,95 @@ class EchoService(Cornerstone):
                                      'back to the requesting client. If no '
                                      'present, then echo will just echo the '
                                      'request message.')
+        arg_parser.add_argument('--socket_type',
+                                default=self.socket_type,
+                                choices=['REP', 'DEALER'],
+                                help='The type of the reply socket. A DEALER '
+                                     'socket allows many requests in flight, '
+                                     'and keeps the routing envelope of each '
+                                     'request for its reply. The --executor '
+                                     'requires a DEALER socket.')
+        arg_parser.add_argument('--cache_bytes',
+                                type=int,
+                                default=self.cache_bytes,
+                                help='Enable a cache of the replies of up to '
+                                     'the given number of bytes, so that a '
+                                     'repeated request is replied without the '
+                                     'message handler.')
+        arg_parser.add_argument('--cache_ttl',
+                                type=float,
+                                default=self.cache_ttl,
+                                help='The seconds a cached reply is valid. The '
+                                     'default of 0 does not expire replies.')
 
 
     def configure(self, args=None):
         assert args
 
-        reply_sock = self.zmq_ctx.socket(REP)
+        if self.executor != 'none' and self.socket_type != 'DEALER':
+            raise ValueError('The --executor pool requires the DEALER '
+                             '--socket_type.')
+
+        if self.message_handler is None:
+            self.message_handler = Echo(message=self.message)
+        if self.cache_bytes > 0:
+            self._cache = ReplyCache(max_bytes=self.cache_bytes,
+                                     ttl=self.cache_ttl,
+                                     key=self.cache_key)
+
+        reply_sock = self.zmq_ctx.socket(REP if self.socket_type == 'REP'
+                                         else DEALER)
         reply_sock.connect(self.reply_sock_url)
 
         self.register_input_sock(reply_sock)
         self.register_output_sock(reply_sock)
 
 
-    def _echo_rec_handler(self, input_sock):
-        msg = input_sock.recv()
+    def run(self):
+        Cornerstone.run(self)
 
-        if self.message is None:
-            self._output_sock.send(msg)
-            return msg
+        if self._cache is not None:
+            self.log.info('Reply cache: %s', self._cache.stats())
 
+
+    def _echo_rec_handler(self, input_sock):
+        frames = input_sock.recv_multipart()
+
+        if self.socket_type == 'REP':
+            envelope, body = [], frames
         else:
-            self._output_sock.send(self.message)
-            return self.message
+            envelope, body = split_envelope(frames)
+
+        if self._cache is not None:
+            reply = self._cache.get(body)
+            if reply is not None:
+                self._output_sock.send_multipart(envelope + reply)
+                return reply
+
+        self.submit(body, context=(envelope, body))
+
+        return body
+
+
+    def _echo_result_handler(self, context, reply):
+        """
+        Send the reply to a request, along with the routing envelope of the
+        request, from the run loop.
+        """
+        envelope, body = context
+        if self._cache is not None:
+            self._cache.put(body, reply)
+        self._output_sock.send_multipart(envelope + reply)
+
+
+    def _echo_no_result_handler(self, context, error):
+        """
+        Send an empty reply to a request whose message handler failed, so the
+        client is not left waiting. A message handler that returns None sends
+        no reply on a DEALER socket, while a REP socket is sent an empty reply,
+        as it must reply to each request before it receives the next.
+        """
+        envelope, body = context
+        if error is not None or self.socket_type == 'REP':
+            self._output_sock.send_multipart(envelope + [''])
+
@@ -1,15 +1,26 @@
 #!/usr/bin/env python
 from email.mime.text import MIMEText
 from schematics.models import Model
+from schematics.base import ModelException, TypeException
 from schematics.types import StringType
 from schematics.types.compound import ListType
-from smtplib import SMTP, SMTPAuthenticationError, SMTPServerDisconnected
-from windmills.lib import Brick
+from smtplib import (SMTP, SMTPAuthenticationError, SMTPException,
+                     SMTPRecipientsRefused, SMTPResponseException,
+                     SMTPServerDisconnected)
+from threading import Event, Lock, Thread
+from windmills.lib import Brick, Spool
+from zmq import PUSH
 import json
 import os
-import schematics.base
+import Queue
 import socket
 import sys
+import time
+
+try:
+    from ujson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 
 __author__ = 'neoinsanity'
@@ -25,6 +36,283 @@ class EmailRequest(Model):
     to = ListType(StringType(max_length=256), required=True)
 
 
+class ModelValidator(object):
+    """
+    ModelValidator checks a payload dictionary against the fields of a
+    schematics Model, without the construction of a Model instance for each
+    payload. The field checks are compiled once from the Model definition, and
+    are limited to the required, type and length constraints of the StringType
+    and ListType of StringType fields.
+
+    A payload is accepted or rejected as it would be by
+    Model(**payload).validate(validate_all=True), and a rejected payload
+    raises a ModelException with the same errors. This includes the quirks of
+    the Model, an empty string is a missing value, while a missing or None
+    list is an empty list, which satisfies a required ListType.
+
+    Example Usage:
+    >>> validator = ModelValidator(EmailRequest)
+    >>> validator.validate({'msg': 'Hi', 'sender': 'raul@filepicker.io',
+    ...                     'subject': 'Hello', 'to': ['raul@filepicker.io']})
+    >>> validator.validate({'msg': 'Hi', 'sender': 'x' * 257,  # doctest: +ELLIPSIS
+    ...                     'subject': 'Hello', 'to': 'raul@filepicker.io'})
+    Traceback (most recent call last):
+    ...
+    ModelException: Model had 2 errors - ['Only lists and tuples may be used in a list field - to:raul@filepicker.io', 'String value is too long - sender:...']
+    """
+
+
+    def __init__(self, model_class=None):
+        assert model_class
+
+        self.doc_name = model_class.__name__
+        self._checks = [self._compile(name, field)
+                        for name, field in model_class._fields.items()]
+
+
+    def validate(self, payload):
+        if not isinstance(payload, dict):
+            raise TypeError('The payload must be a dictionary: %r' % payload)
+
+        errors = list()
+        for check in self._checks:
+            error = check(payload)
+            if error is not None:
+                errors.append(error)
+
+        if errors:
+            raise ModelException(self.doc_name, errors)
+
+
+    def _compile(self, name, field):
+        assert field.choices is None
+        assert field.validation is None
+
+        required = field.required
+
+        if isinstance(field, ListType):
+            assert len(field.fields) == 1
+            item_check = self._compile_string(name, field.fields[0])
+
+            def check_list(value):
+                if not isinstance(value, (list, tuple)):
+                    return TypeException('Only lists and tuples may be used in'
+                                         ' a list field', name, value)
+                for item in value:
+                    if item_check(item) is not None:
+                        # the Model reports an item as a str, which fails
+                        # for a non ascii item, and is reported as invalid
+                        try:
+                            return TypeException('Invalid ListType item',
+                                                 name, str(item))
+                        except UnicodeEncodeError:
+                            return TypeException('Invalid value', name, value)
+
+            def check(payload):
+                # the Model stores a missing or None list as an empty list
+                value = payload.get(name)
+                if value is None:
+                    value = list()
+                if value == '':
+                    if required:
+                        return TypeException('Required field missing', name,
+                                             value)
+                    return None
+                return check_list(value)
+
+            return check
+
+        check_string = self._compile_string(name, field)
+
+        def check(payload):
+            # the Model treats an empty string as a missing value
+            value = payload.get(name)
+            if value is None or value == '':
+                if required:
+                    return TypeException('Required field missing', name, value)
+                return None
+            return check_string(value)
+
+        return check
+
+
+    def _compile_string(self, name, field):
+        assert isinstance(field, StringType)
+        assert field.regex is None
+
+        max_length = field.max_length
+        min_length = field.min_length
+
+        def check_string(value):
+            if not isinstance(value, basestring):
+                return TypeException('Invalid value', name, value)
+            if max_length is not None and len(value) > max_length:
+                return TypeException('String value is too long', name, value)
+            if min_length is not None and len(value) < min_length:
+                return TypeException('String value is too short', name, value)
+
+        return check_string
+
+
+class SmtpPool(object):
+    """
+    SmtpPool holds long lived, authenticated SMTP connections for reuse
+    across email deliveries, so each email does not pay for a TCP connect,
+    STARTTLS and login.
+
+    Connections are created on demand up to the pool size. A connection that
+    has been idle for longer than the keepalive interval is probed with a
+    NOOP before use, and replaced if the server has dropped it. A delivery
+    that fails with SMTPServerDisconnected is retried once on a new
+    connection.
+
+    SmtpPool is safe for use from multiple delivery threads, a connection is
+    only held by a single thread between acquire() and release().
+    """
+
+
+    def __init__(self,
+                 host=None,
+                 port=None,
+                 user_name=None,
+                 password=None,
+                 starttls=False,
+                 size=4,
+                 keepalive=30,
+                 timeout=60):
+        assert host
+        assert port
+        assert size > 0
+
+        self.host = host
+        self.port = port
+        self.user_name = user_name
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.keepalive = keepalive # seconds
+        self.timeout = timeout # seconds
+
+        self._idle = Queue.LifoQueue()
+        self._created = 0
+        self._lock = Lock()
+
+
+    def acquire(self):
+        """
+        Acquire a connected SMTP client, which must be handed back with
+        either release() or discard(). When all connections of the pool are
+        in use, acquire() blocks until one is released.
+        """
+        try:
+            client, last_used = self._idle.get_nowait()
+        except Queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                return self._connect()
+            client, last_used = self._idle.get()
+
+        if time.time() - last_used > self.keepalive:
+            client = self._probe(client)
+
+        return client
+
+
+    def release(self, client):
+        """
+        Return a healthy SMTP client to the pool for reuse.
+        """
+        self._idle.put((client, time.time()))
+
+
+    def discard(self, client):
+        """
+        Close an SMTP client that is no longer usable, releasing its slot in
+        the pool for a new connection.
+        """
+        self._quit(client)
+        with self._lock:
+            self._created -= 1
+
+
+    def sendmail(self, sender, receivers, msg):
+        """
+        Send an email on a pooled connection.
+
+        Return: the dictionary of refused recipients returned by
+        SMTP.sendmail.
+        """
+        for attempt in range(2):
+            client = self.acquire()
+            try:
+                refused = client.sendmail(sender, receivers, msg)
+            except SMTPServerDisconnected:
+                self.discard(client)
+                if attempt > 0:
+                    raise
+                continue
+            except SMTPResponseException:
+                # the server rejected the email, the connection is reusable
+                self.release(client)
+                raise
+            except:
+                self.discard(client)
+                raise
+
+            self.release(client)
+            return refused
+
+
+    def close(self):
+        """
+        Quit all of the idle connections held by the pool.
+        """
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except Queue.Empty:
+                break
+            self.discard(client)
+
+
+    def _connect(self):
+        try:
+            client = SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                client.starttls()
+            if self.user_name:
+                client.login(self.user_name, self.password)
+        except:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        return client
+
+
+    def _probe(self, client):
+        try:
+            if client.noop()[0] == 250:
+                return client
+        except (SMTPException, socket.error):
+            pass
+
+        self.discard(client)
+        with self._lock:
+            self._created += 1
+        return self._connect()
+
+
+    def _quit(self, client):
+        try:
+            client.quit()
+        except (SMTPException, socket.error):
+            client.close()
+
+
 class EmailWindmill(Brick):
     SENDGRID_USERNAME = os.getenv('SENDGRID_USERNAME')
     SENDGRID_PASSWORD = os.getenv('SENDGRID_PASSWORD')
@@ -38,8 +326,34 @@ class EmailWindmill(Brick):
         self.password = self.SENDGRID_PASSWORD
         self.host = self.SMTPHOST
         self.port = self.SMTPPORT
+        self.smtp_starttls = False
+        self.smtp_workers = 4
+        self.smtp_keepalive = 30 # seconds
+        self.coalesce_count = 1
+        self.coalesce_window = 0.5 # seconds
+        self.max_recipients = 50
+        self.result_sock_url = None
+        self.spool_dir = None
+        self.spool_max_attempts = 10
+        self.spool_retry_delay = 1 # seconds
+        self.spool_batch = 100
+        self.validator = 'fast'
+        self.queue_high_watermark = 1000
+        self.queue_low_watermark = 500
+
+        self._smtp_pool = None
+        self._validate = None
+        self._delivery_queue = Queue.Queue()
+        self._workers = list()
+        self._batches = dict()
+        self._result_queue = Queue.Queue()
+        self._result_sock = None
+        self._spool = None
+        self._spool_stop = Event()
+        self._spool_scheduler = None
 
         self.input_recv_handler = self._email_recv_handler
+        self.tick_handler = self._email_tick_handler
 
         # signal Brick not to configure output socket
         self.CONFIGURE_OUTPUT = False
@@ -48,56 +362,241 @@ class EmailWindmill(Brick):
 
     def configuration_options(self, arg_parser=None):
         assert arg_parser
+        arg_parser.add_argument('--smtp_host',
+                                dest='host',
+                                default=self.host,
+                                help='The SMTP server host.')
+        arg_parser.add_argument('--smtp_port',
+                                dest='port',
+                                type=int,
+                                default=self.port,
+                                help='The SMTP server port.')
+        arg_parser.add_argument('--smtp_user',
+                                dest='user_name',
+                                default=self.user_name,
+                                help='The SMTP login user name. No login is '
+                                     'attempted if a user name is not set.')
+        arg_parser.add_argument('--smtp_password',
+                                dest='password',
+                                default=self.password,
+                                help='The SMTP login password.')
+        arg_parser.add_argument('--smtp_starttls',
+                                action='store_true',
+                                default=self.smtp_starttls,
+                                help='Enable STARTTLS on the SMTP connections.')
+        arg_parser.add_argument('--smtp_workers',
+                                type=int,
+                                default=self.smtp_workers,
+                                help='The number of delivery workers, each '
+                                     'worker may hold a pooled SMTP connection.')
+        arg_parser.add_argument('--smtp_keepalive',
+                                type=float,
+                                default=self.smtp_keepalive,
+                                help='The seconds a pooled SMTP connection may'
+                                     ' be idle before it is probed with a NOOP'
+                                     ' prior to reuse.')
+        arg_parser.add_argument('--validator',
+                                default=self.validator,
+                                choices=['fast', 'schematics'],
+                                help='The email request validation, either a '
+                                     'precompiled check of the payload or a '
+                                     'schematics model instance.')
+        arg_parser.add_argument('--queue_high_watermark',
+                                type=int,
+                                default=self.queue_high_watermark,
+                                help='The delivery queue depth at which the '
+                                     'input socket is no longer polled.')
+        arg_parser.add_argument('--queue_low_watermark',
+                                type=int,
+                                default=self.queue_low_watermark,
+                                help='The delivery queue depth at which the '
+                                     'polling of a paused input socket '
+                                     'resumes.')
+        arg_parser.add_argument('--coalesce_count',
+                                type=int,
+                                default=self.coalesce_count,
+                                help='The number of requests with the same '
+                                     'sender, subject and msg that may be '
+                                     'merged into a single email. The default '
+                                     'of 1 disables coalescing.')
+        arg_parser.add_argument('--coalesce_window',
+                                type=float,
+                                default=self.coalesce_window,
+                                help='The seconds a coalesced email will wait '
+                                     'for further requests before delivery.')
+        arg_parser.add_argument('--max_recipients',
+                                type=int,
+                                default=self.max_recipients,
+                                help='The maximum number of recipients of a '
+                                     'coalesced email.')
+        arg_parser.add_argument('--result_sock_url',
+                                default=self.result_sock_url,
+                                help='The url that the delivery result of each '
+                                     'request is pushed to. No results are '
+                                     'reported if a url is not set.')
+        arg_parser.add_argument('--spool_dir',
+                                default=self.spool_dir,
+                                help='The directory of the spool that holds '
+                                     'the pending and failed emails across '
+                                     'restarts. Failed emails are only retried '
+                                     'if a spool directory is set.')
+        arg_parser.add_argument('--spool_max_attempts',
+                                type=int,
+                                default=self.spool_max_attempts,
+                                help='The number of delivery attempts of a '
+                                     'spooled email before it is dropped.')
+        arg_parser.add_argument('--spool_retry_delay',
+                                type=float,
+                                default=self.spool_retry_delay,
+                                help='The seconds before the first retry of '
+                                     'a spooled email, doubling with each '
+                                     'subsequent retry.')
+        arg_parser.add_argument('--spool_batch',
+                                type=int,
+                                default=self.spool_batch,
+                                help='The number of due emails read from the '
+                                     'spool at a time.')
 
 
     def configure(self, args=None):
         assert args
 
+        if not 0 <= self.queue_low_watermark < self.queue_high_watermark:
+            raise ValueError('The queue_low_watermark must be below the '
+                             'queue_high_watermark: %d >= %d' %
+                             (self.queue_low_watermark,
+                              self.queue_high_watermark))
+
+        if self.validator == 'fast':
+            self._validate = ModelValidator(EmailRequest).validate
+        else:
+            self._validate = self._schematics_validate
+
+        self._smtp_pool = SmtpPool(host=self.host,
+                                   port=self.port,
+                                   user_name=self.user_name,
+                                   password=self.password,
+                                   starttls=self.smtp_starttls,
+                                   size=self.smtp_workers,
+                                   keepalive=self.smtp_keepalive)
+
+        if self.spool_dir:
+            self._spool = Spool(self.spool_dir,
+                                base_delay=self.spool_retry_delay,
+                                max_attempts=self.spool_max_attempts)
+            self.log.info('Spool holds %d pending emails.', len(self._spool))
+
+        if self.result_sock_url:
+            self._result_sock = self.zmq_ctx.socket(PUSH)
+            self._result_sock.connect(self.result_sock_url)
+
         self.log.info('EmailWindmill configured...')
 
 
+    def run(self):
+        """
+        Run the delivery workers for the duration of the Cornerstone run
+        loop. The recv loop only validates and queues each email, so a slow
+        SMTP server does not stall the draining of the input socket. Once the
+        delivery queue reaches the queue_high_watermark the input socket is
+        paused, until the workers drain the queue to the queue_low_watermark.
+
+        With a spool, each email is spooled before it is queued, and a
+        scheduler thread queues the spooled emails that are due for a retry,
+        or that were pending at the time of a prior shutdown.
+        """
+        self._workers = list()
+        for count in range(self.smtp_workers):
+            worker = Thread(target=self._delivery_worker,
+                            name='%s-delivery-%d' % (self.name, count))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        if self._spool is not None:
+            self._spool_stop.clear()
+            self._spool_scheduler = Thread(target=self._spool_schedule,
+                                           name='%s-spool' % self.name)
+            self._spool_scheduler.daemon = True
+            self._spool_scheduler.start()
+
+        try:
+            Brick.run(self)
+        finally:
+            if self._spool_scheduler is not None:
+                self._spool_stop.set()
+                self._spool_scheduler.join()
+                self._spool_scheduler = None
+
+            # deliver the pending coalesced emails before the workers stop
+            for key in self._batches.keys():
+                self._flush_batch(key)
+            for worker in self._workers:
+                self._delivery_queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._smtp_pool.close()
+
+            if self._spool is not None:
+                self._spool.close()
+
+            self._send_results()
+            if self._result_sock is not None:
+                self._result_sock.close()
+                self._result_sock = None
+
+
     def _email_recv_handler(self, sock):
         request_json = None
         try:
-            request_json = self._input_sock.recv()
+            request_json = sock.recv()
 
             self.log.debug('Request: %s', request_json)
 
-            email_request = json.loads(request_json)
+            email_request = json_loads(request_json)
             payload = email_request['payload']
 
-            validator = EmailRequest(**payload)
             try:
-                validator.validate(validate_all=True)
-            except schematics.base.ModelException, e:
+                self._validate(payload)
+            except ModelException, e:
                 self.log.error('schematics.base.ModelException: %s, while processing %s',
                                e, payload)
                 return
 
-            sender = payload['sender']
-            receivers = payload['to']
+            if not payload.get('to'):
+                self.log.error('Email request without recipients: %s', payload)
+                return
 
-            email_msg = MIMEText(payload['msg'])
+            request = (email_request.get('id'), payload['to'])
+            key = (payload['sender'], payload['subject'], payload['msg'])
 
-            email_msg['Subject'] = payload['subject']
-            email_msg['From'] = sender
-            email_msg['To'] = ', '.join(receivers) # create string list of recipients
+            if (self.coalesce_count <= 1 or
+                len(request[1]) >= self.max_recipients):
+                self._deliver(key, [request])
+                return request_json
+
+            batch = self._batches.get(key)
+            if batch is not None and (batch['recipients'] + len(request[1]) >
+                                      self.max_recipients):
+                self._flush_batch(key)
+                batch = None
+
+            if batch is None:
+                batch = {'deadline': time.time() + self.coalesce_window,
+                         'recipients': 0,
+                         'requests': list()}
+                self._batches[key] = batch
 
-            mail_client = SMTP(self.host, self.port)
-            mail_client.login(self.user_name, self.password)
-            mail_client.sendmail(sender, receivers, email_msg.as_string())
-            mail_client.quit()
+            batch['requests'].append(request)
+            batch['recipients'] += len(request[1])
+
+            if len(batch['requests']) >= self.coalesce_count:
+                self._flush_batch(key)
 
             return request_json
 
         except AttributeError, e:
             self.log.error('AttributeError: %s, while processing: %s' % (e, request_json))
-        except SMTPAuthenticationError, e:
-            self.log.error('SMTPAuthenticationError: %s' % e)
-        except SMTPServerDisconnected, e:
-            self.log.error('SMTPServerDisconnected: %s' % e)
-        except socket.error, e:
-            self.log.error('socket.error: %s' % e)
         except TypeError, e:
             self.log.error('TypeError: %s, while processing: %s' % (e, request_json))
         except ValueError, e:
@@ -106,6 +605,209 @@ class EmailWindmill(Brick):
             self.log.error("Unexpected error:", sys.exc_info()[0])
 
 
+    def queue_depth(self):
+        """
+        Return: The number of emails waiting on the delivery workers.
+        """
+        return self._delivery_queue.qsize()
+
+
+    def _schematics_validate(self, payload):
+        EmailRequest(**payload).validate(validate_all=True)
+
+
+    def _email_tick_handler(self):
+        """
+        Deliver the coalesced emails whose window has expired, and push the
+        delivery results reported by the workers.
+
+        Return: The seconds until the next coalesced email is due, or None if
+        there are no pending coalesced emails.
+        """
+        now = time.time()
+        for key, batch in self._batches.items():
+            if batch['deadline'] <= now:
+                self._flush_batch(key)
+
+        self._send_results()
+
+        if (self.input_paused() and
+            self.queue_depth() <= self.queue_low_watermark):
+            self.resume_input()
+            self.log.info('Delivery queue drained to %d, input resumed.',
+                          self.queue_depth())
+
+        if not self._batches:
+            return None
+        return min(b['deadline'] for b in self._batches.values()) - now
+
+
+    def _flush_batch(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is not None:
+            self._deliver(key, batch['requests'])
+
+
+    def _deliver(self, key, requests):
+        """
+        Queue a single email for the given requests, which all share the
+        sender, subject and msg of the key.
+
+        Keyword Arguments:
+        key - the (sender, subject, msg) of the requests.
+        requests - a list of (request id, recipient list) tuples.
+        """
+        sender, subject, msg = key
+
+        receivers = list()
+        for _, to in requests:
+            receivers.extend(to)
+
+        email_msg = MIMEText(msg)
+
+        email_msg['Subject'] = subject
+        email_msg['From'] = sender
+        if len(requests) == 1:
+            email_msg['To'] = ', '.join(receivers) # create string list of recipients
+        else:
+            # recipients of coalesced requests are not disclosed to each other
+            email_msg['To'] = 'undisclosed-recipients:;'
+
+        msg = email_msg.as_string()
+
+        spool_id = None
+        if self._spool is not None:
+            spool_id = self._spool.append(
+                json.dumps([sender, receivers, msg, requests]), in_flight=True)
+
+        self._delivery_queue.put((sender, receivers, msg, requests, spool_id))
+
+        if (not self.input_paused() and
+            self.queue_depth() >= self.queue_high_watermark):
+            self.pause_input()
+            self.log.info('Delivery queue reached %d, input paused.',
+                          self.queue_depth())
+
+
+    def _send_results(self):
+        """
+        Push the queued delivery results on the result socket. This is only
+        called from the thread running the Cornerstone loop, as the result
+        socket may not be shared with the delivery workers.
+        """
+        while True:
+            try:
+                result = self._result_queue.get_nowait()
+            except Queue.Empty:
+                break
+            self._result_sock.send(json.dumps(result))
+
+
+    def _report(self, requests, refused=None, error=None, deferred=False):
+        """
+        Queue the delivery result of each request for the result socket. A
+        request has failed if none of its recipients were accepted, and is
+        deferred if the failure has been spooled for a retry.
+        """
+        if self._result_sock is None:
+            return
+
+        for request_id, to in requests:
+            request_refused = [r for r in to if refused and r in refused]
+            status = 'sent'
+            if deferred:
+                status = 'deferred'
+            elif error is not None or len(request_refused) == len(to):
+                status = 'failed'
+            result = {'id': request_id,
+                      'status': status,
+                      'refused': request_refused}
+            if error is not None:
+                result['error'] = error
+            self._result_queue.put({'type': 'email_result', 'payload': result})
+
+        self._wakeup()
+
+
+    def _delivery_worker(self):
+        """
+        Deliver the queued emails through the SMTP pool until a None sentinel
+        is received.
+        """
+        while True:
+            delivery = self._delivery_queue.get()
+            if delivery is None:
+                break
+
+            # the input may only be resumed by the loop thread, so wake it
+            if (self.input_paused() and
+                self.queue_depth() <= self.queue_low_watermark):
+                self._wakeup()
+
+            sender, receivers, msg, requests, spool_id = delivery
+            refused = None
+            error = None
+            retry = False
+            try:
+                refused = self._smtp_pool.sendmail(sender, receivers, msg)
+            except SMTPRecipientsRefused, e:
+                self.log.error('SMTPRecipientsRefused: %s' % e.recipients)
+                refused = e.recipients
+            except SMTPAuthenticationError, e:
+                self.log.error('SMTPAuthenticationError: %s' % e)
+                error = str(e)
+            except SMTPServerDisconnected, e:
+                self.log.error('SMTPServerDisconnected: %s' % e)
+                error, retry = str(e), True
+            except SMTPResponseException, e:
+                self.log.error('SMTPResponseException: %s' % e)
+                # only a transient (4xx) rejection is worth a retry
+                error, retry = str(e), 400 <= e.smtp_code < 500
+            except SMTPException, e:
+                self.log.error('SMTPException: %s' % e)
+                error = str(e)
+            except socket.error, e:
+                self.log.error('socket.error: %s' % e)
+                error, retry = str(e), True
+            except:
+                self.log.error('Unexpected error: %s', sys.exc_info()[0])
+                error = str(sys.exc_info()[1])
+
+            if spool_id is not None:
+                if retry and self._spool.fail(spool_id):
+                    self._report(requests, error=error, deferred=True)
+                    continue
+                self._spool.done(spool_id)
+
+            self._report(requests, refused=refused, error=error)
+
+
+    def _spool_schedule(self):
+        """
+        Queue the spooled emails as they become due, until the spool stop
+        event is set. The spool is read in batches, and only while the
+        delivery queue is below the queue_high_watermark.
+        """
+        while not self._spool_stop.is_set():
+            wait = 0.1
+            if self.queue_depth() < self.queue_high_watermark:
+                batch = self._spool.due(limit=self.spool_batch)
+                for spool_id, payload in batch:
+                    sender, receivers, msg, requests = json_loads(payload)
+                    self._delivery_queue.put(
+                        (sender, receivers, msg, requests, spool_id))
+
+                next_due = self._spool.next_due()
+                if len(batch) == self.spool_batch:
+                    wait = 0
+                elif next_due is None:
+                    wait = 1
+                else:
+                    wait = min(max(next_due - time.time(), 0.01), 1)
+
+            self._spool_stop.wait(wait)
+
+
 if __name__ == '__main__':
     argv = sys.argv
     email_windmill = EmailWindmill(argv=argv)
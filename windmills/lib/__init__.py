@@ -1,9 +1,16 @@
 __author__ = 'neoinsanity'
 
-__all__ = ['Brick', 'Cornerstone', 'Miller', 'Mortar', 'Scaffold']
+__all__ = ['AsyncCornerstone', 'Brick', 'CaptureReader', 'CaptureWriter',
+           'Cornerstone', 'HashRing', 'Miller', 'Mortar', 'ReplyCache',
+           'Scaffold', 'Spool']
 
+from async_cornerstone import AsyncCornerstone
 from brick import Brick
+from capture import CaptureReader, CaptureWriter
 from cornerstone import Cornerstone
+from hash_ring import HashRing
 from miller import Miller
 from mortar import Mortar
+from reply_cache import ReplyCache
 from scaffold import Scaffold
+from spool import Spool
@@ -0,0 +1,260 @@
+"""AsyncCornerstone provides a Cornerstone that runs on gevent, so that the
+input handlers of a windmill are able to overlap their I/O.
+
+Configuration options provided by the AsyncCornerstone class.
+    optional arguments:
+        --concurrency CONCURRENCY
+            Set the maximum number of input handlers in flight.
+"""
+from cornerstone import Cornerstone
+
+try:
+    import gevent
+    from gevent.event import Event
+    from gevent.lock import Semaphore
+    from gevent.pool import Pool
+    import zmq.green as green_zmq
+except ImportError: # the async runtime requires the gevent package
+    gevent = None
+    green_zmq = None
+
+
+__author__ = 'neoinsanity'
+__all__ = ['AsyncCornerstone']
+
+
+class AsyncCornerstone(Cornerstone):
+    """
+    AsyncCornerstone has the configuration, socket registration, kill() and
+    control socket semantics of Cornerstone, with a run loop built on gevent
+    rather than a blocking Poller loop.
+
+    The sockets of an AsyncCornerstone are created from a zmq.green context,
+    so a send or recv that would block yields to the other greenlets. Each
+    message of an input socket is handled in a greenlet of its own, so an
+    input_recv_handler that waits on I/O does not hold up the other messages.
+    A handler is called with the input socket, as with Cornerstone, and must
+    receive a single message from it before it first yields. Any I/O other
+    than 0mq must use the gevent cooperative modules, such as gevent.socket
+    or the sockets patched by gevent.monkey, to overlap.
+
+    A send that blocks yields between the frames of a multipart message, so
+    the handlers must send with send() or _route(), which hold a lock of
+    each output socket for the whole message, rather than on the output
+    sockets directly.
+
+    The concurrency option limits the number of handlers in flight, once the
+    limit is reached the input sockets are no longer read until a handler
+    completes. The input policy is not applied, as each input socket is read
+    as soon as it is readable. The input and output sockets must be
+    registered before run() is invoked.
+
+    The sockets belong to the gevent hub of the thread that creates them, so
+    an AsyncCornerstone must be run by the thread that created it. kill() may
+    be called from any thread.
+
+    Example Usage:
+    >>> import time
+    >>> from zmq import PULL, PUSH
+    >>> foo = AsyncCornerstone(argv=['--concurrency', '10'])
+    >>> ctx = foo.zmq_ctx
+    >>> in_sock = ctx.socket(PULL)
+    >>> in_sock.bind('inproc://async_in')
+    >>> foo.register_input_sock(in_sock)
+    >>> replies = []
+    >>> def slow_handler(sock):
+    ...     msg = sock.recv()
+    ...     gevent.sleep(0.5)
+    ...     replies.append(msg)
+    ...     if len(replies) == 10:
+    ...         foo.kill()
+    >>> foo.input_recv_handler = slow_handler
+    >>> push_sock = ctx.socket(PUSH)
+    >>> push_sock.connect('inproc://async_in')
+    >>> for count in range(10):
+    ...     push_sock.send(str(count))
+    >>> start = time.time()
+    >>> foo.run()
+    >>> time.time() - start < 1.5 # the 10 handlers wait concurrently
+    True
+    >>> sorted(replies, key=int)
+    ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+    >>> push_sock.close()
+    """
+    CONTEXT = green_zmq.Context if green_zmq is not None else None
+
+
+    def __init__(self, **kwargs):
+        if gevent is None:
+            raise ImportError('AsyncCornerstone requires the gevent package.')
+
+        # setup the initial default settings
+        self.concurrency = 100
+
+        self._handlers = None
+        self._send_locks = dict() # output socket -> Semaphore
+        self._waker = None
+        self._wake = Event()
+        self._resumed = Event()
+        self._resumed.set()
+
+        Cornerstone.__init__(self, **kwargs)
+
+
+    def configuration_options(self, arg_parser=None):
+        """
+        Sample invocation:
+        >>> import argparse
+        >>> parser = argparse.ArgumentParser(prog='app.py')
+        >>> foo = AsyncCornerstone()
+        >>> foo.configuration_options(arg_parser=parser)
+        >>> args = parser.print_usage() # doctest: +NORMALIZE_WHITESPACE
+        usage: app.py [-h] [--concurrency CONCURRENCY]
+        """
+        assert arg_parser
+
+        arg_parser.add_argument('--concurrency',
+                                type=int,
+                                default=self.concurrency,
+                                help='Set the maximum number of input handlers '
+                                     'in flight. Once reached, the input '
+                                     'sockets are not read until a handler '
+                                     'completes.')
+
+
+    def configure(self, args=None):
+        assert args
+
+        if self.concurrency < 1:
+            raise ValueError('The --concurrency must be at least 1.')
+
+
+    def pause_input(self):
+        """
+        Stop the reading of the input sockets, the handlers in flight are not
+        affected. See Cornerstone.pause_input().
+        """
+        Cornerstone.pause_input(self)
+        self._resumed.clear()
+
+
+    def resume_input(self):
+        Cornerstone.resume_input(self)
+        self._resumed.set()
+
+
+    def run(self):
+        """
+        Run the input and control socket readers until kill() is invoked. The
+        tick handler is invoked on each heartbeat and wake up, as with
+        Cornerstone. At shutdown the handlers in flight are given a heartbeat
+        to complete, before they are killed.
+        """
+        self._stop = False
+
+        self.log.info('Beginning async run() with configuration: %s',
+                      self._args)
+
+        self._wake.clear()
+        waker = gevent.get_hub().loop.async_()
+        waker.start(self._wake.set)
+        with self._wakeup_lock:
+            self._waker = waker
+        self._handlers = Pool(self.concurrency)
+
+        self._connect_control_sock(self._poll)
+        readers = [gevent.spawn(self._read_input, entry)
+                   for entry in self._inputs]
+        readers.append(gevent.spawn(self._read_control))
+
+        active = True
+        while not self._stop:
+            timeout = self._poll_timeout(active=active) / 1000.0
+            active = self._wake.wait(timeout)
+            self._wake.clear()
+
+        self.log.info('Stop flag triggered ... shutting down.')
+        gevent.killall(readers)
+        self._handlers.join(timeout=self.heartbeat)
+        self._handlers.kill()
+        self._handlers = None
+
+        with self._wakeup_lock:
+            self._waker = None
+        waker.close()
+
+        # close the sockets held by the run loop
+        self._close_control_sock(self._poll)
+        for sock in self.input_socks():
+            self.remove_input_sock(sock)
+        for sock in self.output_socks():
+            self.remove_output_sock(sock)
+
+        self.log.info('Run terminated for %s', self.name)
+
+
+    def remove_output_sock(self, sock):
+        self._send_locks.pop(sock, None)
+        Cornerstone.remove_output_sock(self, sock)
+
+
+    def _send_frames(self, sock, frames, copy=True):
+        """
+        Send the frames of a message to a socket, holding the lock of the
+        socket so that the frames of concurrent handlers do not interleave.
+        """
+        lock = self._send_locks.get(sock)
+        if lock is None:
+            lock = self._send_locks[sock] = Semaphore()
+        with lock:
+            Cornerstone._send_frames(self, sock, frames, copy)
+
+
+    def _wakeup(self):
+        """
+        Wake the run loop to invoke the tick handler, or to stop once the stop
+        flag has been set. This method is safe to call from any thread.
+        """
+        if not self._wakeup_lock.acquire(False):
+            return
+        try:
+            if self._waker is not None:
+                self._waker.send()
+        finally:
+            self._wakeup_lock.release()
+
+
+    def _read_input(self, entry):
+        """
+        Hand each message of an input socket to a handler greenlet, while the
+        input is not paused and the handlers in flight are below the
+        concurrency limit.
+        """
+        sock = entry[0]
+        handler = entry[1] if entry[1] is not None else self.input_recv_handler
+        while True:
+            self._resumed.wait()
+            self._handlers.wait_available()
+            if not sock.poll() or self._input_paused:
+                continue
+            self._handlers.spawn(self._handle_input, sock, handler)
+            # the handler takes its message before the socket is polled again
+            gevent.sleep(0)
+
+
+    def _handle_input(self, sock, handler):
+        try:
+            msg = handler(sock)
+        except Exception:
+            self.log.exception('Unhandled exception in input handler.')
+            return
+
+        if self.monitor_stream:
+            self.log.info('i: %s', msg)
+
+
+    def _read_control(self):
+        while True:
+            msg = self._control_sock.recv()
+            if self._command_handler is not None:
+                self._command_handler(msg)
@@ -0,0 +1,196 @@
+"""Capture is a compact binary file format for the recording and replay of
+0mq message streams, including binary and multipart messages.
+"""
+import mmap
+import os
+import struct
+
+
+__author__ = 'neoinsanity'
+__all__ = ['CaptureReader', 'CaptureWriter']
+
+
+MAGIC = 'WMCAP'
+VERSION = 1
+TIMESTAMPS = 0x01
+
+FILE_HEADER = struct.Struct('!5sBB') # magic, version, flags
+TIMESTAMP = struct.Struct('!d')
+FRAME_COUNT = struct.Struct('!I')
+FRAME_LENGTH = struct.Struct('!I')
+
+
+class CaptureWriter(object):
+    """
+    CaptureWriter records messages to a capture file.
+
+    A capture file begins with a header of the magic 'WMCAP', a version byte
+    and a flags byte. Each message follows as an optional timestamp, a double
+    of seconds since the epoch that is present if the TIMESTAMPS flag is set,
+    the count of the frames of the message, and each frame as a length
+    followed by the frame bytes. All integers are unsigned 32 bit in network
+    byte order.
+
+    Example Usage:
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> writer = CaptureWriter(path, timestamps=True)
+    >>> writer.write(['envelope', '\\x00\\x01binary'], timestamp=1.5)
+    >>> writer.write(['single'], timestamp=2.0)
+    >>> writer.close()
+    >>> reader = CaptureReader(path)
+    >>> [(timestamp, [str(frame) for frame in frames])
+    ...  for timestamp, frames in reader]
+    [(1.5, ['envelope', '\\x00\\x01binary']), (2.0, ['single'])]
+    >>> reader.close()
+    >>> os.remove(path)
+    """
+
+
+    def __init__(self, path=None, timestamps=True, append=False):
+        assert path
+
+        self.path = path
+        self.timestamps = timestamps
+
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                flags = read_header(f.read(FILE_HEADER.size))
+            self.timestamps = bool(flags & TIMESTAMPS)
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            flags = TIMESTAMPS if timestamps else 0
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, flags))
+
+
+    def write(self, frames, timestamp=None):
+        """
+        Append a message to the capture.
+
+        Keyword Arguments:
+        frames - the list of frames of the message.
+        timestamp - the time the message was received, only recorded if the
+            capture has timestamps.
+        """
+        self._file.write(self.encode(frames, timestamp))
+
+
+    def encode(self, frames, timestamp=None):
+        """
+        Return: The capture record of a message as a string.
+        """
+        parts = list()
+        if self.timestamps:
+            parts.append(TIMESTAMP.pack(timestamp or 0.0))
+        parts.append(FRAME_COUNT.pack(len(frames)))
+        for frame in frames:
+            parts.append(FRAME_LENGTH.pack(len(frame)))
+            parts.append(frame)
+        return ''.join(parts)
+
+
+    def write_encoded(self, data):
+        """
+        Append the records returned by encode() to the capture.
+        """
+        self._file.write(data)
+
+
+    def fileno(self):
+        return self._file.fileno()
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        self._file.close()
+
+
+class CaptureReader(object):
+    """
+    CaptureReader iterates over the messages of a capture file as
+    (timestamp, frames) tuples. The timestamp is None if the capture does not
+    have timestamps.
+
+    The file is memory mapped, and each frame is returned as a buffer over the
+    mapping, so that a frame may be sent with copy=False without a copy of
+    the frame. The mapping is reused by each iteration of the reader.
+    """
+
+
+    def __init__(self, path=None):
+        assert path
+
+        self.path = path
+        self._mapping = None
+
+        with open(path, 'rb') as f:
+            self.flags = read_header(f.read(FILE_HEADER.size))
+            if os.path.getsize(path) > FILE_HEADER.size:
+                self._mapping = mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+
+        self.timestamps = bool(self.flags & TIMESTAMPS)
+
+
+    def __iter__(self):
+        mapping = self._mapping
+        if mapping is None:
+            return
+
+        timestamps = self.timestamps
+        end = len(mapping)
+        offset = FILE_HEADER.size
+        while offset < end:
+            timestamp = None
+            if timestamps:
+                self._check_size(offset, TIMESTAMP.size, end)
+                timestamp = TIMESTAMP.unpack_from(mapping, offset)[0]
+                offset += TIMESTAMP.size
+            self._check_size(offset, FRAME_COUNT.size, end)
+            count = FRAME_COUNT.unpack_from(mapping, offset)[0]
+            offset += FRAME_COUNT.size
+
+            frames = list()
+            for _ in xrange(count):
+                self._check_size(offset, FRAME_LENGTH.size, end)
+                length = FRAME_LENGTH.unpack_from(mapping, offset)[0]
+                offset += FRAME_LENGTH.size
+                self._check_size(offset, length, end)
+                frames.append(buffer(mapping, offset, length))
+                offset += length
+
+            yield timestamp, frames
+
+
+    def _check_size(self, offset, size, end):
+        if offset + size > end:
+            raise ValueError('Truncated capture file: %s' % self.path)
+
+
+    def close(self):
+        """
+        Release the mapping of the capture. The mapping is not closed, as
+        frames that have been handed to zmq with copy=False may reference it,
+        it will be released with the last such frame.
+        """
+        self._mapping = None
+
+
+def read_header(header):
+    """
+    Validate the header of a capture file.
+
+    Return: The flags of the capture.
+    """
+    if len(header) != FILE_HEADER.size:
+        raise ValueError('Not a capture file, missing the header.')
+    magic, version, flags = FILE_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Not a capture file, bad magic: %r' % magic)
+    if version != VERSION:
+        raise ValueError('Unsupported capture version: %d' % version)
+    return flags
@@ -3,18 +3,63 @@ and control socket.
 
 Configuration options provided by the Cornerstone class.
     optional arguments:
+        --shared_context
+            Use the process wide 0mq context rather than a private context.
+        --control_sock_url CONTROL_SOCK_URL
+            Set the url that the control socket will subscribe to commands.
         --heartbeat HEARTBEAT
             Set the heartbeat rete in seconds of the core 0mq poller.
+        --max_heartbeat MAX_HEARTBEAT
+            Set the ceiling in seconds of the adaptive idle heartbeat.
+        --drain_batch DRAIN_BATCH
+            Set the maximum number of messages handled per poll wake up.
+        --drain_budget DRAIN_BUDGET
+            Set the time budget in milliseconds for draining the input.
+        --input_policy {fair,priority,weighted}
+            Set the order in which multiple input sockets are serviced.
+        --output_policy {broadcast,round_robin,hash,least_queued}
+            Set the routing of messages across multiple output sockets.
+        --hash_frame HASH_FRAME
+            Set the message frame that holds the key of the hash routing.
+        --executor {none,thread,process}
+            Run the message handler in a thread pool or process pool.
+        --executor_workers EXECUTOR_WORKERS
+            Set the number of workers of the executor pool.
+        --executor_inflight EXECUTOR_INFLIGHT
+            Set the number of messages in the pool at which input is paused.
+        --executor_order {unordered,keyed}
+            Set whether the results of messages with the same key are ordered.
+        --order_frame ORDER_FRAME
+            Set the message frame that holds the key of the keyed order.
         --monitor_stream
             Enable the sampling of message flow.
+        --zero_copy
+            Enable zero-copy forwarding of messages by the default handler.
+        --copy_threshold COPY_THRESHOLD
+            Set the message size in bytes below which forwarding will copy.
         --verbose
             Enable verbose log output. Useful for debugging.
 """
+from collections import deque
+from errno import EAGAIN
+import fcntl
+import os
+from hash_ring import HashRing
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
+import Queue
 from scaffold import Scaffold
 import signal
 import sys
-from zmq import (Context, NOBLOCK, Poller, POLLIN, RCVMORE, SNDMORE,
-                 SUB, SUBSCRIBE, ZMQError)
+import time
+from threading import Lock, Thread
+from zmq import (Context, EVENTS, LAST_ENDPOINT, NOBLOCK, PAIR, Poller,
+                 POLLIN, POLLOUT, SUB, SUBSCRIBE, ZMQError, pyzmq_version)
+
+try:
+    from zmq import proxy_steerable
+except ImportError: # the steerable proxy requires pyzmq 16 and libzmq 4.1
+    proxy_steerable = None
 
 
 __author__ = 'neoinsanity'
@@ -28,13 +73,21 @@ class Cornerstone(Scaffold):
     internal xmq poll loop is passive. To start the loop call Cornerstone
     run(). To stop the Cornerstone instance call Cornerstone.kill().
 
-    Cornerstone only allows for one zmq input port and one zmq output port.
-    Cornerstone support respectively; Cornerstone.register_input_sock() and
-    Cornerstone.register_output_sock() methods.
+    The primary input and output ports of Cornerstone are registered with
+    the Cornerstone.register_input_sock() and
+    Cornerstone.register_output_sock() methods respectively. Further input
+    ports, each with its own receive handler, may be added with
+    Cornerstone.add_input_sock(), and further output ports may be added with
+    Cornerstone.add_output_sock().
 
     Cornerstone implements an internal signal handler for detection of
     interrupt signals to handle shutdown of connection resources.
 
+    By default each Cornerstone instance creates a private zmq Context. A
+    Context may be given with the zmq_ctx keyword argument, or the
+    --shared_context option will use the process wide Context.instance().
+    Windmills that share a Context can be wired together with inproc:// urls.
+
     Example Usage:
     >>> import threading
     >>> import time
@@ -66,26 +119,81 @@ class Cornerstone(Scaffold):
     >>> t.join(1)
     >>> assert not t.is_alive()
     """
+    CONTEXT = Context # the class of the zmq context created by configure
 
 
-    def __init__(self, **kwargs):
+    def __init__(self, zmq_ctx=None, **kwargs):
         self._input_sock = None
+        self._input_paused = False
+
+        # the input sockets, in the order of registration, as lists of
+        # [socket, handler, priority, weight]. the primary input socket is
+        # always the first.
+        self._inputs = list()
+        self._input_turn = 0
+        self.input_policy = 'fair'
         self._output_sock = None
         self._control_sock = None
 
+        # the output sockets, in the order of registration, as lists of
+        # [socket, name]. the primary output socket is always the first.
+        self._outputs = list()
+        self._output_names = dict() # name -> output entry
+        self._output_turn = 0
+        self._ring = HashRing()
+        self.output_policy = 'broadcast'
+        self.hash_frame = 0
+
+        # the message handler is run inline by default, or by a pool of
+        # thread or process workers.
+        self.executor = 'none'
+        self.executor_workers = 0 # 0 for a worker per cpu
+        self.executor_inflight = 0 # 0 for 4 messages per worker
+        self.executor_order = 'unordered'
+        self.order_frame = 0
+        self._executor = None
+        self._executor_paused = False
+        self._inflight = 0
+        self._keyed = dict() # key -> deque of the pending (frames, context)
+        self._results = Queue.Queue()
+        self.control_sock_url = 'tcp://localhost:7885'
+
         # determine if outgoing messages should enable NOBLOCK on send
         # default behaviour is to block on a send call till receiver is present
         self.no_block_send = False
 
+        # the default handler forwards with copying unless zero copy is enabled,
+        # a copy threshold of 0 will forward every message without copying.
+        self.zero_copy = False
+        self.copy_threshold = 0 # bytes
+        self._forward_copy = True
+
         # configure the interrupt handling
         self._stop = True
-        signal.signal(signal.SIGINT, self._signal_interrupt_handler)
+        try:
+            signal.signal(signal.SIGINT, self._signal_interrupt_handler)
+        except ValueError: # only the main thread is able to set a handler
+            pass
 
         # a regular hearbeat interval must be set to the default.
         self.heartbeat = 3 # seconds
 
-        # create the zmq context
-        self.zmq_ctx = Context()
+        # a max heartbeat above the heartbeat enables the adaptive idle mode.
+        self.max_heartbeat = 0 # seconds
+        self._idle_heartbeat = self.heartbeat
+
+        # the wake up pipe allows kill() to interrupt a poll in progress.
+        self._wakeup_fds = None
+        self._wakeup_lock = Lock()
+
+        # a drain batch of 1 handles a single message per poll wake up, any
+        # larger value will drain pending input messages before polling again.
+        self.drain_batch = 1
+        self.drain_budget = 0 # milliseconds, a 0 budget disables the limit
+
+        # the zmq context is created during configuration, unless one is given
+        self.zmq_ctx = zmq_ctx
+        self.shared_context = False
 
         # set the default input receive handler, if none has been assigned
         if not hasattr(self, 'input_recv_handler'):
@@ -95,6 +203,33 @@ class Cornerstone(Scaffold):
         if not hasattr(self, '_command_handler'):
             self._command_handler = self._default_command_handler
 
+        # the key of the hash output policy is taken from the hash_frame of a
+        # message, unless an output key function of the frames is assigned
+        if not hasattr(self, 'output_key'):
+            self.output_key = None
+
+        # the message handler transforms the frames of a message into the
+        # frames of a result, which are routed to the output sockets unless a
+        # result handler is assigned.
+        if not hasattr(self, 'message_handler'):
+            self.message_handler = None
+        if not hasattr(self, 'result_handler'):
+            self.result_handler = None
+        # the no result handler is handed the context of a message whose
+        # message handler raised or returned None, such as to complete a
+        # request that must be replied to.
+        if not hasattr(self, 'no_result_handler'):
+            self.no_result_handler = None
+
+        # the key of the keyed executor order is taken from the order_frame of
+        # a message, unless an order key function of the frames is assigned
+        if not hasattr(self, 'order_key'):
+            self.order_key = None
+
+        # the tick handler is invoked after each poll, if one is assigned
+        if not hasattr(self, 'tick_handler'):
+            self.tick_handler = None
+
         # construct the poller
         self._poll = Poller()
 
@@ -118,16 +253,119 @@ class Cornerstone(Scaffold):
         >>> foo = Cornerstone()
         >>> foo.configuration_options(arg_parser=parser)
         >>> args = parser.print_usage() # doctest: +NORMALIZE_WHITESPACE
-        usage: app.py [-h] [--heartbeat HEARTBEAT] [--monitor_stream]
-                  [--no_block_send]
+        usage: app.py [-h] [--shared_context] [--control_sock_url CONTROL_SOCK_URL]
+                  [--heartbeat HEARTBEAT] [--max_heartbeat MAX_HEARTBEAT]
+                  [--drain_batch DRAIN_BATCH] [--drain_budget DRAIN_BUDGET]
+                  [--input_policy {fair,priority,weighted}]
+                  [--output_policy {broadcast,round_robin,hash,least_queued}]
+                  [--hash_frame HASH_FRAME]
+                  [--executor {none,thread,process}]
+                  [--executor_workers EXECUTOR_WORKERS]
+                  [--executor_inflight EXECUTOR_INFLIGHT]
+                  [--executor_order {unordered,keyed}]
+                  [--order_frame ORDER_FRAME]
+                  [--monitor_stream] [--no_block_send] [--zero_copy]
+                  [--copy_threshold COPY_THRESHOLD]
         """
         assert arg_parser
 
+        arg_parser.add_argument('--shared_context',
+                                action='store_true',
+                                default=self.shared_context,
+                                help='Use the process wide 0mq context, '
+                                     'rather than creating a private context. '
+                                     'Windmills sharing a context are able to '
+                                     'communicate over inproc:// urls.')
+        arg_parser.add_argument('--control_sock_url',
+                                default=self.control_sock_url,
+                                help='The url that the control socket will '
+                                     'connect to for the receipt of commands.')
         arg_parser.add_argument('--heartbeat',
-                                type=int,
-                                default=3,
+                                type=float,
+                                default=self.heartbeat,
                                 help="Set the heartbeat rate in seconds of "
                                      "the core 0mq poller timeout.")
+        arg_parser.add_argument('--max_heartbeat',
+                                type=float,
+                                default=self.max_heartbeat,
+                                help='Set the ceiling in seconds for the '
+                                     'adaptive idle heartbeat. The poller '
+                                     'timeout will double while the sockets '
+                                     'are idle until the ceiling is reached. '
+                                     'A value at or below the heartbeat '
+                                     'disables the adaptive idle mode.')
+        arg_parser.add_argument('--drain_batch',
+                                type=int,
+                                default=self.drain_batch,
+                                help='Set the maximum number of pending input '
+                                     'messages handled for each wake up of the'
+                                     ' poller. A value of 1 disables draining.')
+        arg_parser.add_argument('--drain_budget',
+                                type=float,
+                                default=self.drain_budget,
+                                help='Set the time budget in milliseconds for '
+                                     'draining the input socket. A 0 budget '
+                                     'will only limit by the drain batch.')
+        arg_parser.add_argument('--input_policy',
+                                default=self.input_policy,
+                                choices=['fair', 'priority', 'weighted'],
+                                help='Set the order in which multiple input '
+                                     'sockets are serviced. The fair policy '
+                                     'drains each readable socket in turn, the '
+                                     'priority policy only drains a lower '
+                                     'priority socket once the higher priority '
+                                     'sockets are drained, and the weighted '
+                                     'policy drains each socket in turn by a '
+                                     'drain batch scaled by its weight.')
+        arg_parser.add_argument('--output_policy',
+                                default=self.output_policy,
+                                choices=['broadcast', 'round_robin', 'hash',
+                                         'least_queued'],
+                                help='Set the routing of messages across '
+                                     'multiple output sockets. A message is '
+                                     'either sent to every socket, to each '
+                                     'socket in turn, to the socket selected '
+                                     'by a consistent hash of the message key, '
+                                     'or to the next socket that is able to '
+                                     'queue the message without blocking.')
+        arg_parser.add_argument('--hash_frame',
+                                type=int,
+                                default=self.hash_frame,
+                                help='Set the index of the message frame that '
+                                     'holds the key of the hash output '
+                                     'policy.')
+        arg_parser.add_argument('--executor',
+                                default=self.executor,
+                                choices=['none', 'thread', 'process'],
+                                help='Run the message handler in a pool of '
+                                     'thread or process workers, rather than '
+                                     'in the run loop. The results are sent '
+                                     'from the run loop.')
+        arg_parser.add_argument('--executor_workers',
+                                type=int,
+                                default=self.executor_workers,
+                                help='Set the number of workers of the '
+                                     'executor pool. Defaults to a worker per '
+                                     'cpu.')
+        arg_parser.add_argument('--executor_inflight',
+                                type=int,
+                                default=self.executor_inflight,
+                                help='Set the number of messages in the '
+                                     'executor at which the input sockets are '
+                                     'no longer polled. Defaults to 4 per '
+                                     'worker.')
+        arg_parser.add_argument('--executor_order',
+                                default=self.executor_order,
+                                choices=['unordered', 'keyed'],
+                                help='Send the results of the executor as they '
+                                     'complete, or in the order of the '
+                                     'messages that share a key.')
+        arg_parser.add_argument('--order_frame',
+                                type=int,
+                                default=self.order_frame,
+                                help='Set the index of the message frame that '
+                                     'holds the key of the keyed executor '
+                                     'order.')
         arg_parser.add_argument('--monitor_stream',
                                 action='store_true',
                                 help='Enable the sampling of message flow.')
@@ -136,6 +374,17 @@ class Cornerstone(Scaffold):
                                 help='Enable NOBLOCK on the sending of messages.'
                                      ' This will cause an message to be dropped '
                                      'if no receiver is present.')
+        arg_parser.add_argument('--zero_copy',
+                                action='store_true',
+                                help='Enable zero-copy forwarding of messages '
+                                     'by the default receive handler.')
+        arg_parser.add_argument('--copy_threshold',
+                                type=int,
+                                default=self.copy_threshold,
+                                help='Set the message size in bytes below '
+                                     'which zero-copy forwarding will use the '
+                                     'copying path. A 0 threshold disables '
+                                     'copying for all messages.')
 
 
     def configure(self, args=None):
@@ -148,6 +397,15 @@ class Cornerstone(Scaffold):
         """
         assert args
 
+        if self.zmq_ctx is None:
+            if self.shared_context:
+                self.zmq_ctx = self.CONTEXT.instance()
+            else:
+                self.zmq_ctx = self.CONTEXT()
+
+        self._forward_copy = not getattr(self, 'zero_copy', False)
+        self._idle_heartbeat = self.heartbeat
+
 
     def register_input_sock(self, sock):
         """
@@ -159,9 +417,9 @@ class Cornerstone(Scaffold):
 
         Return: None
 
-        Cornerstone does not support multiple input sockets, so any currently
-        registered input socket will be discarded. This is a per instance
-        limitation, in which case the primary concern is ipaddress collision.
+        Cornerstone supports a single primary input socket, so any currently
+        registered primary input socket will be discarded. Further input
+        sockets may be added with add_input_sock(), which are not affected.
 
         Example Usage:
         >>> from zmq import SUB, SUBSCRIBE
@@ -182,13 +440,133 @@ class Cornerstone(Scaffold):
         """
         # if there is an existing input socket, then it will be removed.
         if self._input_sock is not None:
-            self._poll.unregister(self._input_sock)
-            self._input_sock.close()
+            self.remove_input_sock(self._input_sock)
             self._input_sock = None
 
+        if not self._inputs:
+            self._input_paused = False
+
         self._input_sock = sock
         if self._input_sock is not None:
-            self._poll.register(self._input_sock, POLLIN)
+            self._inputs.insert(0, [sock, None, 0, 1])
+            if not self._input_paused:
+                self._poll.register(self._input_sock, POLLIN)
+
+
+    def add_input_sock(self, sock, handler=None, priority=0, weight=1):
+        """
+        Add an input socket alongside the primary input socket, so that a
+        single Cornerstone instance may merge several upstream feeds.
+
+        Keyword Arguments:
+        sock - the input socket that is to be added.
+        handler - the receive handler for the messages of the socket, which is
+            called with the socket. The input_recv_handler is used if no
+            handler is given.
+        priority - the priority of the socket under the 'priority' input
+            policy, a higher priority socket is drained first.
+        weight - the multiple of the drain batch that the socket is drained by
+            under the 'weighted' input policy.
+
+        Return: None
+
+        Example Usage:
+        >>> from zmq import PULL
+        >>> foo = Cornerstone()
+        >>> ctx = foo.zmq_ctx
+        >>> sock1 = ctx.socket(PULL)
+        >>> sock2 = ctx.socket(PULL)
+        >>> foo.register_input_sock(sock1)
+        >>> foo.add_input_sock(sock2, handler=lambda sock: sock.recv(),
+        ...                    priority=1)
+        >>> foo.input_socks() == [sock1, sock2]
+        True
+        >>> foo.remove_input_sock(sock2)
+        >>> foo.input_socks() == [sock1]
+        True
+        >>> foo.register_input_sock(sock=None)
+        >>> foo.input_socks()
+        []
+        """
+        assert sock is not None
+        assert weight >= 1
+
+        self._inputs.append([sock, handler, priority, weight])
+        if not self._input_paused:
+            self._poll.register(sock, POLLIN)
+
+
+    def remove_input_sock(self, sock):
+        """
+        Remove an input socket, which is closed.
+
+        Keyword Arguments:
+        sock - the input socket that is to be removed.
+        """
+        for index, entry in enumerate(self._inputs):
+            if entry[0] is sock:
+                del self._inputs[index]
+                break
+        else:
+            return
+
+        if not self._input_paused:
+            self._poll.unregister(sock)
+        sock.close()
+        if sock is self._input_sock:
+            self._input_sock = None
+
+
+    def input_socks(self):
+        """
+        Return: The list of the input sockets, the primary input socket first.
+        """
+        return [entry[0] for entry in self._inputs]
+
+
+    def pause_input(self):
+        """
+        Stop the polling of the input sockets, so that messages are left to
+        queue on the sockets up to their high water mark, at which point the
+        upstream senders will block. The pause also ends any drain of the
+        input sockets that is in progress.
+
+        This method must be called from the thread running the Cornerstone
+        loop, typically from within an input_recv_handler or tick_handler.
+
+        Example Usage:
+        >>> from zmq import PULL
+        >>> foo = Cornerstone()
+        >>> sock = foo.zmq_ctx.socket(PULL)
+        >>> foo.register_input_sock(sock)
+        >>> foo.pause_input()
+        >>> foo.input_paused()
+        True
+        >>> foo.resume_input()
+        >>> foo.input_paused()
+        False
+        >>> foo.register_input_sock(sock = None)
+        """
+        if self._inputs and not self._input_paused:
+            for entry in self._inputs:
+                self._poll.unregister(entry[0])
+            self._input_paused = True
+
+
+    def resume_input(self):
+        """
+        Resume the polling of the input sockets that were paused by
+        pause_input(). This method must be called from the thread running the
+        Cornerstone loop.
+        """
+        if self._input_paused:
+            for entry in self._inputs:
+                self._poll.register(entry[0], POLLIN)
+            self._input_paused = False
+
+
+    def input_paused(self):
+        return self._input_paused
 
 
     def register_output_sock(self, sock):
@@ -201,10 +579,9 @@ class Cornerstone(Scaffold):
 
         Return: none
 
-        Cornerstone does not support multiple output sockets,
-        so any currently registered output socket will be discarded. This is
-        a per instance limitation. In which case the primary concern is
-        ipaddress collision.
+        Cornerstone supports a single primary output socket, so any currently
+        registered primary output socket will be discarded. Further output
+        sockets may be added with add_output_sock(), which are not affected.
 
         Example Usage:
         >>> from zmq import PUB
@@ -222,10 +599,91 @@ class Cornerstone(Scaffold):
         """
         # if there is an existing output socket, then it will be removed.
         if self._output_sock is not None:
-            self._output_sock.close()
+            self.remove_output_sock(self._output_sock)
             self._output_sock = None
 
         self._output_sock = sock
+        if self._output_sock is not None:
+            self._add_output(sock, None, 0)
+
+
+    def add_output_sock(self, sock, name=None):
+        """
+        Add an output socket alongside the primary output socket. Messages
+        are routed across the output sockets by the output_policy.
+
+        Keyword Arguments:
+        sock - the output socket that is to be added.
+        name - the name of the socket on the ring of the hash output policy.
+            The last endpoint of the socket is used if no name is given, so
+            that the keys keep their socket across restarts.
+
+        Return: None
+
+        Example Usage:
+        >>> from zmq import PULL, PUSH
+        >>> foo = Cornerstone(argv=['--output_policy', 'round_robin'])
+        >>> ctx = foo.zmq_ctx
+        >>> pull_socks = []
+        >>> for index in range(2):
+        ...     push_sock = ctx.socket(PUSH)
+        ...     push_sock.bind('inproc://output_%d' % index)
+        ...     foo.add_output_sock(push_sock)
+        ...     pull_sock = ctx.socket(PULL)
+        ...     pull_sock.connect('inproc://output_%d' % index)
+        ...     pull_socks.append(pull_sock)
+        >>> for msg in ['a', 'b', 'c', 'd']:
+        ...     foo.send(msg)
+        >>> [[sock.recv(), sock.recv()] for sock in pull_socks]
+        [['a', 'c'], ['b', 'd']]
+        >>> for sock in pull_socks + foo.output_socks():
+        ...     sock.close()
+        """
+        assert sock is not None
+        self._add_output(sock, name, len(self._outputs))
+
+
+    def remove_output_sock(self, sock):
+        """
+        Remove an output socket, which is closed.
+
+        Keyword Arguments:
+        sock - the output socket that is to be removed.
+        """
+        for index, entry in enumerate(self._outputs):
+            if entry[0] is sock:
+                del self._outputs[index]
+                break
+        else:
+            return
+
+        del self._output_names[entry[1]]
+        self._ring.remove(entry[1])
+        sock.close()
+        if sock is self._output_sock:
+            self._output_sock = None
+
+
+    def output_socks(self):
+        """
+        Return: The list of the output sockets, the primary output socket
+        first.
+        """
+        return [entry[0] for entry in self._outputs]
+
+
+    def _add_output(self, sock, name, index):
+        if name is None:
+            name = sock.getsockopt(LAST_ENDPOINT)
+            if not name or name in self._output_names:
+                name = 'output-%x' % id(sock)
+        elif name in self._output_names:
+            raise ValueError('Duplicate output socket name: %s' % name)
+
+        entry = [sock, name]
+        self._outputs.insert(index, entry)
+        self._output_names[name] = entry
+        self._ring.add(name)
 
 
     def send(self, msg):
@@ -233,13 +691,111 @@ class Cornerstone(Scaffold):
         if self.monitor_stream:
             self.log.info('o: %s', msg)
 
+        self._route([msg])
+
+
+    def _route(self, frames, copy=True):
+        """
+        Send a message to the output sockets selected by the output_policy.
+        A message is dropped when no output socket is registered, whatever
+        the output_policy, as with a broadcast to no sockets.
+
+        Keyword Arguments:
+        frames - the list of frames of the message.
+        copy - False to send zmq Frame objects without a copy.
+
+        Example Usage:
+        >>> from zmq import PULL, PUSH
+        >>> foo = Cornerstone(argv=['--output_policy', 'hash'])
+        >>> ctx = foo.zmq_ctx
+        >>> pull_socks = []
+        >>> for index in range(3):
+        ...     push_sock = ctx.socket(PUSH)
+        ...     push_sock.bind('inproc://route_%d' % index)
+        ...     foo.add_output_sock(push_sock)
+        ...     pull_sock = ctx.socket(PULL)
+        ...     pull_sock.connect('inproc://route_%d' % index)
+        ...     pull_socks.append(pull_sock)
+        >>> for count in range(2):
+        ...     foo._route(['key-1', str(count)])
+        >>> # both messages of the key are sent to the same socket
+        >>> [sock.recv_multipart() for sock in pull_socks
+        ...  for _ in range(2) if sock.poll(100)]
+        [['key-1', '0'], ['key-1', '1']]
+        >>> for sock in pull_socks + foo.output_socks():
+        ...     sock.close()
+        """
+        outputs = self._outputs
+        if not outputs:
+            return
+
+        if len(outputs) == 1 or self.output_policy == 'broadcast':
+            for entry in outputs:
+                self._send_frames(entry[0], frames, copy)
+            return
+
+        policy = self.output_policy
+        if policy == 'round_robin':
+            index = self._output_turn % len(outputs)
+            self._output_turn = index + 1
+            entry = outputs[index]
+        elif policy == 'hash':
+            if self.output_key is not None:
+                key = self.output_key(frames)
+            else:
+                key = frames[self.hash_frame]
+            entry = self._output_names[self._ring.get(getattr(key, 'bytes',
+                                                              key))]
+        else:
+            entry = self._least_queued()
+
+        self._send_frames(entry[0], frames, copy)
+
+
+    def _least_queued(self):
+        """
+        Select the next output socket, in turn, that is able to queue a
+        message without blocking, which skips the sockets whose peers have
+        fallen behind to their high water mark. When every socket is full,
+        the first socket to become writable is selected, unless no_block_send
+        is enabled, in which case the next socket in turn is selected.
+
+        Return: The output entry of the selected socket.
+        """
+        outputs = self._outputs
+        count = len(outputs)
+        for offset in xrange(1, count + 1):
+            index = (self._output_turn + offset) % count
+            if outputs[index][0].getsockopt(EVENTS) & POLLOUT:
+                self._output_turn = index
+                return outputs[index]
+
+        self._output_turn = (self._output_turn + 1) % count
+        if self.no_block_send:
+            return outputs[self._output_turn]
+
+        poller = Poller()
+        for entry in outputs:
+            poller.register(entry[0], POLLOUT)
+        writable = dict(poller.poll())
+        for entry in outputs:
+            if writable.get(entry[0]) == POLLOUT:
+                return entry
+
+
+    def _send_frames(self, sock, frames, copy=True):
+        """
+        Send the frames of a message to a socket, a message that can not be
+        queued is dropped when no_block_send is enabled.
+        """
         if not self.no_block_send:
-            self._output_sock.send(msg)
+            sock.send_multipart(frames, copy=copy)
         else:
             try:
-                self._output_sock.send(msg, NOBLOCK)
-            except:
-                self.log.error("Unexpected error:", sys.exc_info()[0])
+                sock.send_multipart(frames, NOBLOCK, copy=copy)
+            except ZMQError, ze:
+                self.log.error('Dropped message on send:%d - %s',
+                               ze.errno, ze.strerror)
 
 
     def setRun(self):
@@ -262,33 +818,25 @@ class Cornerstone(Scaffold):
 
         self.log.info('Beginning run() with configuration: %s', self._args)
 
-        #todo: raul - move this section to command configuraiton layer
-        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-        # of course this is when a command configuration layer get's added
-        controller = self.zmq_ctx.socket(SUB)
-        controller.connect('tcp://localhost:7885')
-        controller.setsockopt(SUBSCRIBE, "")
-        self._control_sock = controller
-        self._poll.register(self._control_sock)
-        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+        self._connect_control_sock(self._poll)
+        self._open_wakeup(self._poll)
+        self._start_executor()
 
         loop_count = 0
         input_count = 0
+        timeout = self._poll_timeout()
         while True:
             try:
-                socks = dict(self._poll.poll(timeout=self.heartbeat))
+                socks = dict(self._poll.poll(timeout=timeout))
                 loop_count += 1
                 if self.monitor_stream and (loop_count % 1000) == 0:
                     sys.stdout.write('loop(%s)' % loop_count)
                     sys.stdout.flush()
 
-                if self._input_sock and socks.get(self._input_sock) == POLLIN:
+                if self._inputs:
                     #todo: raul - this whole section needs to be redone,
                     # see additional comment AAA above.
-                    msg = self.input_recv_handler(self._input_sock)
-                    input_count += 1
-                    if self.monitor_stream: # and (input_count % 10) == 0:
-                        self.log.info('i:%s- %s', input_count, msg)
+                    input_count += self._service_inputs(socks, input_count)
 
                 if (self._control_sock and
                     socks.get(self._control_sock) == POLLIN):
@@ -296,10 +844,17 @@ class Cornerstone(Scaffold):
                     if self._command_handler is not None:
                         self._command_handler(msg)
 
+                if socks.get(self._wakeup_fds[0]) == POLLIN:
+                    self._clear_wakeup()
+                    if self._executor is not None:
+                        self._send_results()
+
                 if self._stop:
                     self.log.info('Stop flag triggered ... shutting down.')
                     break
 
+                timeout = self._poll_timeout(active=bool(socks))
+
             except ZMQError, ze:
                 if ze.errno == 4: # Known exception due to keyboard ctrl+c
                     self.log.info('System interrupt call detected.')
@@ -308,20 +863,430 @@ class Cornerstone(Scaffold):
                                    % (ze.errno, ze.strerror))
                     exit(-1)
 
+        # the messages still in the executor at shutdown are dropped
+        self._stop_executor()
+
         # close the sockets held by the poller
-        self._control_sock.close()
-        self.register_input_sock(sock=None)
-        self.register_output_sock(sock=None)
+        self._close_wakeup(self._poll)
+        self._close_control_sock(self._poll)
+        for sock in self.input_socks():
+            self.remove_input_sock(sock)
+        for sock in self.output_socks():
+            self.remove_output_sock(sock)
 
         self.log.info('Run terminated for %s', self.name)
 
 
+    def submit(self, frames, context=None):
+        """
+        Hand the frames of a message to the message_handler, which is run
+        inline or by the executor pool. The result is handed to the
+        result_handler, along with the given context, or routed to the output
+        sockets if no result_handler is assigned. A None result is not sent,
+        nor handed to the result_handler. When the message_handler raises, or
+        returns None, the no_result_handler is handed the context and the
+        error text, or None, if one is assigned. This method must be called
+        from the thread running the Cornerstone loop.
+
+        Keyword Arguments:
+        frames - the list of frames of the message.
+        context - any state of the message that the result_handler requires,
+            such as a routing envelope. The context is not handed to the
+            executor.
+
+        Under the 'keyed' executor order, a message is not handed to the
+        executor while a prior message with the same key is in the executor,
+        so the results of a key are sent in the order of the messages. The
+        handler of a process pool must be picklable, such as a module level
+        function or an instance of a module level class.
+
+        Example Usage:
+        >>> foo = Cornerstone()
+        >>> results = []
+        >>> foo.message_handler = lambda frames: [frame.upper()
+        ...                                       for frame in frames]
+        >>> foo.result_handler = lambda context, result: results.append(
+        ...     (context, result))
+        >>> foo.submit(['ping'], context='client-1')
+        >>> results
+        [('client-1', ['PING'])]
+        >>> foo.no_result_handler = lambda context, error: results.append(
+        ...     (context, error))
+        >>> foo.message_handler = lambda frames: None
+        >>> foo.submit(['ping'], context='client-2')
+        >>> foo.message_handler = lambda frames: frames[1]
+        >>> foo.submit(['ping'], context='client-3')
+        >>> results[1:]
+        [('client-2', None), ('client-3', 'IndexError: list index out of range')]
+        """
+        if self._executor is None:
+            self._complete(context, _call_handler(self.message_handler, frames))
+            return
+
+        key = None
+        if self.executor_order == 'keyed':
+            if self.order_key is not None:
+                key = self.order_key(frames)
+            else:
+                key = frames[self.order_frame]
+            key = getattr(key, 'bytes', key)
+
+        self._inflight += 1
+        if self._inflight >= self.executor_inflight and not self._input_paused:
+            self.pause_input()
+            self._executor_paused = True
+
+        if key is not None:
+            if key in self._keyed:
+                self._keyed[key].append((frames, context))
+                return
+            self._keyed[key] = deque()
+        self._dispatch(key, frames, context)
+
+
+    def _start_executor(self):
+        """
+        Create the executor pool, if one has been configured. The messages of
+        the input sockets that are handled by the default receive handler are
+        submitted to the message_handler, once one has been assigned.
+        """
+        if (self.message_handler is not None and
+            self.input_recv_handler == self._default_recv_handler):
+            self.input_recv_handler = self._submit_recv_handler
+
+        if self.executor == 'none':
+            return
+
+        workers = self.executor_workers or cpu_count()
+        if self.executor_inflight <= 0:
+            self.executor_inflight = 4 * workers
+        pool_class = ThreadPool if self.executor == 'thread' else Pool
+        self._executor = pool_class(workers)
+
+
+    def _stop_executor(self):
+        if self._executor is None:
+            return
+        self._executor.terminate()
+        self._executor.join()
+        self._executor = None
+        self._keyed.clear()
+        self._inflight = 0
+
+
+    def _dispatch(self, key, frames, context):
+        self._executor.apply_async(_call_handler,
+                                   (self.message_handler, frames),
+                                   callback=lambda result:
+                                       self._queue_result(key, context, result))
+
+
+    def _queue_result(self, key, context, result):
+        """
+        Queue the result of an executor worker, to be sent from the run loop.
+        This is invoked on the result thread of the pool.
+        """
+        self._results.put((key, context, result))
+        self._wakeup()
+
+
+    def _send_results(self):
+        """
+        Complete the results of the executor, hand the next message of each
+        completed key to the executor, and resume the polling of the input
+        sockets once the messages in the executor drop below the
+        executor_inflight.
+        """
+        while True:
+            try:
+                key, context, result = self._results.get_nowait()
+            except Queue.Empty:
+                break
+
+            self._inflight -= 1
+            if key is not None:
+                pending = self._keyed[key]
+                if pending:
+                    frames, next_context = pending.popleft()
+                    self._dispatch(key, frames, next_context)
+                else:
+                    del self._keyed[key]
+
+            self._complete(context, result)
+
+        if self._executor_paused and self._inflight < self.executor_inflight:
+            self._executor_paused = False
+            self.resume_input()
+
+
+    def _complete(self, context, result):
+        reply, error = result
+        if error is not None:
+            self.log.error('Message handler failed: %s', error)
+
+        if reply is None:
+            if self.no_result_handler is not None:
+                self.no_result_handler(context, error)
+        elif self.result_handler is not None:
+            self.result_handler(context, reply)
+        else:
+            self._route(reply)
+
+
+    def _submit_recv_handler(self, input_sock):
+        """
+        The receive handler of the input sockets once a message_handler is
+        assigned, which submits each message to the message_handler.
+        """
+        frames = input_sock.recv_multipart()
+        self.submit(frames)
+
+        return frames
+
+
     def kill(self):
         """
         This method will shut down the running loop if run() method has been
         invoked.
         """
         self._stop = True
+        self._wakeup()
+
+
+    def _connect_control_sock(self, poller):
+        """
+        Create the control socket and register it with the given poller.
+
+        Keyword Arguments:
+        poller - the zmq Poller that will watch the control socket.
+        """
+        #todo: raul - move this section to command configuraiton layer
+        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+        # of course this is when a command configuration layer get's added
+        controller = self.zmq_ctx.socket(SUB)
+        controller.connect(self.control_sock_url)
+        controller.setsockopt(SUBSCRIBE, "")
+        self._control_sock = controller
+        poller.register(self._control_sock, POLLIN)
+        # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+
+    def _close_control_sock(self, poller):
+        """
+        Unregister the control socket from the given poller and close it.
+
+        Keyword Arguments:
+        poller - the zmq Poller that is watching the control socket.
+        """
+        if self._control_sock is not None:
+            poller.unregister(self._control_sock)
+            self._control_sock.close()
+            self._control_sock = None
+
+
+    def _open_wakeup(self, poller):
+        """
+        Create the wake up pipe and register the read end with the given
+        poller, so that a poll waiting on a long heartbeat returns as soon as
+        kill() is invoked.
+
+        Keyword Arguments:
+        poller - the zmq Poller that will watch the wake up pipe.
+        """
+        read_fd, write_fd = os.pipe()
+        for fd in (read_fd, write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        poller.register(read_fd, POLLIN)
+        self._wakeup_fds = (read_fd, write_fd)
+
+
+    def _close_wakeup(self, poller):
+        """
+        Unregister the wake up pipe from the given poller and close it.
+
+        Keyword Arguments:
+        poller - the zmq Poller that is watching the wake up pipe.
+        """
+        with self._wakeup_lock:
+            read_fd, write_fd = self._wakeup_fds
+            self._wakeup_fds = None
+        poller.unregister(read_fd)
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+    def _clear_wakeup(self):
+        """
+        Consume the pending wake up notifications from the wake up pipe.
+        """
+        try:
+            os.read(self._wakeup_fds[0], 4096)
+        except OSError, e:
+            if e.errno != EAGAIN:
+                raise
+
+
+    def _wakeup(self):
+        """
+        Interrupt a poll that is in progress. This method is safe to call from
+        any thread and from a signal handler. The lock is never waited upon,
+        as a concurrent holder is either writing a wake up or closing the pipe.
+        """
+        if not self._wakeup_lock.acquire(False):
+            return
+        try:
+            if self._wakeup_fds is not None:
+                os.write(self._wakeup_fds[1], 'w')
+        except OSError, e:
+            if e.errno != EAGAIN: # a full pipe already has a wake up pending
+                raise
+        finally:
+            self._wakeup_lock.release()
+
+
+    def _poll_timeout(self, active=True):
+        """
+        Determine the timeout in milliseconds for the next poll.
+
+        Keyword Arguments:
+        active - True if the previous poll returned any events.
+
+        Return: The poll timeout in milliseconds.
+
+        The heartbeat is used as the timeout, unless the adaptive idle mode
+        has been enabled by a max_heartbeat above the heartbeat. In the
+        adaptive idle mode the timeout will double for each idle poll up to
+        the max_heartbeat, and return to the heartbeat once there is activity.
+
+        The tick handler, when one is assigned, is invoked on each call. A
+        tick handler may return the seconds until it next needs to be invoked,
+        which will cap the timeout, or None to leave the timeout as is.
+
+        Example Usage:
+        >>> foo = Cornerstone(argv=['--heartbeat', '0.5',
+        ...                         '--max_heartbeat', '3'])
+        >>> [foo._poll_timeout(active=False) for _ in range(4)]
+        [1000, 2000, 3000, 3000]
+        >>> foo._poll_timeout(active=True)
+        500
+        >>> foo.tick_handler = lambda: 0.25
+        >>> foo._poll_timeout(active=True)
+        250
+        """
+        if active or self.max_heartbeat <= self.heartbeat:
+            self._idle_heartbeat = self.heartbeat
+        else:
+            self._idle_heartbeat = min(self._idle_heartbeat * 2,
+                                       self.max_heartbeat)
+
+        timeout = int(self._idle_heartbeat * 1000)
+
+        if self.tick_handler is not None:
+            due = self.tick_handler()
+            if due is not None:
+                timeout = min(timeout, max(int(due * 1000), 0))
+
+        return timeout
+
+
+    def _configure_engine(self):
+        """
+        Validate the engine setting of a windmill that supports the 'proxy'
+        engine. When the installed pyzmq does not provide the steerable
+        proxy, the windmill will fall back to the 'poll' engine.
+        """
+        if self.engine == 'proxy' and proxy_steerable is None:
+            self.log.warn('Steerable proxy is not available in pyzmq %s, '
+                          'using the poll engine.', pyzmq_version())
+            self.engine = 'poll'
+
+
+    def _run_proxy(self, frontend, backend):
+        """
+        Run the libzmq steerable proxy between a frontend and backend socket.
+
+        Keyword Arguments:
+        frontend - the socket that the proxy will receive requests upon.
+        backend - the socket that the proxy will forward requests to.
+
+        Return: None
+
+        The socket pair is handed to a background thread that runs
+        zmq.proxy_steerable, so no python code is on the data path. The
+        calling thread services the control socket, in which PAUSE and
+        RESUME commands are passed to the proxy, any other command is given to
+        the command handler. Once the stop flag is set by kill(),
+        the proxy is sent a TERMINATE over an inproc PAIR socket.
+
+        The frontend and backend sockets are not closed, as ownership returns
+        to the calling thread once the proxy has terminated.
+        """
+        self._stop = False
+
+        self.log.info('Beginning proxy run() with configuration: %s',
+                      self._args)
+
+        steer_url = 'inproc://%s-steer-%x' % (self.name, id(self))
+        steer_sock = self.zmq_ctx.socket(PAIR)
+        steer_sock.bind(steer_url)
+
+        proxy_thread = Thread(target=self._proxy_target,
+                              args=(frontend, backend, steer_url))
+        proxy_thread.daemon = True
+        proxy_thread.start()
+
+        poller = Poller()
+        self._connect_control_sock(poller)
+        self._open_wakeup(poller)
+
+        timeout = self._poll_timeout()
+        while not self._stop:
+            try:
+                socks = dict(poller.poll(timeout=timeout))
+
+                if socks.get(self._control_sock) == POLLIN:
+                    msg = self._control_sock.recv()
+                    if msg in ('PAUSE', 'RESUME'):
+                        steer_sock.send(msg)
+                    elif self._command_handler is not None:
+                        self._command_handler(msg)
+
+                if socks.get(self._wakeup_fds[0]) == POLLIN:
+                    self._clear_wakeup()
+
+                timeout = self._poll_timeout(active=bool(socks))
+
+            except ZMQError, ze:
+                if ze.errno == 4: # Known exception due to keyboard ctrl+c
+                    self.log.info('System interrupt call detected.')
+                else: # exit hard on unhandled exceptions
+                    self.log.error('Unhandled exception in run execution:%d - %s'
+                                   % (ze.errno, ze.strerror))
+                    exit(-1)
+
+        self.log.info('Stop flag triggered ... shutting down.')
+        steer_sock.send('TERMINATE')
+        proxy_thread.join()
+        steer_sock.close()
+        self._close_wakeup(poller)
+        self._close_control_sock(poller)
+
+
+    def _proxy_target(self, frontend, backend, steer_url):
+        """
+        The background thread target that runs the steerable proxy until a
+        TERMINATE command is received on the steer_url PAIR socket.
+        """
+        steer_sock = self.zmq_ctx.socket(PAIR)
+        steer_sock.connect(steer_url)
+        try:
+            proxy_steerable(frontend, backend, None, steer_sock)
+        except ZMQError, ze:
+            self.log.error('Proxy terminated on exception:%d - %s',
+                           ze.errno, ze.strerror)
+        finally:
+            steer_sock.close()
 
 
     def _signal_interrupt_handler(self, signum, frame):
@@ -333,23 +1298,210 @@ class Cornerstone(Scaffold):
         self.kill()
 
 
+    def _service_inputs(self, socks, input_count=0):
+        """
+        Drain the readable input sockets in the order of the input_policy.
+
+        Keyword Arguments:
+        socks - the dictionary of socket events returned by the poller.
+        input_count - the number of input messages handled prior to the call.
+
+        Return: The number of messages handled.
+
+        Under the 'fair' and 'weighted' policies each readable socket is
+        drained in turn, and the socket that is drained first rotates with
+        each call, so that no socket is favoured. The 'weighted' policy
+        scales the drain batch of each socket by its weight. Under the
+        'priority' policy the readable sockets are drained from the highest
+        priority, and a lower priority is only drained if the sockets of the
+        higher priorities have no messages left pending.
+
+        Example Usage:
+        >>> from zmq import PULL, PUSH
+        >>> foo = Cornerstone(argv=['--input_policy', 'priority'])
+        >>> ctx = foo.zmq_ctx
+        >>> received = []
+        >>> handler = lambda sock: received.append(sock.recv())
+        >>> for name, priority in [('low', 0), ('high', 1)]:
+        ...     pull_sock = ctx.socket(PULL)
+        ...     pull_sock.bind('inproc://service_%s' % name)
+        ...     foo.add_input_sock(pull_sock, handler, priority=priority)
+        >>> push_socks = []
+        >>> for name in ['low', 'high']:
+        ...     push_sock = ctx.socket(PUSH)
+        ...     push_sock.connect('inproc://service_%s' % name)
+        ...     push_sock.send(name)
+        ...     push_socks.append(push_sock)
+        >>> foo.setRun()
+        >>> while len(received) < 2:
+        ...     count = foo._service_inputs(dict(foo._poll.poll(1000)))
+        >>> received
+        ['high', 'low']
+        >>> for sock in push_socks + foo.input_socks():
+        ...     sock.close()
+        """
+        inputs = self._inputs
+        if self.input_policy != 'priority':
+            self._input_turn = (self._input_turn + 1) % len(inputs)
+            inputs = inputs[self._input_turn:] + inputs[:self._input_turn]
+
+        readable = [entry for entry in inputs
+                    if socks.get(entry[0]) == POLLIN]
+        if not readable:
+            return 0
+
+        count = 0
+        if self.input_policy == 'priority':
+            readable.sort(key=lambda entry: -entry[2])
+            level = readable[0][2]
+            for entry in readable:
+                if entry[2] != level:
+                    # a lower priority waits on any pending higher priority
+                    if any(other[0].getsockopt(EVENTS) & POLLIN
+                           for other in self._inputs if other[2] >= level):
+                        break
+                    level = entry[2]
+                count += self._drain_input(entry[0], input_count + count,
+                                           handler=entry[1])
+                if self._stop or self._input_paused:
+                    break
+            return count
+
+        weighted = self.input_policy == 'weighted'
+        for entry in readable:
+            batch = self.drain_batch * entry[3] if weighted else None
+            count += self._drain_input(entry[0], input_count + count,
+                                       handler=entry[1], batch=batch)
+            if self._stop or self._input_paused:
+                break
+        return count
+
+
+    def _drain_input(self, input_sock, input_count=0, handler=None,
+                     batch=None):
+        """
+        Invoke the input_recv_handler for the messages pending on a given
+        input socket.
+
+        Keyword Arguments:
+        input_sock - the input socket that the poller reported as readable.
+        input_count - the number of input messages handled prior to the call.
+        handler - the receive handler to invoke, input_recv_handler is used
+            if no handler is given.
+        batch - the maximum number of messages to handle, drain_batch is used
+            if no batch is given.
+
+        Return: The number of messages handled.
+
+        The first message is always handled, as the poller has signaled that
+        it is available. Subsequent messages are only handled while the
+        socket reports POLLIN, so the input_recv_handler will never block.
+        Draining stops when drain_batch messages have been handled,
+        the drain_budget has expired, the input has been paused or the stop
+        flag has been set.
+
+        Example Usage:
+        >>> from zmq import PULL, PUSH
+        >>> foo = Cornerstone(argv=['--drain_batch', '3'])
+        >>> ctx = foo.zmq_ctx
+        >>> pull_sock = ctx.socket(PULL)
+        >>> pull_sock.bind('inproc://drain_input')
+        >>> push_sock = ctx.socket(PUSH)
+        >>> push_sock.connect('inproc://drain_input')
+        >>> for msg in ['a', 'b', 'c', 'd']:
+        ...     push_sock.send(msg)
+        >>> foo.input_recv_handler = lambda sock: sock.recv()
+        >>> foo.setRun()
+        >>> foo._drain_input(pull_sock)
+        3
+        >>> foo._drain_input(pull_sock)
+        1
+        >>> push_sock.close()
+        >>> pull_sock.close()
+        """
+        deadline = None
+        if self.drain_budget > 0:
+            deadline = time.time() + (self.drain_budget / 1000.0)
+
+        if handler is None:
+            handler = self.input_recv_handler
+        if batch is None:
+            batch = self.drain_batch
+
+        count = 0
+        while True:
+            msg = handler(input_sock)
+            count += 1
+            if self.monitor_stream: # and (input_count % 10) == 0:
+                self.log.info('i:%s- %s', input_count + count, msg)
+
+            if count >= batch or self._stop or self._input_paused:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+            if not input_sock.getsockopt(EVENTS) & POLLIN:
+                break
+
+        return count
+
+
     def _default_recv_handler(self, input_sock):
         """
         This is the default receiving handler for requests comming in on an
         input socket. The default handler simply takes incoming messages and
         passes them to the registed output socket.
 
-        Return: msg -- The message that is returned from invocation of the
-        recv on the input socket.
+        Return: frames -- The list of message frames that is returned from
+        invocation of the recv_multipart on the input socket.
+
+        All the frames of a multipart message are forwarded together. When
+        zero_copy is enabled, the frames are received and sent as zmq Frame
+        objects, so the payload is never copied into a python string. As the
+        size of a message is unknown prior to the recv, a copy_threshold
+        uses the size of the previous message to select the copying path for
+        the next message, which is faster for a stream of tiny messages.
+
+        Example Usage:
+        >>> from zmq import PULL, PUSH
+        >>> foo = Cornerstone(argv=['--zero_copy', '--copy_threshold', '8'])
+        >>> ctx = foo.zmq_ctx
+        >>> in_sock = ctx.socket(PULL)
+        >>> in_sock.bind('inproc://default_recv_in')
+        >>> out_sock = ctx.socket(PUSH)
+        >>> out_sock.bind('inproc://default_recv_out')
+        >>> foo.register_output_sock(out_sock)
+        >>> push_sock = ctx.socket(PUSH)
+        >>> push_sock.connect('inproc://default_recv_in')
+        >>> pull_sock = ctx.socket(PULL)
+        >>> pull_sock.connect('inproc://default_recv_out')
+        >>> push_sock.send_multipart(['key', 'a larger payload'])
+        >>> frames = foo._default_recv_handler(in_sock)
+        >>> pull_sock.recv_multipart()
+        ['key', 'a larger payload']
+        >>> foo._forward_copy
+        False
+        >>> push_sock.send('tiny')
+        >>> frames = foo._default_recv_handler(in_sock)
+        >>> pull_sock.recv_multipart()
+        ['tiny']
+        >>> foo._forward_copy
+        True
+        >>> for sock in [push_sock, pull_sock, in_sock]:
+        ...     sock.close()
+        >>> foo.register_output_sock(None)
         """
-        msg = input_sock.recv()
-        more = input_sock.getsockopt(RCVMORE)
-        if more:
-            self._output_sock.send(msg, SNDMORE)
-        else:
-            self._output_sock.send(msg)
+        copy = self._forward_copy
+        frames = input_sock.recv_multipart(copy=copy)
+
+        if self.zero_copy and self.copy_threshold > 0:
+            size = 0
+            for frame in frames:
+                size += len(frame)
+            self._forward_copy = size < self.copy_threshold
 
-        return msg
+        self._route(frames, copy=copy)
+
+        return frames
 
 
     def _default_command_handler(self, msg):
@@ -358,3 +1510,19 @@ class Cornerstone(Scaffold):
         invokes a kill flag for any message received.
         """
         self.kill()
+
+
+def _call_handler(handler, frames):
+    """
+    Invoke a message handler, returning an error rather than raising it, as a
+    failed task of a pool would never invoke the pool callback.
+
+    >>> _call_handler(lambda frames: frames[::-1], ['a', 'b'])
+    (['b', 'a'], None)
+    >>> _call_handler(lambda frames: frames[2], ['a', 'b'])
+    (None, 'IndexError: list index out of range')
+    """
+    try:
+        return handler(frames), None
+    except Exception, e:
+        return None, '%s: %s' % (e.__class__.__name__, e)
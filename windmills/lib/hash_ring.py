@@ -0,0 +1,94 @@
+"""HashRing is a consistent hash ring, for the key affine sharding of messages
+across a set of output sockets.
+"""
+from bisect import bisect
+from hashlib import md5
+import struct
+
+
+__author__ = 'neoinsanity'
+__all__ = ['HashRing']
+
+
+class HashRing(object):
+    """
+    HashRing maps keys to nodes, such that a key maps to the same node for as
+    long as the node is on the ring, and the addition or removal of a node
+    only remaps the keys of about one node's share of the ring.
+
+    Each node is placed on the ring at a number of replica points, which
+    evens out the share of the keys that each node receives.
+
+    Example Usage:
+    >>> ring = HashRing(['a', 'b', 'c'])
+    >>> keys = ['key-%d' % i for i in range(1000)]
+    >>> before = dict((key, ring.get(key)) for key in keys)
+    >>> sorted(set(before.values()))
+    ['a', 'b', 'c']
+    >>> ring.remove('c')
+    >>> moved = [key for key in keys if ring.get(key) != before[key]]
+    >>> all(before[key] == 'c' for key in moved)
+    True
+    >>> len(ring)
+    2
+    """
+    POINT = struct.Struct('!Q')
+
+
+    def __init__(self, nodes=None, replicas=100):
+        assert replicas > 0
+
+        self.replicas = replicas
+        self._nodes = set()
+        self._points = list() # sorted ring points
+        self._owners = list() # the node of each ring point
+
+        for node in nodes or list():
+            self.add(node)
+
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+    def add(self, node):
+        """
+        Place a node on the ring. The node must be a string.
+        """
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        self._build()
+
+
+    def remove(self, node):
+        """
+        Take a node off the ring, the keys of the node are spread across the
+        remaining nodes.
+        """
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._build()
+
+
+    def get(self, key):
+        """
+        Return: The node for a string key, or None if the ring is empty.
+        """
+        if not self._points:
+            return None
+        index = bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+    def _build(self):
+        ring = sorted((self._hash('%s-%d' % (node, replica)), node)
+                      for node in self._nodes
+                      for replica in xrange(self.replicas))
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+
+    def _hash(self, key):
+        return self.POINT.unpack_from(md5(key).digest())[0]
@@ -0,0 +1,146 @@
+"""ReplyCache is a bounded cache of the replies to requests, for the request
+handlers of request/reply windmills.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+__author__ = 'neoinsanity'
+__all__ = ['ReplyCache']
+
+
+class ReplyCache(object):
+    """
+    ReplyCache holds the reply frames of requests, keyed on the request
+    frames or on the result of a given key function of the request frames.
+
+    A key function may return any hashable value. A string key is sized by
+    its length, a tuple or list key by the sum of the sizes of its items, and
+    any other key by the length of its repr().
+
+    The cache is bounded by the bytes of the keys and replies it holds, and
+    optionally by a number of entries. The least recently used entries are
+    evicted to make room. An entry may also be given a time to live, after
+    which it is a miss. The hits, misses and evictions are counted.
+
+    ReplyCache is safe for use from multiple threads.
+
+    Example Usage:
+    >>> now = [0.0]
+    >>> cache = ReplyCache(max_bytes=24, ttl=10, clock=lambda: now[0])
+    >>> cache.put(['ping'], ['pong'])
+    >>> cache.put(['hello'], ['world'])
+    >>> cache.get(['ping'])
+    ['pong']
+    >>> cache.put(['marco'], ['polo'])
+    >>> cache.get(['hello']) is None # evicted as least recently used
+    True
+    >>> now[0] = 11.0
+    >>> cache.get(['ping']) is None # expired
+    True
+    >>> sorted(cache.stats().items())
+    [('bytes', 9), ('entries', 1), ('evictions', 1), ('hits', 1), ('misses', 2)]
+    >>> cache = ReplyCache(max_bytes=24, key=lambda request: (len(request), 7))
+    >>> cache.put(['ping'], ['pong'])
+    >>> cache.get(['pong'])
+    ['pong']
+    >>> cache.stats()['bytes'] # the key (1, 7) is sized as 2 bytes
+    6
+    """
+
+
+    def __init__(self,
+                 max_bytes=None,
+                 max_entries=0,
+                 ttl=0,
+                 key=None,
+                 clock=time.time):
+        assert max_bytes > 0
+
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl # seconds, 0 for no expiry
+        self.key = key if key is not None else tuple
+        self._clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict() # key -> (reply, size, expires)
+        self._bytes = 0
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, request):
+        """
+        Return: The cached reply frames of the request, or None on a miss.
+        """
+        key = self.key(request)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[2] and entry[2] <= self._clock():
+                self._bytes -= entry[1]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # reinsert the entry as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+
+    def put(self, request, reply):
+        """
+        Cache the reply frames of a request. A reply that would not fit in
+        the cache on its own is not cached.
+        """
+        key = self.key(request)
+        size = _size(key) + _size(reply)
+        if size > self.max_bytes:
+            return
+
+        expires = self._clock() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+
+            self._entries[key] = (reply, size, expires)
+            self._bytes += size
+
+            while (self._bytes > self.max_bytes or
+                   0 < self.max_entries < len(self._entries)):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[1]
+                self.evictions += 1
+
+
+    def stats(self):
+        """
+        Return: A dictionary of the hits, misses, evictions, entries and bytes
+        of the cache.
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes}
+
+
+def _size(value):
+    value = getattr(value, 'bytes', value) # a zmq Frame
+    if isinstance(value, (basestring, buffer)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_size(item) for item in value)
+    return len(repr(value))
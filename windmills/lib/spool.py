@@ -0,0 +1,367 @@
+"""Spool is a durable, append-only log of pending work entries, with retry
+scheduling by exponential backoff.
+"""
+from heapq import heapify, heappop, heappush
+from threading import Lock
+import mmap
+import os
+import re
+import struct
+import time
+
+
+__author__ = 'neoinsanity'
+__all__ = ['Spool']
+
+
+class Spool(object):
+    """
+    Spool persists work entries in a directory of memory mapped segment files,
+    so that pending and failed entries survive a restart.
+
+    Each segment is an append-only log of records. A record holds either the
+    current state of an entry, its payload along with the attempt count and
+    the time of the next attempt, or the completion of an entry. A retry of an
+    entry appends a new state record to the active segment, which makes the
+    prior record obsolete. Segments are removed from the oldest once none of
+    their records hold the current state of an entry.
+
+    Records are written to the page cache through the mapping, so the spool
+    survives a crash of the process. flush() will sync the active segment to
+    disk for durability across a crash of the host.
+
+    The spool keeps an index of the record offsets of the pending entries,
+    the payloads are only read from the mapping when an entry is due. A heap
+    of the (due, entry id) of the entries that are not in flight orders the
+    entries by due time, an item of the heap that no longer matches its entry
+    is discarded when it reaches the top. An entry handed out by due() is in
+    flight, and is not due again until it is either rescheduled by fail() or
+    completed by done().
+
+    Spool is safe for use from multiple threads.
+
+    Example Usage:
+    >>> import shutil, tempfile
+    >>> spool_dir = tempfile.mkdtemp()
+    >>> spool = Spool(spool_dir, base_delay=0)
+    >>> first = spool.append('first')
+    >>> second = spool.append('second', in_flight=True)
+    >>> spool.due()
+    [(1, 'first')]
+    >>> spool.due()
+    []
+    >>> spool.done(first)
+    >>> spool.fail(second)
+    True
+    >>> spool.close()
+    >>> spool = Spool(spool_dir)
+    >>> spool.due()
+    [(2, 'second')]
+    >>> len(spool)
+    1
+    >>> spool.close()
+    >>> shutil.rmtree(spool_dir)
+    """
+    HEADER = struct.Struct('!BQdII') # kind, entry id, due, attempts, length
+    STATE = 1
+    DONE = 2
+    SEGMENT_NAME = re.compile(r'^spool-(\d{8})\.log$')
+
+
+    def __init__(self,
+                 spool_dir=None,
+                 segment_size=16 * 1024 * 1024,
+                 base_delay=1,
+                 max_delay=300,
+                 max_attempts=10):
+        assert spool_dir
+        assert segment_size > self.HEADER.size
+
+        self.spool_dir = spool_dir
+        self.segment_size = segment_size
+        self.base_delay = base_delay # seconds
+        self.max_delay = max_delay # seconds
+        self.max_attempts = max_attempts
+
+        self._lock = Lock()
+        self._segments = dict() # segment number -> [file, mmap, live count]
+        self._active = None
+        self._offset = 0
+        self._entries = dict() # entry id -> [segment, offset, due, attempts]
+        self._heap = list() # (due, entry id) of the entries not in flight
+        self._in_flight = set()
+        self._next_id = 1
+
+        if not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+
+        self._load()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def append(self, payload, in_flight=False):
+        """
+        Add a new entry to the spool, which is due immediately.
+
+        Keyword Arguments:
+        payload - the string payload of the entry.
+        in_flight - True if the entry is already being attempted, in which
+            case it will only become due once fail() is called for it.
+
+        Return: The id of the entry.
+        """
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            now = time.time()
+            self._write_state(entry_id, now, 0, payload)
+            if in_flight:
+                self._in_flight.add(entry_id)
+            else:
+                heappush(self._heap, (now, entry_id))
+            return entry_id
+
+
+    def due(self, now=None, limit=100):
+        """
+        Take the entries whose next attempt is due, which are then in flight.
+
+        Keyword Arguments:
+        now - the time to compare against, the current time by default.
+        limit - the maximum number of entries to return.
+
+        Return: A list of (entry id, payload) tuples, in due time order.
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            heap = self._heap
+            batch = list()
+            while heap and heap[0][0] <= now and len(batch) < limit:
+                due, entry_id = heappop(heap)
+                if self._stale(due, entry_id):
+                    continue
+                self._in_flight.add(entry_id)
+                batch.append((entry_id, self._read_payload(entry_id)))
+            return batch
+
+
+    def next_due(self):
+        """
+        Return: The time of the earliest attempt of an entry that is not in
+        flight, or None if there are no such entries.
+        """
+        with self._lock:
+            heap = self._heap
+            while heap and self._stale(*heap[0]):
+                heappop(heap)
+            return heap[0][0] if heap else None
+
+
+    def done(self, entry_id):
+        """
+        Remove an entry from the spool once it has been completed.
+        """
+        with self._lock:
+            self._in_flight.discard(entry_id)
+            if entry_id in self._entries:
+                self._write(self.DONE, entry_id, 0, 0, '')
+                self._release(entry_id)
+
+
+    def fail(self, entry_id):
+        """
+        Reschedule a failed entry with an exponential backoff.
+
+        Return: True if the entry was rescheduled, or False if the entry has
+        used up the max_attempts and was removed from the spool.
+        """
+        with self._lock:
+            self._in_flight.discard(entry_id)
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return False
+
+            attempts = entry[3] + 1
+            if attempts >= self.max_attempts:
+                self._write(self.DONE, entry_id, 0, 0, '')
+                self._release(entry_id)
+                return False
+
+            delay = min(self.base_delay * (2 ** (attempts - 1)),
+                        self.max_delay)
+            due = time.time() + delay
+            payload = self._read_payload(entry_id)
+            self._write_state(entry_id, due, attempts, payload)
+            heappush(self._heap, (due, entry_id))
+            return True
+
+
+    def flush(self):
+        """
+        Sync the active segment to disk.
+        """
+        with self._lock:
+            if self._active is not None:
+                self._segments[self._active][1].flush()
+
+
+    def close(self):
+        with self._lock:
+            for segment in sorted(self._segments):
+                f, mapping, _ = self._segments[segment]
+                mapping.flush()
+                mapping.close()
+                f.close()
+            self._segments = dict()
+            self._active = None
+
+
+    def _load(self):
+        """
+        Rebuild the entry index from the segments in the spool directory.
+        """
+        segments = sorted(int(match.group(1))
+                          for match in map(self.SEGMENT_NAME.match,
+                                           os.listdir(self.spool_dir))
+                          if match)
+
+        for segment in segments:
+            f, mapping = self._map(segment)
+            self._segments[segment] = [f, mapping, 0]
+            self._active = segment
+            self._offset = self._scan(segment, mapping)
+
+        self._trim()
+
+        self._heap = [(entry[2], entry_id)
+                      for entry_id, entry in self._entries.iteritems()]
+        heapify(self._heap)
+
+        if self._active is None:
+            self._roll(self.HEADER.size)
+
+
+    def _scan(self, segment, mapping):
+        """
+        Index the records of a segment.
+
+        Return: The offset of the end of the records.
+        """
+        header = self.HEADER
+        offset = 0
+        while offset + header.size <= len(mapping):
+            kind, entry_id, due, attempts, length = header.unpack_from(
+                mapping, offset)
+            if kind not in (self.STATE, self.DONE):
+                break # the remainder of the segment is unused
+
+            self._next_id = max(self._next_id, entry_id + 1)
+            if entry_id in self._entries:
+                self._release(entry_id, trim=False)
+            if kind == self.STATE:
+                self._entries[entry_id] = [segment, offset, due, attempts]
+                self._segments[segment][2] += 1
+
+            offset += header.size + length
+
+        return offset
+
+
+    def _map(self, segment, size=None):
+        path = os.path.join(self.spool_dir, 'spool-%08d.log' % segment)
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        f = open(path, 'r+b')
+        return f, mmap.mmap(f.fileno(), 0)
+
+
+    def _roll(self, needed):
+        """
+        Start a new active segment with space for at least the needed bytes.
+        """
+        segment = 1 if self._active is None else self._active + 1
+        f, mapping = self._map(segment, max(self.segment_size, needed))
+        self._segments[segment] = [f, mapping, 0]
+        self._active = segment
+        self._offset = 0
+        self._trim()
+
+
+    def _write_state(self, entry_id, due, attempts, payload):
+        if entry_id in self._entries:
+            self._release(entry_id, trim=False)
+        offset = self._write(self.STATE, entry_id, due, attempts, payload)
+        self._entries[entry_id] = [self._active, offset, due, attempts]
+        self._segments[self._active][2] += 1
+        self._trim()
+
+
+    def _write(self, kind, entry_id, due, attempts, payload):
+        """
+        Append a record to the active segment. The kind is written last, so a
+        partially written record marks the end of the segment.
+
+        Return: The offset of the record.
+        """
+        header = self.HEADER
+        needed = header.size + len(payload)
+        if self._offset + needed > len(self._segments[self._active][1]):
+            self._roll(needed)
+
+        mapping = self._segments[self._active][1]
+        offset = self._offset
+        start = offset + header.size
+        mapping[start:start + len(payload)] = payload
+        mapping[offset:start] = header.pack(0, entry_id, due, attempts,
+                                            len(payload))
+        mapping[offset] = chr(kind)
+
+        self._offset = start + len(payload)
+        return offset
+
+
+    def _stale(self, due, entry_id):
+        """
+        Return: True if an item of the heap is of an entry that has since
+        been completed, rescheduled or handed out.
+        """
+        entry = self._entries.get(entry_id)
+        return (entry is None or entry[2] != due or
+                entry_id in self._in_flight)
+
+
+    def _read_payload(self, entry_id):
+        segment, offset, _, _ = self._entries[entry_id]
+        mapping = self._segments[segment][1]
+        length = self.HEADER.unpack_from(mapping, offset)[4]
+        start = offset + self.HEADER.size
+        return mapping[start:start + length]
+
+
+    def _release(self, entry_id, trim=True):
+        entry = self._entries.pop(entry_id)
+        self._segments[entry[0]][2] -= 1
+        if trim:
+            self._trim()
+
+
+    def _trim(self):
+        """
+        Remove the oldest segments that no longer hold a current record. Only
+        the oldest are removed, so that a completion record is never removed
+        before the state record that it completes.
+        """
+        for segment in sorted(self._segments):
+            f, mapping, live = self._segments[segment]
+            if live > 0 or segment == self._active:
+                break
+            mapping.close()
+            f.close()
+            os.remove(os.path.join(self.spool_dir, 'spool-%08d.log' % segment))
+            del self._segments[segment]
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from lib import Scaffold
+from lib import Cornerstone
 import sys
 from zmq import  PUB, SUB, SUBSCRIBE
 
@@ -10,7 +10,7 @@ __all__ = ['ProxyWindmill']
 # proxy-windmill
 #
 
-class ProxyWindmill(Scaffold):
+class ProxyWindmill(Cornerstone):
     """
     >>> from threading import Thread
     >>> import time
@@ -33,8 +33,9 @@ class ProxyWindmill(Scaffold):
         self.input_sock_url = 'tcp://localhost:6667'
         self.input_sock_filter = ''
         self.output_sock_url = 'tcp://*:6668'
+        self.engine = 'poll'
 
-        Scaffold.__init__(self, **kwargs)
+        Cornerstone.__init__(self, **kwargs)
 
 
     def configuration_options(self, arg_parser=None):
@@ -51,6 +52,13 @@ class ProxyWindmill(Scaffold):
                                 default=self.output_sock_url,
                                 help='The url that the proxy will publish '
                                      'messages upon.')
+        arg_parser.add_argument('--engine',
+                                default=self.engine,
+                                choices=['poll', 'proxy'],
+                                help='The forwarding engine. The poll engine '
+                                     'forwards through the Cornerstone loop, '
+                                     'the proxy engine hands the sockets to '
+                                     'the libzmq steerable proxy.')
 
 
     def configure(self, args=None):
@@ -65,9 +73,23 @@ class ProxyWindmill(Scaffold):
         sub_socket.bind(self.output_sock_url)
         self.register_output_sock(sub_socket)
 
+        self._configure_engine()
+
         self.log.info('ProxyWindmill configured...')
 
 
+    def run(self):
+        if self.engine != 'proxy':
+            Cornerstone.run(self)
+            return
+
+        self._run_proxy(self._input_sock, self._output_sock)
+
+        self.register_input_sock(sock=None)
+        self.register_output_sock(sock=None)
+        self.log.info('Run terminated for %s', self.name)
+
+
 if __name__ == "__main__":
     argv = sys.argv
     proxy_windmill = ProxyWindmill(argv=argv)
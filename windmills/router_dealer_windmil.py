@@ -1,7 +1,7 @@
 #!/usr/bin/env python
-from lib import Scaffold
+from lib import Cornerstone
 import sys
-from zmq import DEALER, POLLIN, RCVMORE, ROUTER, SNDMORE, ZMQError
+from zmq import DEALER, POLLIN, ROUTER, ZMQError
 
 
 __author__ = 'neoinsanity'
@@ -10,9 +10,12 @@ __all__ = ['RouterDealerWindmill']
 # req-rep-broker-windmill
 #
 
-class RouterDealerWindmill(Scaffold):
+class RouterDealerWindmill(Cornerstone):
     """
-
+    RouterDealerWindmill is a request/reply broker. Requests from REQ
+    clients connected to the router socket are fair queued to the REP or
+    DEALER workers connected to the dealer socket, and the replies are routed
+    back to the requesting client.
     """
 
 
@@ -21,10 +24,12 @@ class RouterDealerWindmill(Scaffold):
         self.router_sock_url = 'tcp://*:8888'
         self.dealer_sock_url = 'tcp://*:8889'
 
+        self.engine = 'poll'
+
         self._router_sock = None
         self._dealer_sock = None
 
-        Scaffold.__init__(self, **kwargs)
+        Cornerstone.__init__(self, **kwargs)
 
 
     def configuration_options(self, arg_parser=None):
@@ -36,6 +41,13 @@ class RouterDealerWindmill(Scaffold):
         arg_parser.add_argument('--dealer_sock_url',
                                 default=self.dealer_sock_url,
                                 help='Set the url address for dealer')
+        arg_parser.add_argument('--engine',
+                                default=self.engine,
+                                choices=['poll', 'proxy'],
+                                help='The brokering engine. The poll engine '
+                                     'shuttles frames in python, the proxy '
+                                     'engine hands the sockets to the libzmq '
+                                     'steerable proxy.')
 
 
     def configure(self, args=None):
@@ -49,46 +61,62 @@ class RouterDealerWindmill(Scaffold):
         dealer_sock.bind(self.dealer_sock_url)
         self._dealer_sock = dealer_sock
 
+        self._configure_engine()
+
         self.log.info('Configured Router Dealer Windmill ...')
 
 
     def run(self):
+        if self.engine == 'proxy':
+            self._run_proxy(self._router_sock, self._dealer_sock)
+            self._router_sock.close()
+            self._dealer_sock.close()
+            self.log.info('Run terminated for %s', self.name)
+            return
+
         self._stop = False
 
-        self.log.info('Beginning run with state: %s', str(self))
+        self.log.info('Beginning run() with configuration: %s', self._args)
+
+        self._poll.register(self._router_sock, POLLIN)
+        self._poll.register(self._dealer_sock, POLLIN)
+        self._connect_control_sock(self._poll)
+        self._open_wakeup(self._poll)
 
         loop_count = 0
-        front_end_loop = 0
-        back_end_loop = 0
-        while(not self._stop):
+        front_end_count = 0
+        back_end_count = 0
+        timeout = self._poll_timeout()
+        while True:
             try:
-                socks = dict(self._poll.poll(timeout=self.heartbeat))
+                socks = dict(self._poll.poll(timeout=timeout))
                 loop_count += 1
                 if self.monitor_stream and (loop_count % 1000) == 0:
                     self.log.info('loop(%s)', loop_count)
 
                 if socks.get(self._router_sock) == POLLIN:
-                    msg = self._router_sock.recv()
-                    more = self._router_sock.getsockopt(RCVMORE)
-                    if more:
-                        self._dealer_sock.send(msg, more)
-                    else:
-                        self._dealer_sock.send(msg)
-                    if self.monitor_stream:
-                        front_end_loop += 1
-                        if(front_end_loop % 10) == 0:
-                            self.log.info('d:%s-%s', front_end_loop, msg)
+                    front_end_count += self._drain_input(
+                        self._router_sock, front_end_count,
+                        handler=self._router_recv_handler)
 
                 if socks.get(self._dealer_sock) == POLLIN:
-                    msg = self._dealer_sock.recv()
-                    more = self._dealer_sock.getsockopt(RCVMORE)
-                    if more:
-                        self._router_sock.send(msg, SNDMORE)
-                    else:
-                        self._router_sock.send(msg)
-                    if self.monitor_stream:
-                        back_end_loop += 1
-                        self.log.info('r:%s-%s', back_end_loop, msg)
+                    back_end_count += self._drain_input(
+                        self._dealer_sock, back_end_count,
+                        handler=self._dealer_recv_handler)
+
+                if socks.get(self._control_sock) == POLLIN:
+                    msg = self._control_sock.recv()
+                    if self._command_handler is not None:
+                        self._command_handler(msg)
+
+                if socks.get(self._wakeup_fds[0]) == POLLIN:
+                    self._clear_wakeup()
+
+                if self._stop:
+                    self.log.info('Stop flag triggered ... shutting down.')
+                    break
+
+                timeout = self._poll_timeout(active=bool(socks))
 
             except ZMQError, ze:
                 if ze.errno == 4: # known exception due to keyboard ctrl+c
@@ -96,6 +124,39 @@ class RouterDealerWindmill(Scaffold):
                 else: # exit hard on unhandled exception
                     self.log.error('Unhandled exception in run exectuion:%d - %s',
                                    ze.errno, ze.strerror)
+                    exit(-1)
+
+        self._close_wakeup(self._poll)
+        self._close_control_sock(self._poll)
+        self._poll.unregister(self._router_sock)
+        self._poll.unregister(self._dealer_sock)
+        self._router_sock.close()
+        self._dealer_sock.close()
+
+        self.log.info('Run terminated for %s', self.name)
+
+
+    def _router_recv_handler(self, router_sock):
+        """
+        Forward a request from the router socket to the dealer socket. The
+        identity envelope frames added by the router are preserved, so the
+        reply can be routed back to the requesting client.
+        """
+        frames = router_sock.recv_multipart(copy=False)
+        self._dealer_sock.send_multipart(frames, copy=False)
+
+        return frames
+
+
+    def _dealer_recv_handler(self, dealer_sock):
+        """
+        Forward a reply from the dealer socket to the router socket, where the
+        leading envelope frames select the client to receive the reply.
+        """
+        frames = dealer_sock.recv_multipart(copy=False)
+        self._router_sock.send_multipart(frames, copy=False)
+
+        return frames
 
 
 if __name__ == '__main__':